@@ -0,0 +1,5 @@
+"""
+Offline benchmarks over synthetic images. Run each module with `python -m benchmarks.<module>`.
+  `python -m benchmarks.suite` runs the whole suite and writes its results as JSON, so they
+  can be compared between commits (with --compare).
+"""
@@ -0,0 +1,39 @@
+from __future__ import print_function
+import argparse
+from colormap import spaces, mappers
+from colormap.types import IN
+from colormap.sources import hsv, rgb
+from .common import synthetic_image, best_of
+
+
+def chained_mapper(entries, actions):
+    """
+    Creates a mapper whose entries split the hue circle, each one having a chain of rgb actions.
+    """
+
+    mapper = mappers.Mapper()
+    width = 1.0 / entries
+    for index in range(entries):
+        entry = mapper.on(hsv.h_is(IN(index * width, (index + 1) * width, False, True)), spaces.hsv)
+        for _ in range(actions):
+            entry.do(rgb.mul(spaces.rgb.B, 0.9), spaces.rgb)
+    return mapper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Masked gather/scatter cost of chained actions in Mapper.run')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--entries', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size))
+    print('%8s %10s %16s' % ('actions', 'seconds', 'ms per action'))
+    for actions in (1, 4, 16):
+        mapper = chained_mapper(args.entries, actions)
+        seconds = best_of(lambda: mapper.run(image, True, dedup=False), args.repeat)
+        print('%8d %10.3f %16.2f' % (actions, seconds, seconds * 1e3 / (actions * args.entries)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import time
+import numpy
+from colormap import spaces, mappers
+from colormap.types import IN
+
+
+def synthetic_image(size, channels=4, distribution='uniform', seed=0):
+    """
+    Creates a normalized (0..1-valued) synthetic image.
+    :param size: A (rows, columns) pair.
+    :param channels: 3 (RGB) or 4 (RGBA).
+    :param distribution: 'uniform' for random noise, 'palette' for a few hundred
+      distinct colours (sprite-like), or 'gradient' for a smooth hue sweep.
+    :param seed: The random seed.
+    :return:
+    """
+
+    random = numpy.random.RandomState(seed)
+    rows, cols = size
+    if distribution == 'uniform':
+        return random.rand(rows, cols, channels)
+    elif distribution == 'palette':
+        palette = random.randint(0, 256, (256, channels)) / 255.0
+        return palette[random.randint(0, len(palette), (rows, cols))]
+    elif distribution == 'gradient':
+        image = numpy.empty((rows, cols, channels))
+        image[:, :, 0] = numpy.linspace(0, 1, cols)[numpy.newaxis, :]
+        image[:, :, 1] = numpy.linspace(0, 1, rows)[:, numpy.newaxis]
+        image[:, :, 2:] = 0.5
+        return image
+    raise ValueError("distribution must be 'uniform', 'palette', or 'gradient'")
+
+
+def sample_mapper(entries):
+    """
+    Creates a mapper with the given amount of hue-keyed entries, like the ones in
+      sample_colormap.py.
+    :param entries:
+    :return:
+    """
+
+    # Expressions are imported here, so the benchmarks not building them load without cantrips.
+    from colormap.sources import hsv, rgb
+    mapper = mappers.Mapper()
+    width = 1.0 / entries
+    for index in range(entries):
+        mapper.on(hsv.h_is(IN(index * width, (index + 1) * width, False, True)), spaces.hsv).do(
+            rgb.mul(spaces.rgb.B, 0.5), spaces.rgb
+        )
+    return mapper
+
+
+def best_of(func, repeat=3):
+    """
+    Runs a function several times and returns the best wall time, in seconds.
+    :param func:
+    :param repeat:
+    :return:
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,41 @@
+from __future__ import print_function
+import argparse
+from cantrips.watch.scope import Scope
+from colormap import spaces
+from colormap.compiler import compile_expression
+from colormap.types import IN
+from colormap.sources import hsv
+from .common import synthetic_image, best_of
+
+
+def interpreted(expr, components):
+    """
+    Evaluates the expression the way cantrips does: through a fresh Scope on each call.
+    """
+
+    def evaluate(wrapper):
+        scope = Scope()
+        setattr(scope, components, wrapper)
+        return scope['$eval'](expr)
+    return evaluate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Interpreted vs compiled masker expressions')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    expr = hsv.h_is(IN(0, 3. / 180.0)) | hsv.h_is(IN(177.0 / 180.0, 1))
+    functions = [('interpreted', interpreted(expr, 'hsv')), ('compiled', compile_expression(expr, 'hsv'))]
+    print('%-10s %-12s %14s' % ('chunk', 'mode', 'us per call'))
+    for size in (4, 16, 64, 512):
+        wrapper = spaces.hsv.encoder(synthetic_image((size, size)))
+        calls = max(1, args.calls // (size * size // 16 or 1))
+        for mode, function in functions:
+            seconds = best_of(lambda: [function(wrapper) for _ in range(calls)], args.repeat)
+            print('%-10s %-12s %14.2f' % ('%dx%d' % (size, size), mode, seconds * 1e6 / calls))
+
+
+if __name__ == '__main__':
+    main()
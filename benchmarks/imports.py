@@ -0,0 +1,62 @@
+from __future__ import print_function
+import argparse
+import json
+import subprocess
+import sys
+
+
+MODULES = ('numpy', 'colormap.types', 'colormap.spaces', 'colormap.utils', 'colormap.sources', 'colormap.mappers',
+           'colormap.files', 'colormap.luts', 'common.lang', 'common.require', 'common.proxy')
+
+# Modules whose loading is reported (they should only load when actually needed).
+HEAVY = ('skimage', 'scipy', 'cantrips.watch.expression', 'multiprocessing.pool', 'ply.yacc', 'colormap.kernels')
+
+_PROBE = """
+import json, sys, time
+start = time.time()
+import %s
+seconds = time.time() - start
+print(json.dumps({'seconds': seconds, 'modules': len(sys.modules),
+                  'loaded': [name for name in %r if sys.modules.get(name) is not None]}))
+"""
+
+
+def measure(module, repeat=5):
+    """
+    Measures the cold import of a module: each run is a new interpreter (so nothing is
+      imported yet, but the OS file cache is warm), and the best run is kept.
+    :param module: The module name.
+    :param repeat: The amount of interpreters to run.
+    :return: A dictionary with the seconds, the amount of modules loaded by then, and which
+      of the HEAVY modules were loaded.
+    """
+
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _PROBE % (module, HEAVY)])
+        result = json.loads(output.decode())
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold import time of colormap and common modules')
+    parser.add_argument('--modules', nargs='+', default=list(MODULES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='the JSON file to write the results into')
+    args = parser.parse_args(argv)
+
+    results = {}
+    print('%-20s %10s %8s  %s' % ('module', 'ms', 'modules', 'heavy modules loaded'))
+    for module in args.modules:
+        result = results[module] = measure(module, args.repeat)
+        print('%-20s %10.1f %8d  %s' % (module, result['seconds'] * 1000, result['modules'],
+                                        ', '.join(result['loaded']) or '-'))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
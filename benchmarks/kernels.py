@@ -0,0 +1,54 @@
+from __future__ import print_function
+import argparse
+import sys
+import numpy
+from skimage import color
+from colormap import kernels
+from .common import synthetic_image, best_of
+
+
+# (name, forward samples' space) pairs. Inverse conversions are checked over the
+#   forward conversion of the same RGB samples, so their inputs are in range.
+CONVERSIONS = (
+    ('rgb2hsv', None), ('hsv2rgb', 'rgb2hsv'),
+    ('rgb2xyz', None), ('xyz2rgb', 'rgb2xyz'),
+    ('rgb2lab', None), ('lab2rgb', 'rgb2lab'), ('xyz2lab', 'rgb2xyz'),
+    ('rgb2luv', None), ('luv2rgb', 'rgb2luv'), ('xyz2luv', 'rgb2xyz'),
+    ('rgb2hed', None), ('hed2rgb', 'rgb2hed'),
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='colormap.kernels vs skimage.color: equivalence and throughput')
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1e-9,
+                        help='max abs difference allowed against skimage, for float64')
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size), channels=3)
+    # Grays, blacks and whites are the edge cases of hsv (delta == 0) and luv (L == 0).
+    image[:4, :, :] = numpy.linspace(0, 1, args.size)[numpy.newaxis, :, numpy.newaxis]
+    pixels = args.size ** 2
+    failed = False
+    print('%-8s %12s %12s %12s %12s %9s' % ('kernel', 'max diff', 'f32 diff', 'skimage MP/s', 'kernel MP/s',
+                                            'speedup'))
+    for name, forward in CONVERSIONS:
+        source = image if forward is None else getattr(color, forward)(image)
+        expected = getattr(color, name)(source)
+        kernel = getattr(kernels, name)
+        difference = numpy.abs(kernel(source) - expected).max()
+        single = numpy.abs(kernel(source.astype(numpy.float32)) - expected).max()
+        out = numpy.empty_like(source)
+        reference = best_of(lambda: getattr(color, name)(source), args.repeat)
+        seconds = best_of(lambda: kernel(source, out), args.repeat)
+        print('%-8s %12.3g %12.3g %12.2f %12.2f %8.2fx' % (name, difference, single, pixels / reference / 1e6,
+                                                            pixels / seconds / 1e6, reference / seconds))
+        failed = failed or not difference <= args.tolerance
+    if failed:
+        print('some kernels differ from skimage by more than %g' % args.tolerance)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+from __future__ import print_function
+import argparse
+from colormap import spaces, mappers
+from colormap.types import IN
+from colormap.sources import rgb
+from .common import synthetic_image, best_of
+
+
+def keyed_mapper(entries, width):
+    """
+    Creates a mapper whose entries key narrow red bands (e.g. palette keys), each one
+      matching about `width` of the pixels of a uniform image.
+    """
+
+    mapper = mappers.Mapper()
+    for index in range(entries):
+        mapper.on(rgb.r_is(IN(index * width, (index + 1) * width, False, True)), spaces.rgb).do(
+            rgb.mul(spaces.rgb.B, 0.5), spaces.rgb
+        )
+    return mapper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Dense vs sparse entry masks in Mapper.run')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--entries', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size))
+    default = mappers.SPARSE_RATIO
+    print('%10s %12s %12s %9s' % ('matched', 'dense s', 'chosen s', 'speedup'))
+    try:
+        for width in (0.0001, 0.001, 0.01, 0.05, 0.2, 0.5):
+            mapper = keyed_mapper(min(args.entries, int(1 / width)), width)
+            mappers.SPARSE_RATIO = -1
+            dense = best_of(lambda: mapper.run(image, False, dedup=False), args.repeat)
+            mappers.SPARSE_RATIO = default
+            chosen = best_of(lambda: mapper.run(image, False, dedup=False), args.repeat)
+            print('%9.2f%% %12.3f %12.3f %8.2fx' % (width * 100, dense, chosen, dense / chosen))
+    finally:
+        mappers.SPARSE_RATIO = default
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from __future__ import print_function
+import argparse
+from colormap import mappers
+from .common import synthetic_image, sample_mapper, best_of
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel tile scheduler scaling for Mapper.run')
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--entries', type=int, default=8)
+    parser.add_argument('--tile', type=int, default=256)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size))
+    mapper = sample_mapper(args.entries)
+    tile_shape = (args.tile, args.tile)
+    reference = mapper.run(image, True, tile_shape=tile_shape)
+    print('%-10s %8s %10s %8s' % ('pool', 'workers', 'seconds', 'speedup'))
+    for pool in (mappers.THREADS, mappers.PROCESSES):
+        baseline = None
+        for workers in args.workers:
+            result = mapper.run(image, True, tile_shape=tile_shape, workers=workers, pool=pool)
+            if not (result == reference).all():
+                raise AssertionError('%d %s workers gave a different result' % (workers, pool))
+            seconds = best_of(lambda: mapper.run(image, True, tile_shape=tile_shape, workers=workers, pool=pool),
+                              args.repeat)
+            baseline = baseline or seconds
+            print('%-10s %8d %10.3f %8.2f' % (pool, workers, seconds, baseline / seconds))
+
+
+if __name__ == '__main__':
+    main()
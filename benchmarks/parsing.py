@@ -0,0 +1,120 @@
+from __future__ import absolute_import, print_function
+import argparse
+import io
+import shutil
+import tempfile
+import time
+import six
+from ply.lex import lex
+from ply.yacc import yacc, NullLogger
+from common import lang
+from common.lang import LYFactory
+
+
+class Arithmetic(LYFactory):
+    """
+    A small arithmetic grammar, standing for short rule snippets.
+    """
+
+    literals = '+-*/();'
+    t_ignore = ' '
+    precedence = (('left', '+', '-'), ('left', '*', '/'))
+
+    def t_NUMBER(self, t):
+        r'\d+'
+        t.value = int(t.value)
+        return t
+
+    def p_main(self, p):
+        """main : main statement
+                | statement"""
+
+    def p_statement(self, p):
+        "statement : expr ';'"
+        p[0] = p[1]
+
+    def p_binary(self, p):
+        """expr : expr '+' expr
+                | expr '-' expr
+                | expr '*' expr
+                | expr '/' expr"""
+        p[0] = (p[2], p[1], p[3])
+
+    def p_group(self, p):
+        "expr : '(' expr ')'"
+        p[0] = p[2]
+
+    def p_number(self, p):
+        "expr : NUMBER"
+        p[0] = p[1]
+
+
+def rebuilt(factory, text):
+    """
+    Parses as LYFactory.ly used to: building the lexer and the parser tables each time.
+    """
+
+    lexer = lex(object=factory)
+    parser = yacc(module=factory, start='main', debug=False, write_tables=False, errorlog=NullLogger())
+    return parser.parse(text, lexer)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuilt vs cached LYFactory parsers over small snippets')
+    parser.add_argument('--snippets', type=int, default=200)
+    parser.add_argument('--statements', type=int, default=20000,
+                        help='the statements of the large input, parsed whole and streamed')
+    args = parser.parse_args(argv)
+
+    snippets = ['(%d + %d) * %d - 1;' % (index, index + 1, index % 7) for index in range(args.snippets)]
+    directory = tempfile.mkdtemp()
+    try:
+        Arithmetic.tables_directory = directory
+        factory = Arithmetic(parser_kwargs={'debug': False, 'errorlog': NullLogger()})
+        start = time.time()
+        expected = [rebuilt(factory, snippet) for snippet in snippets]
+        before = time.time() - start
+
+        start = time.time()
+        parse = factory.parser()
+        first = parse(snippets[0])
+        cold = time.time() - start
+        start = time.time()
+        results = [parse(snippet) for snippet in snippets]
+        after = time.time() - start
+        if first != expected[0] or results != expected:
+            raise AssertionError('Cached parsers differ from rebuilt ones')
+
+        # Another process would find the tables in the directory (and not in its memory).
+        lang._tables.clear()
+        factory = Arithmetic(parser_kwargs={'debug': False, 'errorlog': NullLogger()})
+        start = time.time()
+        factory.parser()(snippets[0])
+        stored = time.time() - start
+    finally:
+        Arithmetic.tables_directory = None
+        shutil.rmtree(directory, True)
+
+    print('%-32s %10.2f ms' % ('rebuilt, per snippet', before * 1000 / len(snippets)))
+    print('%-32s %10.2f ms' % ('cached, first snippet', cold * 1000))
+    print('%-32s %10.2f ms' % ('cached, per snippet', after * 1000 / len(snippets)))
+    print('%-32s %10.2f ms' % ('stored tables, first snippet', stored * 1000))
+
+    text = '\n'.join(snippets[index % len(snippets)] for index in range(args.statements))
+    start = time.time()
+    factory.ly(text)
+    whole = time.time() - start
+    start = time.time()
+    first, count = None, 0
+    for _ in factory.parse_stream(io.StringIO(six.text_type(text)), ('statement',)):
+        if first is None:
+            first = time.time() - start
+        count += 1
+    streamed = time.time() - start
+    print('%-32s %10.2f ms' % ('large input, whole', whole * 1000))
+    print('%-32s %10.2f ms' % ('large input, streamed', streamed * 1000))
+    print('%-32s %10.2f ms' % ('large input, first statement', first * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from colormap.plans import MappingPlan
+from .common import sample_mapper, best_of
+
+
+_BUILD = """
+import time
+start = time.time()
+from benchmarks.common import sample_mapper
+sample_mapper(%d)
+print(time.time() - start)
+"""
+
+_LOAD = """
+import time
+start = time.time()
+from colormap.plans import MappingPlan
+MappingPlan.load(%r).mapper()
+print(time.time() - start)
+"""
+
+
+def _cold(source, repeat):
+    """
+    Runs a script in new interpreters, and keeps the best time it prints.
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return min(float(subprocess.check_output([sys.executable, '-c', source], cwd=root).decode())
+               for _ in range(repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuilt vs planned mappers, in the same and in new processes')
+    parser.add_argument('--entries', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('%8s %8s %10s %10s %10s %12s %12s' % ('entries', 'bytes', 'build ms', 'dump ms', 'load ms',
+                                                     'cold build', 'cold load'))
+        for entries in args.entries:
+            build = best_of(lambda: sample_mapper(entries), args.repeat)
+            plan = MappingPlan.of(sample_mapper(entries))
+            start = time.time()
+            data = plan.dumps()
+            dump = time.time() - start
+            load = best_of(lambda: MappingPlan.loads(data).mapper(), args.repeat)
+            path = os.path.join(directory, 'plan-%d' % entries)
+            plan.save(path)
+            cold_build = _cold(_BUILD % entries, args.repeat)
+            cold_load = _cold(_LOAD % path, args.repeat)
+            print('%8d %8d %10.2f %10.2f %10.2f %12.2f %12.2f' % (entries, len(data), build * 1000, dump * 1000,
+                                                               load * 1000, cold_build * 1000, cold_load * 1000))
+    finally:
+        shutil.rmtree(directory, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, print_function
+import argparse
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from common import require
+
+
+def plugin_source(functions, index):
+    """
+    Creates the source of a mapping-rule plugin with the given amount of functions.
+    """
+
+    return 'import math\nID = %d\n' % index + ''.join('def rule_%d(value):\n    return math.sqrt(value) * %d\n' %
+                                                      (number, number) for number in range(functions))
+
+
+def reexecuted(file_path, name):
+    """
+    Loads a plugin as as_module used to: reading, compiling and executing it each time.
+    """
+
+    with open(file_path, 'U') as module_file:
+        prev = sys.dont_write_bytecode
+        sys.dont_write_bytecode = True
+        module = imp.load_module(name, module_file, file_path, ('.py', 'U', imp.PY_SOURCE))
+        sys.dont_write_bytecode = prev
+        sys.modules[name] = module
+        return module
+
+
+def concurrently(load, paths, threads):
+    """
+    Loads every plugin from the given amount of threads at once.
+    """
+
+    start = time.time()
+    workers = [threading.Thread(target=lambda: [load(path, 'plugin_%d' % index) for index, path in enumerate(paths)])
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-executed vs cached plugin loads')
+    parser.add_argument('--plugins', type=int, default=16)
+    parser.add_argument('--functions', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for index in range(args.plugins):
+            path = os.path.join(directory, 'plugin_%d.py' % index)
+            with open(path, 'w') as plugin_file:
+                plugin_file.write(plugin_source(args.functions, index))
+            paths.append(path)
+        bytecode = os.path.join(directory, 'bytecode')
+
+        before = concurrently(reexecuted, paths, args.threads)
+        first = concurrently(lambda path, name: require.as_module(path, name, bytecode), paths, args.threads)
+        cached = concurrently(lambda path, name: require.as_module(path, name, bytecode), paths, args.threads)
+        reloaded = concurrently(lambda path, name: require.as_module(path, name, bytecode, True), paths, args.threads)
+        # A new process finds the compiled plugins in the bytecode directory (and not in its memory).
+        require._modules.clear()
+        require._code.clear()
+        stored = concurrently(lambda path, name: require.as_module(path, name, bytecode), paths, args.threads)
+    finally:
+        shutil.rmtree(directory, True)
+
+    loads = args.plugins * args.threads
+    for label, seconds in (('re-executed', before), ('first load', first), ('cached', cached),
+                           ('reloaded', reloaded), ('stored bytecode', stored)):
+        print('%-20s %10.3f ms per load' % (label, seconds * 1000 / loads))
+
+
+if __name__ == '__main__':
+    main()
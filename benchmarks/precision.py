@@ -0,0 +1,44 @@
+from __future__ import print_function
+import argparse
+import numpy
+from colormap import spaces, mappers
+from colormap.types import IN
+from colormap.sources import hsv, rgb, lab
+from colormap.utils import rgb_normalize, rgb_denormalize
+from .common import synthetic_image, best_of
+
+
+def precision_mapper(dtype):
+    mapper = mappers.Mapper(dtype)
+    mapper.on(hsv.h_is(IN(0, 0.2)), spaces.hsv).do(hsv.add(spaces.hsv.H, 0.5).rotate(spaces.hsv.H), spaces.hsv)
+    mapper.on(lab.l_is(IN(30, 60)), spaces.lab).do(lab.mul(spaces.lab.L, 1.1), spaces.lab)
+    mapper.on(hsv.v_is(IN(0.5, 1)), spaces.hsv).do(rgb.mul(spaces.rgb.B, 0.5), spaces.rgb)
+    return mapper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='float32 vs float64 Mapper precision')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    raw = rgb_denormalize(synthetic_image((args.size, args.size)), numpy.uint8)
+    results = {}
+    print('%-8s %10s %12s %10s' % ('dtype', 'seconds', 'MP/s', 'image MB'))
+    for dtype in (numpy.float64, numpy.float32):
+        image = rgb_normalize(raw, dtype)
+        mapper = precision_mapper(dtype)
+        results[dtype] = mapper.run(image, True, dedup=False)
+        seconds = best_of(lambda: mapper.run(image, True, dedup=False), args.repeat)
+        print('%-8s %10.3f %12.2f %10.1f' % (numpy.dtype(dtype).name, seconds, args.size ** 2 / seconds / 1e6,
+                                             image.nbytes / 1e6))
+
+    difference = numpy.abs(results[numpy.float64] - results[numpy.float32])
+    levels = numpy.abs(rgb_denormalize(results[numpy.float64], numpy.uint8).astype(int) -
+                       rgb_denormalize(results[numpy.float32], numpy.uint8).astype(int))
+    print('max abs difference: %g' % difference.max())
+    print('uint8 components differing: %d of %d (max %d levels)' % ((levels > 0).sum(), levels.size, levels.max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import argparse
+import numpy
+from colormap import spaces
+from colormap.types import IN
+from .common import synthetic_image, best_of
+
+
+def ranges(count):
+    """
+    Creates `count` disjoint ranges, evenly spread over [0, 1).
+    """
+
+    width = 1.0 / (2 * count)
+    return [IN(2 * index * width, (2 * index + 1) * width, False, True) for index in range(count)]
+
+
+def separate(band, checks):
+    """
+    Checks each range on its own, and joins their masks (as chained h_is(...) | h_is(...) did).
+    """
+
+    result = spaces.mask(band, checks[0])
+    for check in checks[1:]:
+        result = result | spaces.mask(band, check)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Separate vs fused range checks over bands')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size), 3)
+    hue = spaces.hsv.encoder(image)._[..., 0]
+    bands = (('float64 strided', hue), ('float64', numpy.ascontiguousarray(hue)),
+             ('float32', hue.astype(numpy.float32)), ('uint8', (image[..., 0] * 255).astype(numpy.uint8)))
+    print('%-16s %9s %12s %12s %9s' % ('band', 'ranges', 'separate s', 'fused s', 'speedup'))
+    for name, band in bands:
+        scale = 255 if band.dtype == numpy.uint8 else 1
+        out = numpy.empty(band.shape, dtype=bool)
+        for count in (1, 2, 4, 16, 128):
+            checks = [IN(*(check.interval[0] * scale, check.interval[1] * scale) + check.interval[2:])
+                      for check in ranges(count)]
+            fused = checks[0]
+            for check in checks[1:]:
+                fused = fused | check
+            if not (separate(band, checks) == spaces.mask(band, fused)).all():
+                raise AssertionError('Fused checks differ for %s, %d ranges' % (name, count))
+            before = best_of(lambda: separate(band, checks), args.repeat)
+            after = best_of(lambda: spaces.mask(band, fused, out), args.repeat)
+            print('%-16s %9d %12.4f %12.4f %8.2fx' % (name, count, before, after, before / after))
+
+    wrapper = spaces.hsv.encoder(image)
+    print('%-26s %12s' % ('check', 'seconds'))
+    cases = (
+        ('red hue, two ranges', lambda: wrapper.h_is(IN(0, 3. / 180)) | wrapper.h_is(IN(177. / 180, 1))),
+        ('red hue, circular', lambda: wrapper.h_is(IN(177. / 180, 3. / 180))),
+        ('hue & saturation, two', lambda: wrapper.h_is(IN(177. / 180, 3. / 180)) & wrapper.s_is(IN(0.5, 1))),
+        ('hue & saturation, hs_is', lambda: wrapper.hs_is(IN(177. / 180, 3. / 180), IN(0.5, 1))),
+    )
+    for name, func in cases:
+        print('%-26s %12.4f' % (name, best_of(func, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
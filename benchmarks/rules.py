@@ -0,0 +1,49 @@
+from __future__ import print_function
+import argparse
+from colormap import spaces, mappers
+from colormap.types import IN
+from colormap.sources import hsv, rgb, lab
+from .common import synthetic_image, best_of
+
+
+def rules_mapper(entries):
+    """
+    Creates a mapper with many entries alternating hsv and lab maskers, so without a
+      cache every entry converts the image again.
+    """
+
+    mapper = mappers.Mapper()
+    width = 1.0 / entries
+    for index in range(entries):
+        if index % 2:
+            masker = hsv.h_is(IN(index * width, (index + 1) * width, False, True)), spaces.hsv
+        else:
+            masker = lab.l_is(IN(index * width * 100, (index + 1) * width * 100, False, True)), spaces.lab
+        mapper.on(*masker).do(rgb.mul(spaces.rgb.B, 0.5), spaces.rgb)
+    return mapper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Full-frame vs compacted masker evaluation in Mapper.run')
+    parser.add_argument('--size', type=int, default=768)
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image((args.size, args.size))
+    default = mappers.COMPACT_RATIO
+    print('%8s %6s %12s %12s %9s' % ('entries', 'cache', 'full s', 'compacted s', 'speedup'))
+    try:
+        for entries in (8, 32, 64):
+            mapper = rules_mapper(entries)
+            for cache in (True, False):
+                mappers.COMPACT_RATIO = -1
+                full = best_of(lambda: mapper.run(image, cache, dedup=False), args.repeat)
+                mappers.COMPACT_RATIO = default
+                compacted = best_of(lambda: mapper.run(image, cache, dedup=False), args.repeat)
+                print('%8d %6s %12.3f %12.3f %8.2fx' % (entries, cache, full, compacted, full / compacted))
+    finally:
+        mappers.COMPACT_RATIO = default
+
+
+if __name__ == '__main__':
+    main()
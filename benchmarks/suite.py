@@ -0,0 +1,173 @@
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import numpy
+from colormap import spaces, utils
+from colormap.mappers import DEFAULT_TILE_SHAPE
+from colormap.types import IN
+from .common import synthetic_image, sample_mapper, best_of
+
+
+SPACES = ('rgb', 'hsv', 'hed', 'xyz', 'luv', 'lab')
+ENTRIES = (1, 10, 50)
+
+
+def space_cases(image):
+    for name in SPACES:
+        colorspace = getattr(spaces, name)
+        encoded = colorspace.encoder(image)
+        out = numpy.empty(image.shape)
+        yield 'encode/%s' % name, lambda: colorspace.encoder(image, out)
+        yield 'decode/%s' % name, lambda: colorspace.decoder(encoded, out)
+
+
+def mask_cases(image):
+    band = spaces.hsv.encoder(image)._[:, :, 0]
+    color = tuple(image[0, 0])
+    yield 'mask/number', lambda: spaces.mask(band, 0.5)
+    yield 'mask/in', lambda: spaces.mask(band, IN(0.25, 0.75))
+    yield 'mask/in-open', lambda: spaces.mask(band, IN(0.25, 0.75, False, True))
+    yield 'mask/color', lambda: spaces.mask(image, color)
+
+
+def mapper_cases(image):
+    for entries in ENTRIES:
+        mapper = sample_mapper(entries)
+        yield 'mapper/%d/cached' % entries, lambda: mapper.run(image, True, dedup=False)
+        yield 'mapper/%d/uncached' % entries, lambda: mapper.run(image, False, dedup=False)
+        yield 'mapper/%d/auto' % entries, lambda: mapper.run(image, True)
+        yield 'mapper/%d/tiled' % entries, lambda: mapper.run(image, True, DEFAULT_TILE_SHAPE)
+
+
+def histogram_cases(image):
+    band = image[:, :, 0]
+    yield 'dhist/256', lambda: utils.dhist(band, 256)
+    yield 'dhist/4096', lambda: utils.dhist(band, 4096)
+    yield 'histogram/hsv', lambda: utils.HistogramAccumulator(spaces.hsv, 256, image.shape[2]).update(image)
+
+
+def wrapper_cases(image):
+    chunk = image.reshape((-1, image.shape[2]))
+    wrapper = spaces.HSV(chunk.copy())
+    yield 'wrapper/band', lambda: wrapper.v
+    yield 'wrapper/h_is', lambda: wrapper.h_is(IN(0.25, 0.75))
+    yield 'wrapper/mul', lambda: wrapper.mul(spaces.hsv.V, 1.0)
+    yield 'wrapper/clamp', lambda: wrapper.clamp((0, 1, 2))
+    yield 'wrapper/rotate', lambda: wrapper.rotate(spaces.hsv.H)
+
+
+GROUPS = (space_cases, mask_cases, mapper_cases, histogram_cases, wrapper_cases)
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, channels, distributions, repeat=3, only=None, log=None):
+    """
+    Runs the benchmark cases over each combination of synthetic image size, channels and
+      color distribution.
+    :param sizes: Image sides (images are square).
+    :param channels: Channel counts (3 for RGB, 4 for RGBA).
+    :param distributions: Color distributions (see synthetic_image).
+    :param repeat: The amount of runs of each case (the best one is kept).
+    :param only: An optional substring the case names must contain.
+    :param log: An optional file to print each result into, as it is measured.
+    :return: A dictionary with the environment and the list of results.
+    """
+
+    results = []
+    for size in sizes:
+        for channel_count in channels:
+            for distribution in distributions:
+                image = synthetic_image((size, size), channel_count, distribution)
+                for group in GROUPS:
+                    for name, func in group(image):
+                        if only and only not in name:
+                            continue
+                        seconds = best_of(func, repeat)
+                        result = {'name': name, 'size': size, 'channels': channel_count,
+                                  'distribution': distribution, 'seconds': seconds,
+                                  'mpixels_per_second': size * size / seconds / 1e6 if seconds else None}
+                        results.append(result)
+                        if log is not None:
+                            print('%-22s %5d %2d %-9s %10.5f' % (name, size, channel_count, distribution, seconds),
+                                  file=log)
+    return {
+        'environment': {
+            'python': platform.python_version(), 'numpy': numpy.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(), 'revision': _revision(),
+            'date': datetime.datetime.utcnow().isoformat(),
+        },
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def _key(result):
+    return result['name'], result['size'], result['channels'], result['distribution']
+
+
+def compare(baseline, current, threshold=1.1, log=sys.stdout):
+    """
+    Compares two suite outputs, case by case.
+    :param baseline: The former output.
+    :param current: The new output.
+    :param threshold: The slowdown ratio (new / former seconds) considered a regression.
+    :param log: The file to print the comparison into.
+    :return: The list of regressed case keys.
+    """
+
+    former = dict((_key(result), result['seconds']) for result in baseline['results'])
+    regressions = []
+    print('%-22s %5s %2s %-9s %10s %10s %7s' % ('case', 'size', 'ch', 'colors', 'before', 'after', 'ratio'),
+          file=log)
+    for result in current['results']:
+        key = _key(result)
+        if key not in former:
+            continue
+        ratio = result['seconds'] / former[key] if former[key] else float('inf')
+        flag = ' <-' if ratio > threshold else ''
+        if flag:
+            regressions.append(key)
+        print('%-22s %5d %2d %-9s %10.5f %10.5f %7.2f%s' % (key + (former[key], result['seconds'], ratio, flag)),
+              file=log)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite over synthetic images, with JSON output')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 512])
+    parser.add_argument('--channels', type=int, nargs='+', default=[3, 4])
+    parser.add_argument('--distributions', nargs='+', default=['uniform', 'palette', 'gradient'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='only run the cases whose name contains this text')
+    parser.add_argument('--output', help='the JSON file to write the results into (default: stdout)')
+    parser.add_argument('--compare', help='a former JSON output to compare the results against')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='the slowdown ratio considered a regression when comparing')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.channels, args.distributions, args.repeat, args.only, sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    elif not args.compare:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(json.load(baseline), results, args.threshold)
+        if regressions:
+            print('%d cases regressed beyond %.2fx' % (len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+from __future__ import print_function
+import argparse
+import timeit
+import numpy
+from colormap import spaces, mappers, kernels
+from colormap.types import IN
+from colormap.sources import hsv, rgb
+from .common import synthetic_image
+
+
+def _mul_clamp(chunk):
+    numpy.multiply(chunk[..., 2], 0.5, out=chunk[..., 2])
+    numpy.clip(chunk[..., :3], 0., 1., out=chunk[..., :3])
+    return chunk
+
+
+def cases(chunk):
+    """
+    Pairs of (wrapper, plain ndarray) statements doing the same over a chunk, so the
+      wrapper overhead can be told apart from the NumPy work.
+    """
+
+    wrapper = spaces.HSV(chunk)
+    masker = mappers.Masker(hsv.h_is(IN(0, 0.5)), spaces.hsv)
+    action = mappers.Action(rgb.mul(spaces.rgb.B, 0.5).clamp((0, 1, 2)), spaces.rgb)
+    return (
+        ('wrap', lambda: spaces.HSV(chunk), lambda: chunk),
+        ('band', lambda: wrapper.h, lambda: chunk[..., 0]),
+        ('h_is', lambda: wrapper.h_is(IN(0, 0.5)), lambda: (chunk[..., 0] >= 0) & (chunk[..., 0] <= 0.5)),
+        ('mul', lambda: wrapper.mul(2, 1.0), lambda: numpy.multiply(chunk[..., 2], 1.0, out=chunk[..., 2])),
+        ('compare', lambda: wrapper < 0.5, lambda: chunk < 0.5),
+        ('masker', lambda: masker.get_mask(mappers.MappingContext(chunk, False)),
+         lambda: IN(0, 0.5).contains(kernels.rgb2hsv(chunk[..., :3])[..., 0])),
+        ('action', lambda: action.execute(chunk), lambda: _mul_clamp(chunk)),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ColorSpaceWrapper overhead over small and large chunks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 256, 65536])
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    print('%-8s %8s %12s %12s %12s' % ('case', 'pixels', 'wrapper us', 'ndarray us', 'overhead us'))
+    for size in args.sizes:
+        chunk = synthetic_image((size, 1)).reshape((size, 4))
+        number = max(1, args.number * 256 // max(size, 256))
+        for name, wrapped, plain in cases(chunk):
+            wrapped_us = min(timeit.repeat(wrapped, number=number, repeat=3)) / number * 1e6
+            plain_us = min(timeit.repeat(plain, number=number, repeat=3)) / number * 1e6
+            print('%-8s %8d %12.2f %12.2f %12.2f' % (name, size, wrapped_us, plain_us, wrapped_us - plain_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+Expressions built from colormap.sources (e.g. hsv.h_is(IN(0, 0.1)) | hsv.h_is(IN(0.9, 1)))
+  are trees that cantrips interprets node by node, on each evaluation, through a Scope.
+
+This module lowers such trees, once, into a plain-tuple representation:
+
+  ('root',)                          The scope itself.
+  ('const', value)                   A value not depending on the scope.
+  ('attr', node, name)               getattr(node, name), or Undefined() if missing.
+  ('op', func, (node, ...))          func(node, ...), e.g. operator.or_.
+  ('call', node, (node, ...), ((name, node), ...))
+                                     node(node, ..., name=node, ...).
+  ('seq', type, (node, ...))         A list, tuple, set or frozenset of nodes.
+  ('dict', type, ((node, node), ...))
+                                     A dictionary of nodes.
+
+And then compiles that representation into a single Python function taking the colorspace
+  wrapper, with the constants bound in its globals. Subtrees not depending on the scope are
+  folded into constants at compile time, and range checks of the same band combined with
+  | or & (e.g. hsv.h_is(IN(0, 0.1)) | hsv.h_is(IN(0.9, 1))) are fused into a single check
+  against an interval set.
+"""
+
+import collections
+import functools
+import hashlib
+import inspect
+import operator
+import sys
+import numpy
+from six import integer_types, string_types
+from .spaces import BAND_CHECKS
+from .types import IN, IntervalSet
+
+
+_undefined = []
+
+
+def undefined():
+    """
+    Gets cantrips' Undefined value, which missing attributes evaluate to. cantrips is
+      imported on the first call, so lowered expressions (e.g. from mapping plans) are
+      compiled and fingerprinted without it unless they refer a missing attribute.
+    :return:
+    """
+
+    if not _undefined:
+        from cantrips.watch.undefined import Undefined
+        _undefined.append(Undefined())
+    return _undefined[0]
+
+
+_BINARY_OPERATORS = {
+    operator.or_: '|', operator.and_: '&', operator.xor: '^',
+    operator.add: '+', operator.sub: '-', operator.mul: '*', operator.mod: '%',
+    operator.floordiv: '//', operator.lshift: '<<', operator.rshift: '>>',
+    operator.lt: '<', operator.le: '<=', operator.gt: '>', operator.ge: '>=',
+    operator.eq: '==', operator.ne: '!=',
+}
+
+
+_UNARY_OPERATORS = {
+    operator.invert: '~', operator.neg: '-', operator.pos: '+',
+}
+
+
+class _NameProbe(object):
+    """
+    Recovers the attribute name an AttributeExpression was built with, by answering
+      any attribute lookup with the name itself.
+    """
+
+    def __getattr__(self, item):
+        return item
+
+
+def _private(expr, cls, name):
+    return vars(expr)['_%s__%s' % (cls.__name__, name)]
+
+
+def is_expression(value):
+    """
+    Tells whether a value is an expression (e.g. built from colormap.sources), without
+      importing cantrips' expressions (which are not cheap to import) when there can
+      be no expression because they were never imported.
+    :param value:
+    :return:
+    """
+
+    module = sys.modules.get('cantrips.watch.expression')
+    return module is not None and isinstance(value, module.Expression)
+
+
+class LoweredExpression(collections.namedtuple('LoweredExpression', ('node',))):
+    """
+    An expression already lowered (e.g. loaded from a mapping plan), which is compiled
+      and fingerprinted as the expression it was lowered from, without cantrips.
+    """
+
+
+def lower(value):
+    """
+    Lowers an expression (or any value, perhaps containing expressions) into its
+      plain-tuple representation.
+    :param value:
+    :return:
+    """
+
+    if isinstance(value, LoweredExpression):
+        return value.node
+    if is_expression(value):
+        from cantrips.watch.expression import (
+            IdentityExpression, AttributeExpression, OperatorExpression, CallableExpression
+        )
+        if isinstance(value, IdentityExpression):
+            return 'root',
+        elif isinstance(value, AttributeExpression):
+            func = _private(value, OperatorExpression, 'func')
+            expr, = _private(value, OperatorExpression, 'args')
+            return 'attr', lower(expr), func(_NameProbe())
+        elif isinstance(value, OperatorExpression):
+            func = _private(value, OperatorExpression, 'func')
+            args = _private(value, OperatorExpression, 'args')
+            return 'op', func, tuple(lower(arg) for arg in args)
+        elif isinstance(value, CallableExpression):
+            expr = _private(value, CallableExpression, 'expr')
+            args = _private(value, CallableExpression, 'args')
+            kwargs = _private(value, CallableExpression, 'kwargs')
+            return ('call', lower(expr), tuple(lower(arg) for arg in args),
+                    tuple((key, lower(arg)) for key, arg in sorted(kwargs.items())))
+        else:
+            raise TypeError("Cannot lower an expression of type %s" % type(value).__name__)
+    for type_ in (list, tuple, set, frozenset):
+        if isinstance(value, type_):
+            nodes = tuple(lower(item) for item in value)
+            if all(node[0] == 'const' for node in nodes):
+                return 'const', value
+            return 'seq', type(value), nodes
+    if isinstance(value, dict):
+        nodes = tuple((lower(key), lower(item)) for key, item in value.items())
+        if all(key[0] == 'const' and item[0] == 'const' for key, item in nodes):
+            return 'const', value
+        return 'dict', type(value), nodes
+    return 'const', value
+
+
+def _getattr(value, name):
+    """
+    Gets an attribute as expressions do: Undefined() if it is missing.
+    """
+
+    try:
+        return getattr(value, name)
+    except AttributeError:
+        return undefined()
+
+
+class _Namespace(object):
+    """
+    Stands for the scope when the root itself is referenced. It holds the wrapper
+      as an attribute named after the colorspace components.
+    """
+
+    def __init__(self, components, wrapper):
+        setattr(self, components, wrapper)
+
+    def __getattr__(self, item):
+        return undefined()
+
+
+class _Generator(object):
+    """
+    Generates the source of a lowered expression, keeping the constants aside.
+    """
+
+    def __init__(self, components):
+        self.components = components
+        self.constants = {'_namespace': _Namespace, '_getattr': _getattr}
+
+    def constant(self, value):
+        name = '_c%d' % len(self.constants)
+        self.constants[name] = value
+        return name
+
+    def source(self, node):
+        kind = node[0]
+        if kind == 'root':
+            return '_namespace(%r, w)' % self.components
+        elif kind == 'const':
+            return self.constant(node[1])
+        elif kind == 'attr':
+            if node[1][0] == 'root':
+                if node[2] == self.components:
+                    return 'w'
+                return self.constant(undefined())
+            return '_getattr(%s, %r)' % (self.source(node[1]), node[2])
+        elif kind == 'op':
+            func, args = node[1], [self.source(arg) for arg in node[2]]
+            if func in _BINARY_OPERATORS and len(args) == 2:
+                return '(%s %s %s)' % (args[0], _BINARY_OPERATORS[func], args[1])
+            if func in _UNARY_OPERATORS and len(args) == 1:
+                return '(%s%s)' % (_UNARY_OPERATORS[func], args[0])
+            return '%s(%s)' % (self.constant(func), ', '.join(args))
+        elif kind == 'call':
+            args = [self.source(arg) for arg in node[2]]
+            if node[3]:
+                args.append('**{%s}' % ', '.join('%r: %s' % (key, self.source(arg)) for key, arg in node[3]))
+            return '%s(%s)' % (self.source(node[1]), ', '.join(args))
+        elif kind == 'seq':
+            return '%s((%s,))' % (self.constant(node[1]), ', '.join(self.source(item) for item in node[2]))
+        elif kind == 'dict':
+            return '%s({%s})' % (self.constant(node[1]), ', '.join('%s: %s' % (self.source(key), self.source(item))
+                                                                     for key, item in node[2]))
+        raise ValueError("Unknown node kind: %r" % (kind,))
+
+
+def _depends(node):
+    """
+    Tells whether a lowered node depends on the scope.
+    """
+
+    kind = node[0]
+    if kind == 'root':
+        return True
+    elif kind == 'const':
+        return False
+    elif kind == 'attr':
+        return _depends(node[1])
+    elif kind in ('op', 'seq'):
+        return any(_depends(arg) for arg in node[2])
+    elif kind == 'call':
+        return _depends(node[1]) or any(_depends(arg) for arg in node[2]) or any(_depends(arg) for _, arg in node[3])
+    elif kind == 'dict':
+        return any(_depends(key) or _depends(item) for key, item in node[2])
+    raise ValueError("Unknown node kind: %r" % (kind,))
+
+
+def fold(node):
+    """
+    Folds the subtrees not depending on the scope into constants.
+    :param node:
+    :return:
+    """
+
+    if node[0] == 'const':
+        return node
+    if not _depends(node):
+        return 'const', compile_lowered(node, '')(None)
+    kind = node[0]
+    if kind == 'attr':
+        return 'attr', fold(node[1]), node[2]
+    elif kind == 'op':
+        return 'op', node[1], tuple(fold(arg) for arg in node[2])
+    elif kind == 'call':
+        return 'call', fold(node[1]), tuple(fold(arg) for arg in node[2]), tuple((key, fold(arg))
+                                                                                 for key, arg in node[3])
+    elif kind == 'seq':
+        return 'seq', node[1], tuple(fold(item) for item in node[2])
+    elif kind == 'dict':
+        return 'dict', node[1], tuple((fold(key), fold(item)) for key, item in node[2])
+    return node
+
+
+def _same_chain(first, second):
+    """
+    Tells whether two lowered nodes are the same attribute chain (e.g. hsv.h_is).
+    """
+
+    if first[0] == 'root' or second[0] == 'root':
+        return first[0] == second[0]
+    return (first[0] == second[0] == 'attr' and first[2] == second[2] and
+            _same_chain(first[1], second[1]))
+
+
+def _range_check(node):
+    """
+    Gets the (check, range) of a lowered single-band range check (e.g. hsv.h_is(IN(0, 0.1))),
+      or None if the node is not such check.
+    """
+
+    if node[0] != 'call' or node[3] or len(node[2]) != 1 or node[2][0][0] != 'const':
+        return None
+    check, (_, value) = node[1], node[2][0]
+    if check[0] != 'attr' or check[2] not in BAND_CHECKS or not isinstance(value, (IN, IntervalSet)):
+        return None
+    if isinstance(value, IN) and not all(isinstance(bound, (integer_types, float, numpy.integer, numpy.floating))
+                                         for bound in value.interval[:2]):
+        return None
+    return check, value
+
+
+def fuse(node):
+    """
+    Fuses range checks of the same band, combined with | or &, into a single check
+      against their interval set (e.g. hsv.h_is(IN(0, 0.1)) | hsv.h_is(IN(0.9, 1)) into
+      hsv.h_is(IN(0, 0.1) | IN(0.9, 1))), bottom-up.
+    :param node:
+    :return:
+    """
+
+    kind = node[0]
+    if kind == 'attr':
+        return 'attr', fuse(node[1]), node[2]
+    elif kind == 'op':
+        node = 'op', node[1], tuple(fuse(arg) for arg in node[2])
+        if node[1] in (operator.or_, operator.and_) and len(node[2]) == 2:
+            first, second = _range_check(node[2][0]), _range_check(node[2][1])
+            if first and second and _same_chain(first[0], second[0]):
+                combined = node[1](IntervalSet.of(first[1]), second[1])
+                return 'call', first[0], (('const', combined),), ()
+        return node
+    elif kind == 'call':
+        return 'call', fuse(node[1]), tuple(fuse(arg) for arg in node[2]), tuple((key, fuse(arg))
+                                                                                 for key, arg in node[3])
+    elif kind == 'seq':
+        return 'seq', node[1], tuple(fuse(item) for item in node[2])
+    elif kind == 'dict':
+        return 'dict', node[1], tuple((fuse(key), fuse(item)) for key, item in node[2])
+    return node
+
+
+def compile_lowered(node, components):
+    """
+    Compiles a lowered expression into a function taking the wrapper of the given components.
+    :param node:
+    :param components:
+    :return:
+    """
+
+    generator = _Generator(components)
+    source = 'lambda w: %s' % generator.source(node)
+    return eval(compile(source, '<colormap expression>', 'eval'), generator.constants)
+
+
+def compile_expression(expr, components):
+    """
+    Compiles an expression into a function taking a single argument: the wrapper that
+      the expression refers by the colorspace components (e.g. hsv), and returning
+      the same result that evaluating the expression in such scope would return.
+    :param expr:
+    :param components:
+    :return:
+    """
+
+    return compile_lowered(fuse(fold(lower(expr))), components)
+
+
+def _global_names(code):
+    """
+    The names a code object (and the code objects nested in it) may look up in its globals.
+    """
+
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+
+def _state(value):
+    """
+    The state of an object: what it tells to pickle (if its class tells it), or else its
+      attributes and slots. None if it has no state to tell.
+    """
+
+    getstate = getattr(type(value), '__getstate__', None)
+    if getstate is not None and getstate is not getattr(object, '__getstate__', None):
+        return value.__getstate__()
+    state = dict(getattr(value, '__dict__', None) or {})
+    for cls in type(value).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        for slot in (slots,) if isinstance(slots, string_types) else slots:
+            if slot not in ('__dict__', '__weakref__') and hasattr(value, slot):
+                state[slot] = getattr(value, slot)
+    return state or None
+
+
+def canonical(value, _seen=()):
+    """
+    Renders a stable text for a value (e.g. a lowered expression), so it can be hashed
+      and the hash keeps being the same across processes. Functions are rendered by
+      their name, bytecode, constants, closure, and the globals they refer; partials by
+      their function and arguments; methods by their function and the object they are
+      bound to; and objects by their class and state (see _state), or else by how they
+      are pickled if they are callable.
+
+    Callables whose state cannot be told (e.g. C-level callable objects) raise TypeError,
+      as two different ones would be rendered the same.
+    :param value:
+    :return:
+    """
+
+    if value is None or isinstance(value, (bool, float, complex) + integer_types + string_types):
+        return repr(value)
+    if id(value) in _seen:
+        return '<recursive>'
+    _seen += (id(value),)
+    if isinstance(value, (tuple, list)):
+        return '%s(%s)' % (type(value).__name__, ','.join(canonical(item, _seen) for item in value))
+    elif isinstance(value, (set, frozenset)):
+        return '%s(%s)' % (type(value).__name__, ','.join(sorted(canonical(item, _seen) for item in value)))
+    elif isinstance(value, dict):
+        return '%s(%s)' % (type(value).__name__, ','.join(sorted('%s:%s' % (canonical(key, _seen),
+                                                                            canonical(item, _seen))
+                                                                  for key, item in value.items())))
+    elif isinstance(value, numpy.ndarray):
+        return 'ndarray(%s,%r,%s)' % (value.dtype.str, value.shape,
+                                      hashlib.sha1(numpy.ascontiguousarray(value).tobytes()).hexdigest())
+    elif isinstance(value, numpy.generic):
+        return repr(value.item())
+    elif isinstance(value, type):
+        return 'type(%s.%s)' % (value.__module__, value.__name__)
+    elif inspect.ismodule(value):
+        return 'module(%s)' % value.__name__
+    elif isinstance(value, functools.partial):
+        return 'partial(%s,%s,%s)' % (canonical(value.func, _seen), canonical(value.args, _seen),
+                                      canonical(value.keywords or {}, _seen))
+    elif inspect.ismethod(value):
+        return 'method(%s,%s)' % (canonical(value.__self__, _seen), canonical(value.__func__, _seen))
+    elif inspect.isfunction(value):
+        code = value.__code__
+        closure = tuple(cell.cell_contents for cell in value.__closure__ or ())
+        referred = dict((name, value.__globals__[name]) for name in _global_names(code)
+                        if name in value.__globals__)
+        return 'function(%s.%s,%s,%s,%s,%s,%s,%s)' % (
+            value.__module__, value.__name__, hashlib.sha1(code.co_code).hexdigest(),
+            canonical(code.co_consts, _seen), canonical(code.co_names, _seen),
+            canonical(value.__defaults__, _seen), canonical(closure, _seen), canonical(referred, _seen)
+        )
+    elif inspect.isbuiltin(value) or isinstance(value, numpy.ufunc):
+        bound = getattr(value, '__self__', None)
+        if bound is None or inspect.ismodule(bound):
+            return 'builtin(%s.%s)' % (getattr(value, '__module__', None), value.__name__)
+        return 'builtin(%s,%s)' % (canonical(bound, _seen), value.__name__)
+    elif inspect.ismethoddescriptor(value) and hasattr(value, '__objclass__'):
+        return 'descriptor(%s,%s)' % (canonical(value.__objclass__, _seen), value.__name__)
+    elif inspect.iscode(value):
+        return 'code(%s,%s)' % (hashlib.sha1(value.co_code).hexdigest(), canonical(value.co_consts, _seen))
+    state = _state(value)
+    if state is None and callable(value) and type(value).__reduce__ is not object.__reduce__:
+        # C-level callables (e.g. operator.itemgetter) may still tell how to be pickled.
+        state = value.__reduce__()
+    call = getattr(type(value), '__call__', None) if callable(value) else None
+    if call is not None and not inspect.isfunction(getattr(call, '__func__', call)):
+        if state is None:
+            raise TypeError("Cannot render a callable of type %s: its state is unknown" % type(value).__name__)
+        call = None
+    if state is not None or call is not None:
+        return '%s(%s,%s)' % (canonical(type(value), _seen), canonical(state, _seen), canonical(call, _seen))
+    return repr(value)
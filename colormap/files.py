@@ -0,0 +1,119 @@
+import numpy
+from numpy import float32, float64, uint8
+from numpy.lib.format import open_memmap
+from .mappers import THREADS
+from .utils import rgb_normalize, rgb_denormalize
+
+
+DEFAULT_BAND_ROWS = 256
+
+
+def open_image(path, shape=None, dtype=None, mode='r', offset=0):
+    """
+    Opens an image file as a memory-mapped array, without reading it. NPY files know their
+      shape and dtype (if given, they are checked against the file). Raw files (a headerless,
+      row-major dump of the pixels) need them.
+    :param path: The file path. NPY files are told by their .npy extension.
+    :param shape: The (rows, columns, components) shape of raw files.
+    :param dtype: The dtype of raw files (uint8 by default).
+    :param mode: 'r' (read-only, the default), 'r+' (read-write), or 'c' (copy-on-write).
+    :param offset: The offset, in bytes, of the pixels in raw files.
+    :return:
+    """
+
+    if path.endswith('.npy'):
+        image = numpy.load(path, mmap_mode=mode)
+        if shape is not None and tuple(shape) != image.shape:
+            raise ValueError('Image file has shape %r, not %r' % (image.shape, tuple(shape)))
+        if dtype is not None and numpy.dtype(dtype) != image.dtype:
+            raise ValueError('Image file has dtype %s, not %s' % (image.dtype, numpy.dtype(dtype)))
+        return image
+    if shape is None:
+        raise ValueError('Raw image files need a shape')
+    return numpy.memmap(path, dtype=uint8 if dtype is None else dtype, mode=mode, offset=offset, shape=tuple(shape))
+
+
+def create_image(path, shape, dtype=uint8):
+    """
+    Creates an image file (NPY, if the path has the .npy extension, or raw otherwise) and
+      opens it as a writable memory-mapped array.
+    :param path:
+    :param shape:
+    :param dtype:
+    :return:
+    """
+
+    if path.endswith('.npy'):
+        return open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    return numpy.memmap(path, dtype=dtype, mode='w+', shape=tuple(shape))
+
+
+def map_bands(mapper, image, out, cache=False, band_rows=DEFAULT_BAND_ROWS, tile_shape=None, workers=1,
+              pool=THREADS, stats=None):
+    """
+    Runs a mapper over an image band by band (a band being a range of whole rows, so each
+      band is a contiguous region of a row-major file), writing each mapped band into the
+      output. Only a band is in memory at once: with memory-mapped arrays, images larger
+      than the memory can be mapped, and the reads and writes are buffered by the OS page
+      cache.
+
+    uint8 bands are normalized before being mapped. Mapped bands are denormalized when
+      the output is uint8.
+    :param mapper: The mapper.
+    :param image: The (rows, columns, components) image, usually memory-mapped.
+    :param out: The output image of the same shape, usually memory-mapped. Flushed at the end.
+    :param cache: As in Mapper.run.
+    :param band_rows: The amount of rows of each band.
+    :param tile_shape: An optional tile shape to run each band with, as in Mapper.run.
+    :param workers: As in Mapper.run, for the tiles of each band.
+    :param pool: As in Mapper.run.
+    :param stats: An optional dictionary to fill with the amount of bands and pixels.
+    :return: The output image.
+    """
+
+    if len(image.shape) != 3 or image.shape[2] not in (3, 4):
+        raise ValueError("Image to be masked must have three dimensions (non-palette colors)")
+    if out.shape != image.shape:
+        raise ValueError("Output image must have the same shape of the image to be masked")
+    if out.dtype not in (uint8, float32, float64):
+        raise ValueError("Output image must be uint8, float32 or float64")
+    if band_rows < 1:
+        raise ValueError('band_rows must be positive')
+
+    if stats is None:
+        stats = {}
+    stats['bands'] = 0
+    stats['pixels'] = image.shape[0] * image.shape[1]
+    dtype = mapper.dtype or (out.dtype if out.dtype in (float32, float64) else float64)
+    mapped = numpy.empty((min(band_rows, image.shape[0]),) + image.shape[1:], dtype=dtype)
+    for start in range(0, image.shape[0], band_rows):
+        band = rgb_normalize(numpy.asarray(image[start:start + band_rows]), dtype)
+        result = mapper.run(band, cache, tile_shape, mapped[:len(band)], workers, pool, dedup=False)
+        if out.dtype == uint8:
+            out[start:start + band_rows] = rgb_denormalize(result, uint8)
+        else:
+            out[start:start + band_rows] = result
+        stats['bands'] += 1
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+
+def map_file(mapper, path, out_path, shape=None, dtype=None, out_dtype=None, offset=0, **kwargs):
+    """
+    Maps an image file into another one through memory-mapped arrays (see map_bands).
+    :param mapper: The mapper.
+    :param path: The input file path (NPY or raw, see open_image).
+    :param out_path: The output file path (NPY or raw, by its extension).
+    :param shape: The shape of raw input files.
+    :param dtype: The dtype of raw input files (uint8 by default), or the one NPY input files
+      are expected to have.
+    :param out_dtype: The dtype of the output (by default, the input one).
+    :param offset: The offset of the pixels in raw input files.
+    :param kwargs: Other arguments to map_bands.
+    :return: The memory-mapped output.
+    """
+
+    image = open_image(path, shape, dtype, offset=offset)
+    out = create_image(out_path, image.shape, out_dtype or image.dtype)
+    return map_bands(mapper, image, out, **kwargs)
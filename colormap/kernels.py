@@ -0,0 +1,268 @@
+"""
+Colorspace conversion kernels, in plain NumPy.
+
+Each kernel takes a (..., 3) image (e.g. (N, 3) or (H, W, 3)) and an optional output
+  buffer of the same shape (which may be the image itself, or a strided view like the
+  first three components of an RGBA buffer). The pixels are converted in chunks of
+  CHUNK pixels, fusing the matrix and nonlinear steps of each conversion over the same
+  chunk while it is still in cache, and writing each converted chunk into the output.
+
+Float32 images are converted in float32, and float64 images in float64. Unsigned
+  integer images are normalized to float64 first. The formulas (and constants) are
+  the same used by skimage.color (D65 illuminant, 2 degree observer).
+"""
+
+import math
+from functools import wraps
+import numpy
+
+
+CHUNK = 16384
+
+
+# sRGB (D65) <-> XYZ.
+XYZ_FROM_RGB = numpy.array([[0.412453, 0.357580, 0.180423],
+                            [0.212671, 0.715160, 0.072169],
+                            [0.019334, 0.119193, 0.950227]])
+RGB_FROM_XYZ = numpy.linalg.inv(XYZ_FROM_RGB)
+
+
+# Haematoxylin-Eosin-DAB stains (Ruifrok and Johnston, 2001).
+RGB_FROM_HED = numpy.array([[0.65, 0.70, 0.29],
+                            [0.07, 0.99, 0.11],
+                            [0.27, 0.57, 0.78]])
+HED_FROM_RGB = numpy.linalg.inv(RGB_FROM_HED)
+# Optical densities are scaled by the log of the least intensity (a Python float, so it
+#   does not promote float32 chunks).
+LOG_ADJUST = math.log(1e-6)
+
+
+# D65 reference white, 2 degree observer.
+WHITE = numpy.array([0.95047, 1., 1.08883])
+U0 = 4 * WHITE[0] / numpy.dot([1, 15, 3], WHITE)
+V0 = 9 * WHITE[1] / numpy.dot([1, 15, 3], WHITE)
+EPS = numpy.finfo(numpy.float64).eps
+
+
+_constants = {}
+
+
+def _constant(array, dtype):
+    """
+    Gets a constant array in the given dtype, so float32 chunks stay in float32.
+    """
+
+    key = id(array), dtype
+    if key not in _constants:
+        _constants[key] = array.astype(dtype)
+    return _constants[key]
+
+
+def _scalar(value, dtype):
+    """
+    Gets a constant scalar in the given dtype (float64 scalars would promote float32
+      arrays to float64 under NumPy 2).
+    """
+
+    return numpy.dtype(dtype).type(value)
+
+
+def _as_float(image):
+    if image.dtype in (numpy.float32, numpy.float64):
+        return image
+    if image.dtype.kind == 'u':
+        return image / float(numpy.iinfo(image.dtype).max)
+    return image.astype(numpy.float64)
+
+
+def _flat(out):
+    """
+    Views a (..., 3) buffer as (N, 3) without copying, or returns None if not possible.
+    """
+
+    flat = out.view()
+    try:
+        flat.shape = (-1, 3)
+    except AttributeError:
+        return None
+    return flat
+
+
+def _kernel(func):
+    """
+    Turns a chunk function func(source, target), converting a (n, 3) chunk into a (n, 3)
+      target (and reading the whole source chunk before writing the target), into a
+      kernel taking any (..., 3) image and an optional output buffer.
+    """
+
+    @wraps(func)
+    def kernel(image, out=None):
+        image = _as_float(numpy.asarray(image))
+        if image.shape[-1:] != (3,):
+            raise ValueError("Image to be converted must have 3 components in its last dimension")
+        if out is None:
+            out = numpy.empty(image.shape, dtype=image.dtype)
+        elif out.shape != image.shape:
+            raise ValueError("Output buffer must have the same shape of the image to be converted")
+
+        target = _flat(out)
+        if target is None:
+            out[...] = kernel(image)
+            return out
+        source = image.reshape((-1, 3))
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for start in range(0, len(source), CHUNK):
+                func(source[start:start + CHUNK], target[start:start + CHUNK])
+        return out
+    return kernel
+
+
+def identity(image, out=None):
+    """
+    Copies the image as it is (no normalization is done, even for integer images).
+    """
+
+    if out is None:
+        return numpy.array(image, dtype=image.dtype if image.dtype in (numpy.float32, numpy.float64) else numpy.float64)
+    out[...] = image
+    return out
+
+
+@_kernel
+def rgb2hsv(source, target):
+    r, g, b = source[:, 0], source[:, 1], source[:, 2]
+    v = source.max(axis=1)
+    delta = v - source.min(axis=1)
+    flat = delta == 0
+    s = delta / v
+    s[flat] = 0
+    h = numpy.where(b == v, 4. + (r - g) / delta, numpy.where(g == v, 2. + (b - r) / delta, (g - b) / delta))
+    h = (h / 6.) % 1.
+    h[flat] = 0
+    target[:, 0] = h
+    target[:, 1] = s
+    target[:, 2] = v
+
+
+@_kernel
+def hsv2rgb(source, target):
+    h, s, v = source[:, 0], source[:, 1], source[:, 2]
+    hi = numpy.floor(h * 6)
+    f = h * 6 - hi
+    p = v * (1 - s)
+    q = v * (1 - f * s)
+    t = v * (1 - (1 - f) * s)
+    v = v.copy()
+    hi = hi.astype(numpy.uint8) % 6
+    target[:, 0] = numpy.choose(hi, (v, q, p, p, t, v))
+    target[:, 1] = numpy.choose(hi, (t, v, v, q, p, p))
+    target[:, 2] = numpy.choose(hi, (p, p, t, v, v, q))
+
+
+def _linear(source):
+    return numpy.where(source > 0.04045, numpy.power((source + 0.055) / 1.055, 2.4), source / 12.92)
+
+
+def _xyz(source):
+    return numpy.dot(_linear(source), _constant(XYZ_FROM_RGB, source.dtype).T)
+
+
+@_kernel
+def rgb2xyz(source, target):
+    target[...] = _xyz(source)
+
+
+@_kernel
+def xyz2rgb(source, target):
+    linear = numpy.dot(source, _constant(RGB_FROM_XYZ, source.dtype).T)
+    rgb = numpy.where(linear > 0.0031308, 1.055 * numpy.power(linear, 1 / 2.4) - 0.055, linear * 12.92)
+    numpy.clip(rgb, 0, 1, out=target)
+
+
+def _lab(xyz):
+    scaled = xyz / _constant(WHITE, xyz.dtype)
+    scaled = numpy.where(scaled > 0.008856, numpy.power(scaled, 1. / 3.), 7.787 * scaled + 16. / 116.)
+    x, y, z = scaled[:, 0], scaled[:, 1], scaled[:, 2]
+    return (116. * y) - 16., 500.0 * (x - y), 200.0 * (y - z)
+
+
+def _luv(xyz):
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    u0, v0 = _scalar(U0, xyz.dtype), _scalar(V0, xyz.dtype)
+    l = y / _scalar(WHITE[1], xyz.dtype)
+    l = numpy.where(l > 0.008856, 116. * numpy.power(l, 1. / 3.) - 16., 903.3 * l)
+    denominator = x + 15. * y + 3. * z + _scalar(EPS, xyz.dtype)
+    return l, 13. * l * ((4. * x) / denominator - u0), 13. * l * ((9. * y) / denominator - v0)
+
+
+def _store(target, components):
+    for index, component in enumerate(components):
+        target[:, index] = component
+
+
+@_kernel
+def xyz2lab(source, target):
+    _store(target, _lab(source))
+
+
+@_kernel
+def rgb2lab(source, target):
+    _store(target, _lab(_xyz(source)))
+
+
+@_kernel
+def lab2xyz(source, target):
+    l, a, b = source[:, 0], source[:, 1], source[:, 2]
+    y = (l + 16.) / 116.
+    xyz = numpy.empty(source.shape, dtype=source.dtype)
+    xyz[:, 0] = (a / 500.) + y
+    xyz[:, 1] = y
+    xyz[:, 2] = numpy.maximum(y - (b / 200.), 0)
+    xyz = numpy.where(xyz > 0.2068966, numpy.power(xyz, 3.), (xyz - 16.0 / 116.) / 7.787)
+    numpy.multiply(xyz, _constant(WHITE, source.dtype), out=target)
+
+
+@_kernel
+def lab2rgb(source, target):
+    xyz2rgb(lab2xyz(source), target)
+
+
+@_kernel
+def xyz2luv(source, target):
+    _store(target, _luv(source))
+
+
+@_kernel
+def rgb2luv(source, target):
+    _store(target, _luv(_xyz(source)))
+
+
+@_kernel
+def luv2xyz(source, target):
+    l, u, v = source[:, 0], source[:, 1], source[:, 2]
+    eps = _scalar(EPS, source.dtype)
+    y = numpy.where(l > 7.999625, numpy.power((l + 16.) / 116., 3.), l / 903.3) * _scalar(WHITE[1], source.dtype)
+    a = _scalar(U0, source.dtype) + u / (13. * l + eps)
+    b = _scalar(V0, source.dtype) + v / (13. * l + eps)
+    c = 3 * y * (5 * b - 3)
+    z = ((a - 4) * c - 15 * a * b * y) / (12 * b)
+    _store(target, (-(c / b + 3. * z), y, z))
+
+
+@_kernel
+def luv2rgb(source, target):
+    xyz2rgb(luv2xyz(source), target)
+
+
+@_kernel
+def rgb2hed(source, target):
+    # Color deconvolution, as skimage.color.separate_stains does it.
+    density = numpy.log(numpy.maximum(source, 1e-6)) / LOG_ADJUST
+    numpy.maximum(numpy.dot(density, _constant(HED_FROM_RGB, source.dtype)), 0, out=target)
+
+
+@_kernel
+def hed2rgb(source, target):
+    # The inverse of rgb2hed, as skimage.color.combine_stains does it.
+    density = numpy.dot(source * LOG_ADJUST, _constant(RGB_FROM_HED, source.dtype))
+    numpy.clip(numpy.exp(density), 0, 1, out=target)
@@ -0,0 +1,136 @@
+import collections
+import os
+import tempfile
+import numpy
+from numpy import arange, empty, float64, intp, uint8
+from .utils import rgb_normalize
+
+
+class LookupTable(collections.namedtuple('LookupTable', ('table', 'levels'))):
+    """
+    A 3D lookup table with the result of a mapper over a regular grid of the RGB cube.
+      The table has shape (levels, levels, levels, 3) and is indexed by [r, g, b].
+
+    With 256 levels, the grid has every uint8 color, and mapping a uint8 image is a single
+      gather giving exactly what running the mapper over the normalized image would give.
+      With fewer levels (or float images) the table is trilinearly interpolated.
+
+    Only the RGB components go through the table: alpha, if present, is passed through.
+      So mappers whose maskers or actions depend on (or change) the alpha channel cannot
+      be turned into lookup tables.
+    """
+
+    @classmethod
+    def build(cls, mapper, levels=256, cache=True, dtype=float64):
+        """
+        Evaluates a mapper over the RGB cube grid. The cube is mapped one red slab at a time,
+          into reused slab buffers, and written into the table (in its dtype), so memory is
+          bounded by the table size plus a slab.
+        :param mapper: The mapper to evaluate.
+        :param levels: The amount of levels per component (2..256).
+        :param cache: Whether the mapper should cache its conversions (per slab).
+        :param dtype: The dtype of the table.
+        :return:
+        """
+
+        if not 2 <= levels <= 256:
+            raise ValueError('levels must be between 2 and 256')
+        grid = arange(levels) / float(levels - 1)
+        table = empty((levels, levels, levels, 3), dtype=dtype)
+        slab = empty((levels, levels, 3))
+        slab[:, :, 1] = grid[:, None]
+        slab[:, :, 2] = grid[None, :]
+        mapped = empty(slab.shape, dtype=slab.dtype if mapper.dtype is None else mapper.dtype)
+        for red in range(levels):
+            slab[:, :, 0] = grid[red]
+            table[red] = mapper.run(slab, cache, out=mapped, dedup=False)
+        return cls(table, levels)
+
+    def apply(self, image):
+        """
+        Maps an image through the table. uint8 images are normalized, as rgb_normalize does.
+        :param image: A (H, W, 3) or (H, W, 4) image, either uint8 or 0..1-valued.
+        :return: The mapped 0..1-valued image.
+        """
+
+        if len(image.shape) != 3 or image.shape[2] not in (3, 4):
+            raise ValueError("Image to be mapped must have three dimensions (non-palette colors)")
+
+        if image.dtype == uint8 and self.levels == 256:
+            index = image[:, :, 0].astype(intp) << 16
+            index |= image[:, :, 1].astype(intp) << 8
+            index |= image[:, :, 2]
+            result = self.table.reshape((-1, 3))[index]
+        else:
+            result = self._interpolate(rgb_normalize(image[:, :, :3]))
+
+        if image.shape[2] == 4:
+            return numpy.dstack((result, rgb_normalize(image[:, :, 3])))
+        return result
+
+    def _interpolate(self, image):
+        """
+        Trilinearly interpolates the table for a 0..1-valued RGB image.
+        :param image:
+        :return:
+        """
+
+        top = self.levels - 1
+        scaled = numpy.clip(image, 0., 1.) * top
+        lower = numpy.minimum(scaled.astype(intp), top - 1)
+        weights = scaled - lower
+        flat = self.table.reshape((-1, 3))
+        result = numpy.zeros(image.shape, dtype=self.table.dtype)
+        for dr in (0, 1):
+            wr = weights[:, :, 0] if dr else 1 - weights[:, :, 0]
+            for dg in (0, 1):
+                wg = weights[:, :, 1] if dg else 1 - weights[:, :, 1]
+                for db in (0, 1):
+                    wb = weights[:, :, 2] if db else 1 - weights[:, :, 2]
+                    index = ((lower[:, :, 0] + dr) * self.levels + lower[:, :, 1] + dg) * self.levels + \
+                        lower[:, :, 2] + db
+                    result += flat[index] * (wr * wg * wb)[:, :, None]
+        return result
+
+
+class LookupTableCache(object):
+    """
+    Keeps lookup tables in a directory, as .npy files keyed by the mapper fingerprint, the
+      levels, and the dtype. Tables are memory-mapped when loaded, so repeated runs pay
+      neither the mapper evaluation nor reading the whole table up front.
+
+    Mappers whose fingerprint cannot be computed (see Mapper.fingerprint) must be given an
+      explicit key, which must change whenever their definition does.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, mapper, levels=256, dtype=float64, key=None):
+        return os.path.join(self.directory, '%s-%d-%s.npy' % (mapper.fingerprint() if key is None else key,
+                                                             levels, numpy.dtype(dtype).name))
+
+    def get(self, mapper, levels=256, cache=True, dtype=float64, key=None):
+        """
+        Gets the lookup table for a mapper, building and storing it if it is not there.
+        :param mapper:
+        :param levels:
+        :param cache:
+        :param dtype:
+        :param key: An explicit key for the mapper, instead of its fingerprint.
+        :return:
+        """
+
+        path = self.path(mapper, levels, dtype, key)
+        if os.path.exists(path):
+            return LookupTable(numpy.load(path, mmap_mode='r'), levels)
+
+        lut = LookupTable.build(mapper, levels, cache, dtype)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Write aside and rename, so concurrent readers never see a partial table.
+        handle, temporary = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        with os.fdopen(handle, 'wb') as table_file:
+            numpy.save(table_file, lut.table)
+        os.rename(temporary, path)
+        return lut
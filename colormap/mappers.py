@@ -1,8 +1,243 @@
 import collections
-from numpy import ones, zeros
-from .spaces import rgb, ColorSpace, RGB
-from cantrips.watch.expression import Expression
-from cantrips.watch.scope import Scope
+import hashlib
+import threading
+import time
+import numpy
+from numpy import asarray, empty, stack
+from .spaces import rgb, ColorSpace, ColorSpaceWrapper, RGB
+from .utils import tiles, ScratchArena
+from .compiler import compile_expression, is_expression, lower, canonical, LoweredExpression
+from .profiling import Profile
+
+
+THREADS = 'threads'
+PROCESSES = 'processes'
+DEFAULT_TILE_SHAPE = (256, 256)
+DEDUP_RATIO = 0.25
+DEDUP_SAMPLE = 4096
+SPARSE_RATIO = 0.25
+COMPACT_RATIO = 0.5
+
+
+class ConversionCache(object):
+    """
+    A colorspace conversion cache that persists across runs (and mappers). Conversions are
+      keyed by the image (by default, a digest of its contents, shape and dtype) and the
+      colorspace components, and are evicted in least-recently-used order to keep their
+      total size within a byte budget.
+
+    It is safe to share the cache among threads (e.g. a THREADS run, or concurrent runs).
+      Processes (e.g. the workers of a PROCESSES run, when pickled to them) get caches of
+      their own: pickled caches are empty, with the same byte budget.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_key(image):
+        """
+        Computes the identity of an image by its contents.
+        :param image:
+        :return:
+        """
+
+        digest = hashlib.sha1(numpy.ascontiguousarray(image).view(numpy.uint8)).hexdigest()
+        return digest, image.shape, image.dtype.str
+
+    def bind(self, image, key=None):
+        """
+        Gets a view of this cache for a single image, usable as a MappingContext cache.
+        :param image: The image whose conversions will be looked up and stored.
+        :param key: An optional key identifying the image, instead of its digest.
+        :return:
+        """
+
+        return _BoundConversionCache(self, self.image_key(image) if key is None else key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                return value
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Gets a conversion, if it is kept, without counting it as a hit or a miss (nor as
+          recently used).
+        """
+
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def put(self, key, value):
+        size = value.nbytes
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key).nbytes
+            if size > self.max_bytes:
+                return
+            while self.bytes + size > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1].nbytes
+            self._entries[key] = value
+            self.bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+
+class _BoundConversionCache(object):
+    """
+    The dictionary-like view of a ConversionCache for a single image, keyed by colorspace.
+    """
+
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+
+    def get(self, colorspace, default=None):
+        return self._cache.get((self._key, colorspace.components), default)
+
+    def peek(self, colorspace, default=None):
+        return self._cache.peek((self._key, colorspace.components), default)
+
+    def __setitem__(self, colorspace, wrapper):
+        self._cache.put((self._key, colorspace.components), wrapper)
+
+
+def _float_dtype(array):
+    """
+    The dtype of the colorspace conversions of an array.
+    """
+
+    return array.dtype if array.dtype in (numpy.float32, numpy.float64) else numpy.dtype(numpy.float64)
+
+
+def _scratch(arena, name, like):
+    """
+    Gets a scratch buffer for the conversions of an array, or None if there is no arena.
+    """
+
+    return None if arena is None else arena.buffer(name, like.shape, _float_dtype(like))
+
+
+class Mask(collections.namedtuple('Mask', ('shape', 'array', 'indices'))):
+    """
+    The pixels of a frame matched by a mapping entry. Dense masks keep a (rows, columns)
+      boolean array. Sparse masks keep the sorted flat indices of the matched pixels
+      instead, so gathering and scattering them (and claiming them out of the remaining
+      pixels) takes time proportional to the matched pixels rather than the frame size.
+
+    Mapper runs choose, per entry, the sparse representation when the entry's masker
+      matches at most SPARSE_RATIO of the frame (e.g. a hue key over a small sprite area).
+    """
+
+    @classmethod
+    def dense(cls, array):
+        return cls(array.shape, array, None)
+
+    @classmethod
+    def sparse(cls, shape, indices):
+        return cls(tuple(shape), None, indices)
+
+    @classmethod
+    def claim(cls, matches, taken, ratio=None, out=None):
+        """
+        Creates the mask of the matched pixels not taken yet, and marks them as taken.
+        :param matches: The boolean (rows, columns) array of pixels matched by a masker.
+        :param taken: The boolean (rows, columns) array of pixels matched by former entries.
+          It is updated in place.
+        :param ratio: The matched-pixels ratio up to which the mask is sparse (by default,
+          SPARSE_RATIO).
+        :param out: An optional buffer for the dense mask.
+        :return:
+        """
+
+        ratio = SPARSE_RATIO if ratio is None else ratio
+        if numpy.count_nonzero(matches) <= ratio * matches.size:
+            indices = numpy.flatnonzero(matches)
+            flat_taken = taken.reshape(-1)
+            indices = indices[~flat_taken[indices]]
+            flat_taken[indices] = True
+            return cls.sparse(matches.shape, indices)
+        # For booleans, matches & ~taken is matches > taken.
+        array = numpy.greater(matches, taken, out=out)
+        taken |= array
+        return cls.dense(array)
+
+    @property
+    def is_sparse(self):
+        return self.indices is not None
+
+    def count(self):
+        return len(self.indices) if self.is_sparse else numpy.count_nonzero(self.array)
+
+    def to_array(self):
+        """
+        Gets the (rows, columns) boolean array of this mask.
+        """
+
+        if not self.is_sparse:
+            return self.array
+        array = numpy.zeros(self.shape, dtype=bool)
+        array.reshape(-1)[self.indices] = True
+        return array
+
+    def _positions(self):
+        return numpy.divmod(self.indices, self.shape[1])
+
+    def gather(self, image, arena=None, name='chunk'):
+        """
+        Gathers the masked pixels of an image (of this mask's frame shape) as a (pixels,
+          components) chunk, into a scratch buffer when possible.
+        :param image:
+        :param arena:
+        :param name:
+        :return:
+        """
+
+        components = image.shape[-1]
+        if arena is None or not image.flags.c_contiguous:
+            if self.is_sparse:
+                rows, cols = self._positions()
+                return image[rows, cols]
+            return image[self.array]
+        flat = image.reshape((-1, components))
+        out = arena.buffer(name, (self.count(), components), image.dtype)
+        if self.is_sparse:
+            return numpy.take(flat, self.indices, axis=0, out=out)
+        return numpy.compress(self.array.ravel(), flat, axis=0, out=out)
+
+    def scatter(self, image, chunk):
+        """
+        Writes a (pixels, components) chunk into the masked pixels of an image.
+        :param image:
+        :param chunk:
+        :return:
+        """
+
+        if self.is_sparse:
+            rows, cols = self._positions()
+            image[rows, cols] = chunk
+        else:
+            image[self.array] = chunk
 
 
 class MappingContext(collections.namedtuple('_MappingContext', ('image', 'cache'))):
@@ -16,17 +251,44 @@ class MappingContext(collections.namedtuple('_MappingContext', ('image', 'cache'
 
     Even if it is not allowed to cache, will store the last processing result.
 
+    The cache may be a ConversionCache, to share the conversions across runs. Otherwise,
+      if a scratch arena is given, conversions are written into its buffers (one per
+      colorspace) instead of new arrays.
+
     Another use is in a masked-chunk level. In this case, the initial rgb image
       is not the full one, but just a chunk determined by a formerly-existent
-      mask. The usage, however, is the same.
+      mask. The usage, however, is the same. Such contexts may be given the context
+      of the full image (and the mask), so conversions already processed there are
+      gathered instead of converting the chunk again, and a prefix to tell their
+      scratch buffers apart.
+
+    Conversions are recorded in the given profile, if any.
     """
 
-    def __new__(cls, image, cache):
-        value = super(MappingContext, cls).__new__(cls, image, {} if cache else None)
+    def __new__(cls, image, cache, arena=None, parent=None, mask=None, prefix='', profile=None):
+        if isinstance(cache, ConversionCache):
+            cache = cache.bind(image)
+            arena = None
+        else:
+            cache = {} if cache else None
+        value = super(MappingContext, cls).__new__(cls, image, cache)
         value.__colorspace = rgb
+        value.__arena = arena
+        value.__parent = parent
+        value.__mask = mask
+        value.__prefix = prefix
+        value.__profile = profile
         value._set_last(None, None)
         return value
 
+    @property
+    def arena(self):
+        return self.__arena
+
+    @property
+    def profile(self):
+        return self.__profile
+
     def _set_last(self, space, image):
         self.__last_image = image
         self.__last_space = space
@@ -48,23 +310,111 @@ class MappingContext(collections.namedtuple('_MappingContext', ('image', 'cache'
         If the requested format is rgb we return the initial image.
         If the requested format is the same last format, we return the same last image.
         Otherwise we compute it or recover it from cache, according to the case.
+        Colorspaces having a source colorspace are computed from the (processed) source.
         """
 
-        if not isinstance(rgb, ColorSpace):
+        if not isinstance(colorspace, ColorSpace):
             raise TypeError("process_image() expects a single parameter of type ColorSpace")
 
         if colorspace == rgb:
             return RGB(self.image)
 
         if colorspace == self.__last_space:
+            if self.__profile is not None:
+                self.__profile.conversion(colorspace.components, 'cached')
             return self.__last_image
 
         if self.cache is None:
-            return self._set_last(colorspace, colorspace.encoder(self.image))
+            return self._set_last(colorspace, self._convert(colorspace))
         else:
-            if colorspace not in self.cache:
-                self.cache[colorspace] = self._set_last(colorspace, colorspace.encoder(self.image))
-            return self.cache[colorspace]
+            wrapper = self.cache.get(colorspace)
+            if wrapper is None:
+                wrapper = self._convert(colorspace)
+                self.cache[colorspace] = wrapper
+            elif self.__profile is not None:
+                self.__profile.conversion(colorspace.components, 'cached')
+            return self._set_last(colorspace, wrapper)
+
+    def _convert(self, colorspace):
+        if self.__profile is None:
+            return self._compute(colorspace)[0]
+        start = time.time()
+        wrapper, kind = self._compute(colorspace)
+        self.__profile.conversion(colorspace.components, kind, time.time() - start,
+                                  self.image.shape[0] * self.image.shape[1])
+        return wrapper
+
+    def _compute(self, colorspace):
+        """
+        Converts the image to the given colorspace, telling whether it was computed or gathered.
+        """
+
+        if self.__parent is not None:
+            wrapper = self.__parent.gather(colorspace, self.__mask, self.__prefix + colorspace.components + '-')
+            if wrapper is not None:
+                return type(wrapper)(wrapper._.reshape(self.image.shape)), 'gathered'
+        out = _scratch(self.__arena, self.__prefix + 'convert-' + colorspace.components, self.image)
+        if colorspace.source is not None:
+            return colorspace.from_source(self.process_image(colorspace.source), out), 'computed'
+        return colorspace.encoder(self.image, out), 'computed'
+
+    def _processed(self, colorspace):
+        """
+        Gets the image in the given colorspace only if it was already processed.
+        """
+
+        if colorspace == self.__last_space:
+            return self.__last_image
+        if isinstance(self.cache, _BoundConversionCache):
+            # Looking for conversions to gather from is not a use of the cache.
+            return self.cache.peek(colorspace)
+        if self.cache is not None:
+            return self.cache.get(colorspace)
+
+    def gather(self, colorspace, mask, prefix=''):
+        """
+        Gets the masked pixels in the given colorspace, only if that can be done from an
+          already-processed image (in the same colorspace, or in its source colorspace),
+          instead of converting the masked pixels from plain-rgb. Otherwise, returns None.
+        :param colorspace:
+        :param mask:
+        :param prefix: A prefix for the names of the scratch buffers to gather into.
+        :return:
+        """
+
+        wrapper = self._processed(colorspace)
+        if wrapper is not None:
+            return type(wrapper)(mask.gather(wrapper._, self.__arena, prefix + 'gathered'))
+        if colorspace.source is not None:
+            wrapper = self._processed(colorspace.source)
+            if wrapper is not None:
+                gathered = mask.gather(wrapper._, self.__arena, prefix + 'gathered')
+                return colorspace.from_source(type(wrapper)(gathered),
+                                              _scratch(self.__arena, prefix + 'encoded', gathered))
+
+
+def _compiled(func, colorspace):
+    """
+    Expressions (and lowered ones) are compiled (once) into plain functions taking the
+      wrapper. Other callables are kept as they are.
+    """
+
+    if is_expression(func) or isinstance(func, LoweredExpression):
+        return compile_expression(func, colorspace.components)
+    return func
+
+
+def _function(node, func):
+    """
+    Gets the compiled function of a masker or action. It is kept in the node's dictionary,
+      which copies (made by _replace or _make, or unpickled) lack: they compile their own
+      on first use.
+    """
+
+    function = node.__dict__.get('_function')
+    if function is None:
+        function = node.__dict__['_function'] = _compiled(func, node.colorspace)
+    return function
 
 
 class Masker(collections.namedtuple('Masker', ('masker', 'colorspace'))):
@@ -74,19 +424,18 @@ class Masker(collections.namedtuple('Masker', ('masker', 'colorspace'))):
     """
 
     def __new__(cls, masker, colorspace=rgb):
-        if not isinstance(rgb, ColorSpace):
+        if not isinstance(colorspace, ColorSpace):
             raise TypeError("`colorspace` parameter for Masker must be a ColorSpace instance")
-        return super(Masker, cls).__new__(cls, masker, colorspace)
+        value = super(Masker, cls).__new__(cls, masker, colorspace)
+        value._function = _compiled(masker, colorspace)
+        return value
 
     def get_mask(self, context):
-        wrapper = context.process_image(self.colorspace)
-        if isinstance(self.masker, Expression):
-            scope = Scope()
-            setattr(scope, self.colorspace.components, wrapper)
-            result = scope['$eval'](self.masker)
-        else:
-            result = self.masker(wrapper)
-        return result
+        return _function(self, self.masker)(context.process_image(self.colorspace))
+
+    def __getstate__(self):
+        # Compiled functions are not pickled: unpickled maskers compile their own.
+        return None
 
 
 class Action(collections.namedtuple('Action', ('action', 'colorspace'))):
@@ -97,38 +446,42 @@ class Action(collections.namedtuple('Action', ('action', 'colorspace'))):
     """
 
     def __new__(cls, action, colorspace=rgb):
-        if not isinstance(rgb, ColorSpace):
+        if not isinstance(colorspace, ColorSpace):
             raise TypeError("`colorspace` parameter for Action must be a ColorSpace instance")
-        return super(Action, cls).__new__(cls, action, colorspace)
+        value = super(Action, cls).__new__(cls, action, colorspace)
+        value._function = _compiled(action, colorspace)
+        return value
+
+    def __getstate__(self):
+        # Compiled functions are not pickled: unpickled actions compile their own.
+        return None
 
-    def execute(self, chunk):
+    def execute(self, chunk, encoded=None, arena=None):
         """
         Executes the action, taking the chunk in RGB[A] and returning it in RGB[A] as well but having
           a specific colorspace for processing.
         :param chunk:
+        :param encoded: The chunk, if already available in the action's colorspace.
+        :param arena: An optional scratch arena to convert the chunk into and back.
         :return:
         """
 
         # Wrap the input
         if self.colorspace == rgb:
             wrapper = RGB(chunk)
+        elif encoded is not None:
+            wrapper = encoded
         else:
-            wrapper = self.colorspace.encoder(chunk)
+            wrapper = self.colorspace.encoder(chunk, _scratch(arena, 'encoded', chunk))
 
         # Process input -> output
-        if isinstance(self.action, Expression):
-            # Assign the wrapper as scope member with appropriate name.
-            scope = Scope()
-            setattr(scope, self.colorspace.components, wrapper)
-            result = scope['$eval'](self.action)
-        else:
-            result = self.action(wrapper)
+        result = _function(self, self.action)(wrapper)
 
         # Unwrap the output
         if self.colorspace == rgb:
-            return result
+            return result._ if isinstance(result, ColorSpaceWrapper) else result
         else:
-            return self.colorspace.decoder(result)
+            return self.colorspace.decoder(result, _scratch(arena, 'decoded', chunk))
 
 
 class MappingEntry(collections.namedtuple('MappingEntry', ('masker', 'actions'))):
@@ -150,13 +503,71 @@ class MappingEntry(collections.namedtuple('MappingEntry', ('masker', 'actions'))
         return self
 
 
-class Mapper(collections.namedtuple('Mapper', ('entries',))):
+def _color_keys(image):
+    """
+    Views each pixel of an image as a single opaque value, so pixels having the same
+      bytes (i.e. the same color) have the same key.
+    """
+
+    pixels = numpy.ascontiguousarray(image).reshape((-1, image.shape[2]))
+    return pixels.view(numpy.dtype((numpy.void, pixels.dtype.itemsize * pixels.shape[1]))).ravel()
+
+
+def _sampled_ratio(image):
+    """
+    The distinct-color ratio of a sample of (about DEDUP_SAMPLE) evenly spaced pixels of
+      an image. Only the sampled pixels are copied.
+    """
+
+    pixels = image.shape[0] * image.shape[1]
+    rows, cols = numpy.divmod(numpy.arange(0, pixels, max(1, pixels // DEDUP_SAMPLE)), image.shape[1])
+    sample = _color_keys(image[rows, cols][:, numpy.newaxis, :])
+    return len(numpy.unique(sample)) / float(len(sample))
+
+
+_process_job = None
+
+
+def _process_init(mapper, image, cache, profiled=False):
+    """
+    Initializes a worker process of a parallel run. Under fork-based process pools
+      the arguments are inherited instead of being pickled.
+    """
+
+    global _process_job
+    _process_job = (mapper, image, cache, ScratchArena(), profiled)
+
+
+def _process_tile(tile):
+    """
+    Runs the mapping over a single tile inside a worker process, and returns
+      the mapped tile back to the parent process (with the tile's profile, if
+      the run is profiled).
+    """
+
+    mapper, image, cache, arena, profiled = _process_job
+    chunk = image[tile]
+    out = empty(chunk.shape, dtype=chunk.dtype)
+    profile = Profile() if profiled else None
+    mapper._run_frame(chunk, cache, out, arena, profile)
+    return out, profile
+
+
+class Mapper(collections.namedtuple('Mapper', ('entries', 'dtype'))):
     """
     Mapper object.
+
+    The mapper may have a float precision (float32 or float64). When it has one, images
+      are cast to it, and conversions, chunks and output are kept in that precision. With
+      float32, half the memory (and bandwidth) of float64 is used. Against float64, the
+      mapped values differ by about 3e-8 (4e-7 at the 99th percentile), so after
+      rgb_denormalize to uint8 about one component in 100000 is off by one level. Pixels
+      lying within float32 rounding of a masker bound (e.g. an IN bound, or the hue wrap)
+      may be matched by another entry: about 0.01% of the pixels of a uniform-noise image.
     """
 
-    def __new__(cls):
-        return super(Mapper, cls).__new__(cls, [])
+    def __new__(cls, dtype=None):
+        return super(Mapper, cls).__new__(cls, [], dtype)
 
     def on(self, masker, colorspace=rgb):
         """
@@ -167,31 +578,325 @@ class Mapper(collections.namedtuple('Mapper', ('entries',))):
         self.entries.append(entry)
         return entry
 
-    def run(self, image, cache):
+    def fingerprint(self):
+        """
+        Computes a digest of the mapping definition (maskers, actions, their colorspaces, and
+          the precision), stable across processes, to key results that depend only on the definition.
+          Raises TypeError if a masker or action refers a callable whose state cannot be told
+          (see colormap.compiler.canonical).
+        :return:
+        """
+
+        definition = [(lower(entry.masker.masker), entry.masker.colorspace.components,
+                       [(lower(action.action), action.colorspace.components) for action in entry.actions])
+                      for entry in self.entries]
+        definition.append(None if self.dtype is None else numpy.dtype(self.dtype).str)
+        return hashlib.sha1(canonical(definition).encode('utf-8')).hexdigest()
+
+    def __reduce__(self):
+        # Expressions do not pickle, so mappers are pickled as their plan.
+        from .plans import MappingPlan, _plan_mapper
+        return _plan_mapper, (MappingPlan.of(self),)
+
+    def run(self, image, cache, tile_shape=None, out=None, workers=1, pool=THREADS, dedup=None,
+            dedup_ratio=DEDUP_RATIO, stats=None, profile=None):
         """
         Runs the mapping. Returns the mapped image.
+
+        When a tile shape is given, the image is streamed through the maskers and actions
+          tile by tile, and each tile's result is written into the output image. Since
+          every masker and action works pixel-wise, the result is the same as in the
+          full-frame run, while the intermediate masks and colorspace conversions (and
+          the cache, if any) only live for the current tile.
+
+        When more than one worker is requested, tiles (DEFAULT_TILE_SHAPE, if no tile
+          shape is given) are mapped concurrently. Each tile is written in its own region
+          of the output, so the result is the same regardless the amount of workers.
+
+        Images with few distinct colors (e.g. sprites and palette-like art) can be mapped
+          by deduplication instead: the maskers and actions run over the distinct colors
+          only, and the results are scattered back to the pixels. When not told explicitly,
+          deduplication is used when the distinct-color ratio of a sample of the pixels is
+          below the given ratio, unless a tile shape is given: deduplication needs arrays
+          of the whole frame (and a contiguous copy of it, if the image is not contiguous).
+
+        Each entry takes the pixels its masker matches among the ones not taken by former
+          entries. Once at most COMPACT_RATIO of the pixels are left, they are compacted and
+          the following maskers are evaluated over them only, and no more maskers are
+          evaluated once every pixel is taken.
         :param image:
-        :param cache:
+        :param cache: Whether to cache the colorspace conversions during this run, or a
+          ConversionCache to share them across runs.
+        :param tile_shape: An optional (rows, columns) pair to run the mapping tile by tile.
+        :param out: An optional preallocated output image, with the same shape of the input.
+        :param workers: The amount of workers to map the tiles with.
+        :param pool: Either THREADS (the default) or PROCESSES. Process pools rely on fork
+          to share the mapper and image with the workers, and otherwise pickle them (the
+          mapper is pickled as its plan, see colormap.plans).
+        :param dedup: Whether to map the distinct colors only (True), the whole image (False),
+          or to choose it according to the sampled distinct-color ratio (None, the default;
+          tiled runs are not deduplicated then).
+        :param dedup_ratio: The distinct-color ratio below which deduplication is chosen.
+        :param stats: An optional dictionary to fill with the pixel and distinct-color counts,
+          the distinct-color ratio, whether deduplication was used, the timings, and the
+          amount of scratch buffer allocations (and their bytes) the run needed. Conversions
+          and masked chunks are written into scratch buffers reused across the entries,
+          actions and tiles of the run (except for process pools, and for conversions kept
+          by a ConversionCache).
+        :param profile: An optional colormap.profiling.Profile to record the time of each
+          masker, action and conversion into (and the stats of the run).
         :return:
         """
 
         if len(image.shape) != 3 or image.shape[2] not in (3, 4):
             raise ValueError("Image to be masked must have three dimensions (non-palette colors)")
 
-        context = MappingContext(image, cache)
-        # Guess the masks. Keep the remaining mask.
+        if self.dtype is not None:
+            image = image.astype(self.dtype, copy=False)
+
+        if out is None:
+            out = empty(image.shape, dtype=image.dtype)
+        elif out.shape != image.shape:
+            raise ValueError("Output image must have the same shape of the image to be masked")
+
+        if stats is None:
+            stats = {}
+        stats['pixels'] = image.shape[0] * image.shape[1]
+        if dedup is None:
+            # Deduplicating takes whole-frame arrays, so tiled runs (whose memory is bounded
+            #   by the tile size) only deduplicate when told explicitly.
+            if tile_shape is None:
+                stats['sampled_ratio'] = _sampled_ratio(image)
+                dedup = stats['sampled_ratio'] < dedup_ratio
+            else:
+                dedup = False
+        stats['dedup'] = dedup
+
+        start = time.time()
+        arena = ScratchArena()
+        if dedup:
+            self._run_unique(image, cache, tile_shape, out, workers, pool, stats, arena, _color_keys(image), profile)
+        else:
+            self._dispatch(image, cache, tile_shape, out, workers, pool, arena, profile)
+        stats['seconds'] = time.time() - start
+        stats['allocations'] = arena.allocations
+        stats['allocated_bytes'] = arena.bytes
+        if profile is not None:
+            profile.run(stats, cache)
+        return out
+
+    def _run_unique(self, image, cache, tile_shape, out, workers, pool, stats, arena, keys, profile=None):
+        """
+        Runs the mapping over the distinct colors of the image, and scatters the results.
+        :param image:
+        :param cache:
+        :param tile_shape:
+        :param out:
+        :param workers:
+        :param pool:
+        :param stats:
+        :param arena:
+        :param keys:
+        :param profile:
+        :return:
+        """
+
+        start = time.time()
+        _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+        colors = image.reshape((-1, image.shape[2]))[first][:, numpy.newaxis, :]
+        stats['distinct_colors'] = len(colors)
+        stats['distinct_ratio'] = len(colors) / float(stats['pixels'])
+        stats['unique_seconds'] = time.time() - start
+
+        start = time.time()
+        mapped = empty(colors.shape, dtype=colors.dtype)
+        self._dispatch(colors, cache, tile_shape, mapped, workers, pool, arena, profile)
+        stats['map_seconds'] = time.time() - start
+
+        start = time.time()
+        out[...] = mapped[:, 0, :][inverse.reshape(image.shape[0:2])]
+        stats['scatter_seconds'] = time.time() - start
+
+    def _dispatch(self, image, cache, tile_shape, out, workers, pool, arena, profile=None):
+        """
+        Runs the mapping over the image in parallel, by tiles, or in a single frame, according
+          to the given tile shape and workers.
+        :param image:
+        :param cache:
+        :param tile_shape:
+        :param out:
+        :param workers:
+        :param pool:
+        :param arena:
+        :param profile:
+        :return:
+        """
+
+        if workers > 1:
+            self._run_parallel(image, cache, tile_shape or DEFAULT_TILE_SHAPE, out, workers, pool, arena, profile)
+        elif tile_shape is None:
+            self._run_frame(image, cache, out, arena, profile)
+        else:
+            for rows, cols in tiles(image.shape, tile_shape):
+                self._run_frame(image[rows, cols], cache, out[rows, cols], arena, profile)
+
+    def run_batch(self, images, cache, tile_shape=None, workers=1, pool=THREADS, dedup=None,
+                  dedup_ratio=DEDUP_RATIO, stats=None, profile=None):
+        """
+        Runs the mapping over a batch of same-shaped images. Returns the stacked mapped images.
+
+        The frames are laid one below the other as a single tall image, so the colorspace
+          conversions and masks are computed once for the whole batch instead of once per
+          frame (the remaining arguments work as in run()).
+        :param images: A (N, H, W, C) array, or an iterable of (H, W, C) images.
+        :param cache:
+        :param tile_shape:
+        :param workers:
+        :param pool:
+        :param dedup:
+        :param dedup_ratio:
+        :param stats:
+        :param profile:
+        :return: A (N, H, W, C) array.
+        """
+
+        images = asarray(images) if hasattr(images, 'shape') else stack(list(images))
+        if len(images.shape) != 4 or images.shape[3] not in (3, 4):
+            raise ValueError("Images to be masked must be a stack of three-dimensional images (non-palette colors)")
+
+        count, rows, cols, channels = images.shape
+        frames = images.reshape((count * rows, cols, channels))
+        return self.run(frames, cache, tile_shape, None, workers, pool, dedup, dedup_ratio,
+                        stats, profile).reshape(images.shape)
+
+    def _run_parallel(self, image, cache, tile_shape, out, workers, pool, arena, profile=None):
+        """
+        Runs the mapping tile by tile, in a pool of workers.
+        :param image:
+        :param cache:
+        :param tile_shape:
+        :param out:
+        :param workers:
+        :param pool:
+        :param arena: The run's arena. Threads use their own arenas, and add their counts to it.
+        :param profile: The run's profile. Processes send their tiles' profiles back to be merged.
+        :return:
+        """
+
+        # Pools are imported on the first parallel run, so short-lived runs do not pay for them.
+        from multiprocessing.pool import Pool, ThreadPool
+        tile_list = list(tiles(image.shape, tile_shape))
+        if pool == THREADS:
+            # Threads write straight into their own region of the output.
+            local = threading.local()
+            arenas = []
+
+            def run_tile(tile):
+                if not hasattr(local, 'arena'):
+                    local.arena = ScratchArena()
+                    arenas.append(local.arena)
+                self._run_frame(image[tile], cache, out[tile], local.arena, profile)
+
+            executor = ThreadPool(workers)
+            try:
+                executor.map(run_tile, tile_list, 1)
+            finally:
+                executor.close()
+                executor.join()
+            arena.allocations += sum(thread_arena.allocations for thread_arena in arenas)
+            arena.bytes += sum(thread_arena.bytes for thread_arena in arenas)
+        elif pool == PROCESSES:
+            # Processes send their mapped tiles back to be written into the output.
+            executor = Pool(workers, _process_init, (self, image, cache, profile is not None))
+            try:
+                for index, (result, tile_profile) in enumerate(executor.imap(_process_tile, tile_list)):
+                    out[tile_list[index]] = result
+                    if profile is not None:
+                        profile.merge(tile_profile)
+            finally:
+                executor.close()
+                executor.join()
+        else:
+            raise ValueError("pool must be either THREADS or PROCESSES")
+
+    def _compact(self, context, indices, arena=None):
+        """
+        Compacts the given pixels of a frame into a single-column image, and creates its
+          context. Conversions already processed for the whole frame are gathered from it.
+        :param context: The context of the whole frame.
+        :param indices: The flat indices of the pixels to compact.
+        :param arena:
+        :return:
+        """
+
+        remaining = Mask.sparse(context.image.shape[0:2], indices)
+        chunk = remaining.gather(context.image, arena, 'remaining')[:, numpy.newaxis, :]
+        return MappingContext(chunk, True, arena, context, remaining, 'remaining-', context.profile)
+
+    def _run_frame(self, image, cache, out, arena=None, profile=None):
+        """
+        Runs the mapping over a whole frame (or tile), writing into the output frame (or tile).
+        :param image:
+        :param cache:
+        :param out:
+        :param arena: An optional scratch arena for the masks, conversions and chunks.
+        :param profile: An optional profile to record the maskers, actions and conversions into.
+        :return:
+        """
+
+        context = MappingContext(image, cache, arena, profile=profile)
+        # Guess the masks. Keep track of the pixels already taken by an entry. Once few
+        #   pixels are left, compact them (and keep their flat indices), and evaluate the
+        #   following maskers only over the compacted pixels, compacting them again as
+        #   they keep being taken.
         premasked = []
-        initial_mask = ones(image.shape[0:2], dtype=bool)
-        for entry in self.entries:
-            matched_mask = initial_mask & entry.masker.get_mask(context)
-            premasked.append((matched_mask, entry))
-            initial_mask = initial_mask & ~matched_mask
-        # Apply actions on every mask. Apply a null action on the remaining mask.
-        remaining_mask = initial_mask
-        new_image = zeros(image.shape[0:3], dtype=image.dtype)
-        for mask, entry in premasked:
-            new_image[mask] = image[mask]
-            for action in entry.actions:
-                new_image[mask] = action.execute(new_image[mask])
-        new_image[remaining_mask] = image[remaining_mask]
-        return new_image
\ No newline at end of file
+        shape = image.shape[0:2]
+        size = shape[0] * shape[1]
+        if arena is None:
+            taken = numpy.zeros(shape, dtype=bool)
+        else:
+            taken = arena.buffer('taken', shape, bool)
+            taken.fill(False)
+        indices = None
+        left = size
+        for index, entry in enumerate(self.entries):
+            if not left:
+                break
+            if indices is None and left <= COMPACT_RATIO * size:
+                indices = numpy.flatnonzero(~taken)
+                compacted, alive = self._compact(context, indices, arena), numpy.ones(left, dtype=bool)
+            elif indices is not None and left <= COMPACT_RATIO * len(indices):
+                indices = indices[alive]
+                compacted, alive = self._compact(context, indices, arena), numpy.ones(left, dtype=bool)
+            start = None if profile is None else time.time()
+            if indices is None:
+                matches = numpy.broadcast_to(entry.masker.get_mask(context), shape)
+                mask = Mask.claim(matches, taken, out=None if arena is None else arena.buffer('mask-%d' % index, shape,
+                                                                                              bool))
+            else:
+                matches = numpy.broadcast_to(entry.masker.get_mask(compacted), compacted.image.shape[0:2])
+                claimed = numpy.greater(matches.reshape(-1), ~alive)
+                alive &= ~claimed
+                mask = Mask.sparse(shape, indices[claimed])
+            matched = mask.count()
+            left -= matched
+            if profile is not None:
+                profile.masker(index, entry.masker.colorspace.components, time.time() - start, matched, matches.size)
+            premasked.append((index, mask, entry))
+        # Start from the image, so the remaining pixels (and entries without actions) need
+        #   no further work. Each entry's masked chunk is gathered once, goes through all
+        #   the actions, and is scattered once.
+        out[...] = image
+        for index, mask, entry in premasked:
+            if entry.actions:
+                chunk = mask.gather(image, arena, 'chunk')
+                for position, action in enumerate(entry.actions):
+                    start = None if profile is None else time.time()
+                    if position or action.colorspace == rgb:
+                        chunk = action.execute(chunk, None, arena)
+                    else:
+                        # The first action may take its input from the already-processed images.
+                        chunk = action.execute(chunk, context.gather(action.colorspace, mask), arena)
+                    if profile is not None:
+                        profile.action(index, position, action.colorspace.components, time.time() - start, len(chunk))
+                mask.scatter(out, chunk)
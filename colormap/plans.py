@@ -0,0 +1,130 @@
+import collections
+import zlib
+from six.moves import cPickle as pickle
+from . import spaces
+from .compiler import lower, LoweredExpression
+from .mappers import Mapper
+
+
+PLAN_VERSION = 1
+
+
+def _colorspace(components):
+    colorspace = getattr(spaces, components, None)
+    if not isinstance(colorspace, spaces.ColorSpace) or colorspace.components != components:
+        raise ValueError("Unknown colorspace in mapping plan: %r" % (components,))
+    return colorspace
+
+
+def _function(node):
+    # Constant nodes are plain callables (e.g. module-level functions), kept as they are.
+    return node[1] if node[0] == 'const' else LoweredExpression(node)
+
+
+class MappingPlan(collections.namedtuple('MappingPlan', ('entries', 'dtype'))):
+    """
+    A compiled, immutable mapping definition: each entry holds its lowered masker and its
+      lowered actions, with their colorspaces by components (see colormap.compiler). Plans
+      do not refer cantrips expressions, so they serialize into compact bytes (or files) and
+      load in milliseconds: a process pool or a batch job can ship one plan to its workers
+      instead of rebuilding the mapper (or pickling expression graphs). Plans are compiled
+      without importing cantrips, unless they refer a missing attribute (which evaluates to
+      cantrips' Undefined).
+
+    Mappers made from a plan have the same fingerprint of the mapper the plan was made of.
+      Maskers and actions which are plain callables must be picklable (e.g. module-level
+      functions, not lambdas) for the plan to be serialized.
+
+    Plans are pickled: only load them from trusted sources.
+    """
+
+    @classmethod
+    def of(cls, mapper):
+        """
+        Makes the plan of a mapper.
+        :param mapper:
+        :return:
+        """
+
+        entries = tuple((lower(entry.masker.masker), entry.masker.colorspace.components,
+                         tuple((lower(action.action), action.colorspace.components) for action in entry.actions))
+                        for entry in mapper.entries)
+        return cls(entries, mapper.dtype)
+
+    def mapper(self):
+        """
+        Makes a mapper of this plan (once: the mapper is kept by the plan).
+        :return:
+        """
+
+        mapper = self.__dict__.get('_mapper')
+        if mapper is None:
+            mapper = Mapper(self.dtype)
+            for masker, components, actions in self.entries:
+                entry = mapper.on(_function(masker), _colorspace(components))
+                for action, action_components in actions:
+                    entry.do(_function(action), _colorspace(action_components))
+            self.__dict__['_mapper'] = mapper
+        return mapper
+
+    def __getstate__(self):
+        # The mapper kept by the plan is not pickled along.
+        return None
+
+    def fingerprint(self):
+        """
+        Computes the fingerprint of the plan's mapper (see Mapper.fingerprint).
+        :return:
+        """
+
+        return self.mapper().fingerprint()
+
+    def dumps(self):
+        """
+        Serializes the plan into compressed bytes.
+        :return:
+        """
+
+        return zlib.compress(pickle.dumps((PLAN_VERSION, self.entries, self.dtype), pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Loads a plan from the bytes of dumps().
+        :param data:
+        :return:
+        """
+
+        version, entries, dtype = pickle.loads(zlib.decompress(data))
+        if version != PLAN_VERSION:
+            raise ValueError("Unsupported mapping plan version: %r" % (version,))
+        return cls(entries, dtype)
+
+    def save(self, path):
+        """
+        Saves the plan into a file.
+        :param path:
+        :return:
+        """
+
+        with open(path, 'wb') as plan_file:
+            plan_file.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a plan from a file.
+        :param path:
+        :return:
+        """
+
+        with open(path, 'rb') as plan_file:
+            return cls.loads(plan_file.read())
+
+
+def _plan_mapper(plan):
+    """
+    Unpickles a mapper from its plan (see Mapper.__reduce__).
+    """
+
+    return plan.mapper()
@@ -0,0 +1,156 @@
+import collections
+import json
+import threading
+
+
+class Profile(object):
+    """
+    Collects where the time of Mapper runs goes: the wall time and matched pixels of each
+      entry's masker, the wall time and pixels of each action, and the colorspace conversions
+      (computed, served by the cache or by the last conversion, or gathered from the whole
+      frame) with their wall time. Runs also add their stats (e.g. scratch allocations and
+      their bytes), and the cache hits and misses of a ConversionCache.
+
+    Pass a profile to Mapper.run (or run_batch) to fill it. A profile may be filled by
+      several runs (and by the threads or processes of a parallel run): counts and times
+      are added up. Runs without a profile pay a single `is None` check per masker, action
+      and conversion.
+    """
+
+    def __init__(self):
+        self.maskers = collections.OrderedDict()
+        self.actions = collections.OrderedDict()
+        self.conversions = collections.OrderedDict()
+        self.runs = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(records, key, **values):
+        record = records.get(key)
+        if record is None:
+            record = records[key] = dict((name, 0) for name in values)
+        for name, value in values.items():
+            record[name] = record.get(name, 0) + value
+
+    def masker(self, entry, colorspace, seconds, matched, evaluated):
+        """
+        Records an evaluation of an entry's masker.
+        :param entry: The entry index.
+        :param colorspace: The masker colorspace components.
+        :param seconds: The wall time of the evaluation (and of claiming its pixels).
+        :param matched: The pixels the entry took.
+        :param evaluated: The pixels the masker was evaluated over.
+        """
+
+        with self._lock:
+            self._add(self.maskers, (entry, colorspace), calls=1, seconds=seconds, matched=matched,
+                      evaluated=evaluated)
+
+    def action(self, entry, action, colorspace, seconds, pixels):
+        """
+        Records an execution of an entry's action.
+        :param entry: The entry index.
+        :param action: The action index, within the entry.
+        :param colorspace: The action colorspace components.
+        :param seconds: The wall time of the execution (with its conversions).
+        :param pixels: The pixels the action was executed over.
+        """
+
+        with self._lock:
+            self._add(self.actions, (entry, action, colorspace), calls=1, seconds=seconds, pixels=pixels)
+
+    def conversion(self, colorspace, kind, seconds=0., pixels=0):
+        """
+        Records a conversion request of a mapping context.
+        :param colorspace: The colorspace components.
+        :param kind: 'computed', 'cached' (served by the cache, or by the last conversion),
+          or 'gathered' (from the conversion of the whole frame).
+        :param seconds: The wall time spent.
+        :param pixels: The pixels converted (or gathered).
+        """
+
+        with self._lock:
+            self._add(self.conversions, (colorspace, kind), calls=1, seconds=seconds, pixels=pixels)
+
+    def run(self, stats, cache=None):
+        """
+        Records the stats of a whole run.
+        :param stats: The stats dictionary filled by the run.
+        :param cache: The ConversionCache of the run, if any.
+        """
+
+        record = dict(stats)
+        if cache is not None and hasattr(cache, 'hits'):
+            record['cache_hits'], record['cache_misses'], record['cache_bytes'] = cache.hits, cache.misses, cache.bytes
+        with self._lock:
+            self.runs.append(record)
+
+    def merge(self, other):
+        """
+        Adds the records of another profile (e.g. from a worker process).
+        :param other:
+        :return: This profile.
+        """
+
+        with self._lock:
+            for mine, theirs in ((self.maskers, other.maskers), (self.actions, other.actions),
+                                 (self.conversions, other.conversions)):
+                for key, values in theirs.items():
+                    self._add(mine, key, **values)
+            self.runs.extend(other.runs)
+        return self
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        """
+        Gets the records as plain lists and dictionaries.
+        """
+
+        return {
+            'maskers': [dict(values, entry=entry, colorspace=colorspace)
+                        for (entry, colorspace), values in self.maskers.items()],
+            'actions': [dict(values, entry=entry, action=action, colorspace=colorspace)
+                        for (entry, action, colorspace), values in self.actions.items()],
+            'conversions': [dict(values, colorspace=colorspace, kind=kind)
+                            for (colorspace, kind), values in self.conversions.items()],
+            'runs': list(self.runs),
+        }
+
+    def to_json(self, **kwargs):
+        """
+        Renders the records as JSON (see as_dict).
+        """
+
+        return json.dumps(self.as_dict(), sort_keys=True, **kwargs)
+
+    def report(self):
+        """
+        Renders the records as a plain-text report, slowest first within each section.
+        """
+
+        lines = ['%-24s %8s %10s %12s %12s' % ('masker', 'calls', 'seconds', 'matched', 'evaluated')]
+        for (entry, colorspace), values in sorted(self.maskers.items(), key=lambda item: -item[1]['seconds']):
+            lines.append('%-24s %8d %10.4f %12d %12d' % ('entry %d (%s)' % (entry, colorspace), values['calls'],
+                                                         values['seconds'], values['matched'], values['evaluated']))
+        lines.append('')
+        lines.append('%-24s %8s %10s %12s' % ('action', 'calls', 'seconds', 'pixels'))
+        for (entry, action, colorspace), values in sorted(self.actions.items(), key=lambda item: -item[1]['seconds']):
+            lines.append('%-24s %8d %10.4f %12d' % ('entry %d action %d (%s)' % (entry, action, colorspace),
+                                                    values['calls'], values['seconds'], values['pixels']))
+        lines.append('')
+        lines.append('%-24s %8s %10s %12s' % ('conversion', 'calls', 'seconds', 'pixels'))
+        for (colorspace, kind), values in sorted(self.conversions.items(), key=lambda item: -item[1]['seconds']):
+            lines.append('%-24s %8d %10.4f %12d' % ('%s %s' % (colorspace, kind), values['calls'], values['seconds'],
+                                                    values['pixels']))
+        for index, record in enumerate(self.runs):
+            lines.append('')
+            lines.append('run %d: %s' % (index, ', '.join('%s=%s' % (key, record[key]) for key in sorted(record))))
+        return '\n'.join(lines)
@@ -1,7 +1,7 @@
 import collections
+import importlib
 from functools import wraps
 import numpy
-from common.proxy import Proxy
 from six import integer_types
 from numpy import (
     int_, intp, int8, int16, int32, int64,
@@ -9,7 +9,7 @@ from numpy import (
     float_, float16, float32, float64
 )
 from numpy import all as npall
-from .types import IN
+from .types import IN, IntervalSet
 
 
 def _valid_real(value):
@@ -22,7 +22,7 @@ def _valid_real(value):
                                               uint64, float_, float16, float32, float64))
 
 
-def mask(array, value):
+def mask(array, value, out=None):
     """
     Creates a mask from an array against a value, depending on value's nature:
 
@@ -45,26 +45,77 @@ def mask(array, value):
       mask(arr, IN(0.5, 1., false, true)) will make a mask for pixels
         greater than or equal 0.5 and lower than 1.
 
+      mask(arr, IN(0.9, 0.1)) is circular (min > max): it will make a mask for
+        pixels greater than or equal 0.9, or lower than or equal 0.1 (e.g. a
+        hue range wrapping around 1.0), in a single evaluation.
+
+    * IntervalSet instances (e.g. IN(0, 0.1) | IN(0.9, 1)):
+
+      mask(arr, IN(0, 0.1) | IN(0.9, 1)) will make a mask for pixels in
+        any of the ranges, in a single evaluation.
+
     :param array:
     :param value:
+    :param out: An optional boolean array to write the mask into.
     :return:
     """
 
     if _valid_real(value):
-        return array == value
+        return numpy.equal(array, value, out=out)
     elif isinstance(value, (list, tuple)):
         if not all(_valid_real(v) for v in value):
             raise TypeError("Cannot mask against list or tuples having values other than valid numbers, or being "
                             "multi-dimensional or irregular sequences")
-        return npall(array == value, axis=2)
-    elif isinstance(value, IN):
-        return value.contains(array)
+        return npall(array == value, axis=-1, out=out)
+    elif isinstance(value, (IN, IntervalSet)):
+        return value.contains(array, out)
     else:
         raise TypeError("Cannot take a mask from this argument. Only numpy-accepted numeric types, tuples, lists, or "
                         "`IN` instances are accepted")
 
 
-class ColorSpace(collections.namedtuple('ColorSpace', ['encoder', 'decoder', 'components'])):
+def mask_all(array, idxes, values, out=None):
+    """
+    Creates a mask of the pixels whose bands (idxes) match each of their values, as in
+      mask(...) for each band (so values may be numbers, IN ranges or interval sets). Each
+      band is checked in place, and the checks are and-ed into a single output mask.
+    :param array:
+    :param idxes:
+    :param values:
+    :param out: An optional boolean array to write the mask into.
+    :return:
+    """
+
+    if len(idxes) != len(values):
+        raise TypeError("Expected %d values to check, got %d" % (len(idxes), len(values)))
+    if not all(_valid_real(value) or isinstance(value, (IN, IntervalSet)) for value in values):
+        raise TypeError("Cannot mask bands against values other than valid numbers, `IN` or `IntervalSet` "
+                        "instances")
+    if out is None:
+        out = numpy.empty(array.shape[:-1], dtype=bool)
+    mask(array[..., idxes[0]], values[0], out)
+    if len(idxes) > 1:
+        scratch = numpy.empty(out.shape, dtype=bool)
+        for idx, value in zip(idxes[1:], values[1:]):
+            out &= mask(array[..., idx], value, scratch)
+    return out
+
+
+class ColorSpace(collections.namedtuple('ColorSpace', ['encoder', 'decoder', 'components', 'source',
+                                                       'from_source', 'ranges'])):
+    """
+    A colorspace knows how to encode a plain-rgb image into a wrapper, and decode it back.
+
+    Some colorspaces are computed on top of another one (e.g. lab and luv are computed
+      from xyz). Those tell their source colorspace, and a function converting a wrapper
+      of the source into a wrapper of their own, so an already-converted source image
+      can be reused instead of converting from plain-rgb again.
+
+    Colorspaces also tell the (low, high) range of each component over the plain-rgb cube.
+    """
+
+    def __new__(cls, encoder, decoder, components, source=None, from_source=None, ranges=None):
+        return super(ColorSpace, cls).__new__(cls, encoder, decoder, components, source, from_source, ranges)
 
     def __getattribute__(self, item):
         """
@@ -78,54 +129,81 @@ class ColorSpace(collections.namedtuple('ColorSpace', ['encoder', 'decoder', 'co
         return super(ColorSpace, self).__getattribute__(item)
 
 
-from skimage.color import (
-    rgb2hsv, hsv2rgb,
-    rgb2luv, luv2rgb,
-    rgb2hed, hed2rgb,
-    rgb2lab, lab2rgb,
-    rgb2xyz, xyz2rgb,
-)
+def backend(name, module='.kernels'):
+    """
+    Refers a converter (a kernel, see colormap.kernels) by its module and name, so the
+      module (and whatever heavy dependencies it has) is imported on the first conversion
+      instead of when importing this module. Colorspaces are registered with backends,
+      so importing colormap only costs what is actually converted.
+    :param name: The name of the converter in its module.
+    :param module: The module name (relative names are relative to this package).
+    :return:
+    """
+
+    resolved = []
+
+    def converter(image, out):
+        if not resolved:
+            resolved.append(getattr(importlib.import_module(module, __package__), name))
+        return resolved[0](image, out)
+    converter.__name__ = name
+    return converter
 
 
 def _alpha_aware_converter(func):
     """
     Returns a new function that will apply the original converter but keep the alpha channel if the image is (W, H, 4).
+      The new function takes an optional output buffer (it may be the input image itself) to write the result into.
+      Otherwise, the result is a new float array having the image's precision. The converter must be a kernel (see
+      colormap.kernels, and backend), so it writes the color components straight into the output buffer.
     :param converter:
     :return:
     """
 
     @wraps(func)
-    def _converter(image):
-        if is_4comp(image):
-            result = func(image[:, :, :3])
-            alpha = image[:, :, 3]
-            return numpy.dstack((result, alpha))
-        else:
-            return func(image)
+    def _converter(image, out=None):
+        if out is None:
+            out = numpy.empty(image.shape, dtype=image.dtype if image.dtype in (float32, float64) else float64)
+        # Kernels take both whole images and masked (pixels, components) chunks.
+        func(image[..., :3], out[..., :3])
+        if image.shape[-1] == 4:
+            # Alpha goes straight through.
+            out[..., 3] = image[..., 3]
+        return out
     return _converter
 
 
-def _alpha_aware_colorspace_wrapper(enc, dec, wrapper_class):
+def _alpha_aware_colorspace_wrapper(enc, dec, wrapper_class, source=None, from_source=None):
     """
-    Creates a ColorSpace whose functions are alpha-channel aware.
+    Creates a ColorSpace whose functions are alpha-channel aware, and take an optional
+      output buffer.
     :param enc: encoder function
     :param dec: decoder function
     :param wrapper_class: a wrapper class to use as object.
+    :param source: an optional colorspace this one can be computed from.
+    :param from_source: the function converting from the source colorspace, if any.
     :return:
     """
 
     enc = _alpha_aware_converter(enc)
     dec = _alpha_aware_converter(dec)
 
-    def encode(image):
+    def encode(image, out=None):
         # Forth to wrapped
-        return wrapper_class(enc(image))
+        return wrapper_class(enc(image, out))
 
-    def decode(wrapper):
+    def decode(wrapper, out=None):
         # Back to plain-rgb
-        dec(wrapper.np_image)
+        return dec(wrapper._ if isinstance(wrapper, ColorSpaceWrapper) else wrapper, out)
+
+    if from_source is not None:
+        convert = _alpha_aware_converter(from_source)
+
+        def from_source(source_wrapper, out=None):
+            # From the source's wrapper to this one
+            return wrapper_class(convert(source_wrapper._, out))
 
-    return ColorSpace(encode, decode, wrapper_class.COMPONENTS)
+    return ColorSpace(encode, decode, wrapper_class.COMPONENTS, source, from_source, wrapper_class.RANGES)
 
 
 def is_scalar(img):
@@ -144,17 +222,72 @@ def is_4comp(img):
     return len(img.shape) == 3 and img.shape[2] == 4
 
 
-class ColorSpaceWrapper(Proxy):
+def _forwarded(name):
     """
-    This is just a wrapper for an array describing an image.
-    Any operation sent to this object, other than the specifically implemented
-      in this object (or any subclass) goes directly to the wrapped object.
+    Creates a method forwarding the call to the same method of the wrapped array.
     """
 
-    # Other calls are simply proxied.
+    def method(self, *args):
+        return getattr(self._, name)(*args)
+    method.__name__ = name
+    return method
+
+
+class ColorSpaceWrapper(object):
+    """
+    This is just a wrapper for an array describing an image (or a masked chunk, having
+      one pixel per row). The array is kept in the `_` slot and operations are made
+      straight on it: indexing, iteration, and numeric and comparison operators are
+      forwarded to it, and other attributes (e.g. shape) are looked up on it.
+    """
+
+    __slots__ = ('_',)
+
     def __init__(self, np_image):
         self._ = np_image
 
+    def __getattr__(self, item):
+        # Only reached when the attribute is not in the wrapper class.
+        if item == '_':
+            raise AttributeError(item)
+        return getattr(self._, item)
+
+    def __getitem__(self, item):
+        return self._[item]
+
+    def __setitem__(self, item, value):
+        self._[item] = value
+
+    def __len__(self):
+        return len(self._)
+
+    def __iter__(self):
+        return iter(self._)
+
+    def __array__(self, dtype=None, copy=None):
+        # NumPy 2 tells whether a copy is required (True), forbidden (False), or up to us (None).
+        if copy is False and dtype is not None and numpy.dtype(dtype) != self._.dtype:
+            raise ValueError("Unable to avoid a copy while converting to %s" % numpy.dtype(dtype))
+        array = self._ if dtype is None else self._.astype(dtype, copy=False)
+        return array.copy() if copy and array is self._ else array
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._)
+
+    __hash__ = None
+
+    def _update(self, components, func, *args):
+        """
+        Applies a ufunc to the selected components, in place when they can be viewed.
+        """
+
+        if isinstance(components, integer_types + (numpy.integer, slice)):
+            view = self._[..., components]
+            func(view, *args, out=view)
+        else:
+            self._[..., components] = func(self._[..., components], *args)
+        return self
+
     def set(self, components, value):
         """
         Sets each value in the component to value. Value may be an iterable so we can operate
@@ -162,7 +295,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] = value
+        self._[..., components] = value
         return self
 
     def add(self, components, value):
@@ -172,7 +305,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] += value
+        self._[..., components] += value
         return self
 
     def sub(self, components, value):
@@ -182,7 +315,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] -= value
+        self._[..., components] -= value
         return self
 
     def mul(self, components, value):
@@ -192,7 +325,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] *= value
+        self._[..., components] *= value
         return self
 
     def div(self, components, value):
@@ -202,7 +335,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] /= value
+        self._[..., components] /= value
         return self
 
     def clamp(self, components):
@@ -211,8 +344,7 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] = numpy.clip(self._[:, components], 0., 1.)
-        return self
+        return self._update(components, numpy.clip, 0., 1.)
 
     def rotate(self, components):
         """
@@ -220,8 +352,17 @@ class ColorSpaceWrapper(Proxy):
         NOTES: Since this wrapper is masked, data views will have two dimensions instead of three.
           One is for the pixel index, and other is for pixel component.
         """
-        self._[:, components] = self._[:, components] % 1
-        return self
+        return self._update(components, numpy.mod, 1)
+
+
+_FORWARDED = ('__lt__', '__le__', '__eq__', '__ne__', '__gt__', '__ge__',
+              '__add__', '__sub__', '__mul__', '__div__', '__truediv__', '__floordiv__', '__mod__', '__pow__',
+              '__radd__', '__rsub__', '__rmul__', '__rdiv__', '__rtruediv__', '__rfloordiv__', '__rmod__', '__rpow__',
+              '__and__', '__or__', '__xor__', '__rand__', '__ror__', '__rxor__',
+              '__neg__', '__pos__', '__abs__', '__invert__')
+for _name in _FORWARDED:
+    setattr(ColorSpaceWrapper, _name, _forwarded(_name))
+
 
 def band_property(idx):
     """
@@ -237,10 +378,10 @@ def band_property(idx):
     """
 
     def _get(self):
-        return self.np_image[:, :, idx]
+        return self._[..., idx]
 
     def _set(self, value):
-        self.np_image[:, :, idx] = value
+        self._[..., idx] = value
 
     return property(_get, _set)
 
@@ -271,15 +412,19 @@ def mask_bands(*idxes):
     Notes: if only one index is provided, a 1-arity method is returned and
       the check is scalar. Scalar checks provide scalar values to mask function
       and stuff like IN can be performed. Other scalar checks behave exactly as
-      the __eq__ operator.
+      the __eq__ operator. Scalar checks also take an optional output mask, and
+      tell their band (so checks of the same band can be fused into one).
+      Multiple-band checks take a value per band, and check each band as the
+      scalar checks do (see mask_all), e.g. hs_is(IN(0.9, 0.1), IN(0.5, 1)).
     """
 
     if len(idxes) == 1:
-        def method(self, value):
-            return mask(self[:, :, idxes[0]], value)
+        def method(self, value, out=None):
+            return mask(self._[..., idxes[0]], value, out)
+        method.band = idxes[0]
     else:
         def method(self, *values):
-            return mask(self[:, :, idxes], values)
+            return mask_all(self._, idxes, values)
     return method
 
 
@@ -288,7 +433,9 @@ class RGB(ColorSpaceWrapper):
     RGB (perhaps with Alpha) color space.
     """
 
+    __slots__ = ()
     COMPONENTS = 'rgb'
+    RANGES = ((0., 1.), (0., 1.), (0., 1.))
     r, g, b, alpha = band_properties(4)
     r_is, g_is, b_is = mask_bands(0), mask_bands(1), mask_bands(2)
     rg_is, rb_is, gb_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -301,7 +448,9 @@ class HSV(ColorSpaceWrapper):
     HSV (perhaps with Alpha) color space.
     """
 
+    __slots__ = ()
     COMPONENTS = 'hsv'
+    RANGES = ((0., 1.), (0., 1.), (0., 1.))
     h, s, v, alpha = band_properties(4)
     h_is, s_is, v_is = mask_bands(0), mask_bands(1), mask_bands(2)
     hs_is, hv_is, sv_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -314,7 +463,9 @@ class LUV(ColorSpaceWrapper):
     LUV (perhaps with Alpha) color space.
     """
 
+    __slots__ = ()
     COMPONENTS = 'luv'
+    RANGES = ((0., 100.), (-84., 176.), (-135., 108.))
     l, u, v, alpha = band_properties(4)
     l_is, u_is, v_is = mask_bands(0), mask_bands(1), mask_bands(2)
     lu_is, lv_is, uv_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -324,10 +475,14 @@ class LUV(ColorSpaceWrapper):
 
 class HED(ColorSpaceWrapper):
     """
-    HED (perhaps with Alpha) color space.
+    HED (perhaps with Alpha) color space: the optical densities of the Haematoxylin, Eosin
+      and DAB stains, as skimage.color computes them. Negative densities are clipped, so
+      decoding is not the exact inverse of encoding.
     """
 
+    __slots__ = ()
     COMPONENTS = 'hed'
+    RANGES = ((0., 1.88), (0., 1.14), (0., 1.58))
     h, e, d, alpha = band_properties(4)
     h_is, e_is, d_is = mask_bands(0), mask_bands(1), mask_bands(2)
     he_is, hd_is, ed_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -340,7 +495,9 @@ class LAB(ColorSpaceWrapper):
     LAB (perhaps with Alpha) color space.
     """
 
+    __slots__ = ()
     COMPONENTS = 'lab'
+    RANGES = ((0., 100.), (-87., 99.), (-108., 95.))
     l, a, b, alpha = band_properties(4)
     l_is, a_is, b_is = mask_bands(0), mask_bands(1), mask_bands(2)
     la_is, lb_is, ab_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -353,7 +510,9 @@ class XYZ(ColorSpaceWrapper):
     XYZ (perhaps with alpha) color space.
     """
 
+    __slots__ = ()
     COMPONENTS = 'xyz'
+    RANGES = ((0., 0.95047), (0., 1.), (0., 1.08883))
     x, y, z, alpha = band_properties(4)
     x_is, y_is, z_is = mask_bands(0), mask_bands(1), mask_bands(2)
     xy_is, xz_is, yz_is = mask_bands(0, 1), mask_bands(0, 2), mask_bands(1, 2)
@@ -361,9 +520,14 @@ class XYZ(ColorSpaceWrapper):
     xyza = mask_bands(0, 1, 2, 3)
 
 
-rgb = _alpha_aware_colorspace_wrapper(lambda a: a, lambda a: a, RGB)
-hsv = _alpha_aware_colorspace_wrapper(rgb2hsv, hsv2rgb, HSV)
-luv = _alpha_aware_colorspace_wrapper(rgb2luv, luv2rgb, LUV)
-hed = _alpha_aware_colorspace_wrapper(rgb2hed, hed2rgb, HED)
-lab = _alpha_aware_colorspace_wrapper(rgb2lab, lab2rgb, LAB)
-xyz = _alpha_aware_colorspace_wrapper(rgb2xyz, xyz2rgb, XYZ)
\ No newline at end of file
+rgb = _alpha_aware_colorspace_wrapper(backend('identity'), backend('identity'), RGB)
+hsv = _alpha_aware_colorspace_wrapper(backend('rgb2hsv'), backend('hsv2rgb'), HSV)
+hed = _alpha_aware_colorspace_wrapper(backend('rgb2hed'), backend('hed2rgb'), HED)
+xyz = _alpha_aware_colorspace_wrapper(backend('rgb2xyz'), backend('xyz2rgb'), XYZ)
+luv = _alpha_aware_colorspace_wrapper(backend('rgb2luv'), backend('luv2rgb'), LUV, xyz, backend('xyz2luv'))
+lab = _alpha_aware_colorspace_wrapper(backend('rgb2lab'), backend('lab2rgb'), LAB, xyz, backend('xyz2lab'))
+
+# The names of the single-band checks (e.g. h_is), whose IN checks combined with | or &
+#   can be fused into a single interval set check.
+BAND_CHECKS = frozenset(name for wrapper_class in (RGB, HSV, LUV, HED, LAB, XYZ)
+                        for name, value in vars(wrapper_class).items() if hasattr(value, 'band'))
@@ -1,6 +1,20 @@
+import numpy
+from six import integer_types
+
+
+_REAL_TYPES = integer_types + (float, numpy.integer, numpy.floating)
+
+
 class IN(object):
     """
     Range-check for arrays.
+
+    Ranges whose min is greater than their max are circular: they wrap around the end
+      of the band's range, so IN(0.9, 0.1) over the hue checks values from 0.9 up to 1.0,
+      or from 0.0 up to 0.1 (i.e. values not lower than 0.9 or not greater than 0.1).
+
+    Ranges may be combined into interval sets, e.g. IN(0, 0.1) | IN(0.9, 1), to check
+      a band against all of them at once.
     """
 
     def __init__(self, minv, maxv, strict_min=False, strict_max=False):
@@ -9,7 +23,237 @@ class IN(object):
         self.__strict_min = strict_min
         self.__strict_max = strict_max
 
-    def contains(self, item):
+    @property
+    def interval(self):
+        """
+        The (min, max, strict_min, strict_max) definition of this range.
+        """
+
+        return self.__minv, self.__maxv, self.__strict_min, self.__strict_max
+
+    def contains(self, item, out=None):
+        if isinstance(self.__minv, _REAL_TYPES) and isinstance(self.__maxv, _REAL_TYPES):
+            return IntervalSet.of(self).contains(item, out)
+        # Bounds may also be arrays (e.g. per-pixel bounds).
         lower = item > self.__minv if self.__strict_min else item >= self.__minv
         upper = item < self.__maxv if self.__strict_max else item <= self.__maxv
-        return lower & upper
+        circular = numpy.greater(self.__minv, self.__maxv)
+        result = numpy.logical_and(lower, upper, out=out)
+        if circular.any():
+            result |= circular & (lower | upper)
+        return result
+
+    def __or__(self, other):
+        return IntervalSet.of(self) | other
+
+    def __and__(self, other):
+        return IntervalSet.of(self) & other
+
+    __ror__ = __or__
+    __rand__ = __and__
+
+
+def _later_low(first, second):
+    """
+    The most restrictive of two (value, closed) lower bounds.
+    """
+
+    if first[0] != second[0]:
+        return max(first, second)
+    return first[0], first[1] and second[1]
+
+
+def _earlier_high(first, second):
+    """
+    The most restrictive of two (value, closed) upper bounds.
+    """
+
+    if first[0] != second[0]:
+        return min(first, second)
+    return first[0], first[1] and second[1]
+
+
+def _empty(low, high):
+    return low[0] > high[0] or (low[0] == high[0] and not (low[1] and high[1]))
+
+
+class IntervalSet(object):
+    """
+    A union of disjoint ranges, each one kept as ((low, closed), (high, closed)) bounds.
+      Sets are created from IN ranges, and combined with | (union) and & (intersection),
+      so checking a band against several ranges is a single evaluation with bounded
+      temporaries (instead of a few full-size arrays per range):
+
+    * Integer arrays of up to 16 bits, against two or more intervals, are looked up
+      in a boolean table of every integer value.
+    * Few intervals are checked with comparisons into the output mask (and up to two
+      scratch masks), once the band is made contiguous.
+    * Many intervals (more than SEARCH_INTERVALS) are checked by the parity of the
+      position of each value among the sorted bounds.
+
+    Checks are made in the precision of the array (as IN checks do), over half-open
+      [low, high) bounds of that precision: strict lower bounds and closed upper bounds
+      are moved to the next representable value.
+    """
+
+    SEARCH_INTERVALS = 64
+
+    def __init__(self, intervals=()):
+        self.intervals = tuple(intervals)
+        self._bounds = {}
+        self._tables = {}
+
+    @classmethod
+    def of(cls, value):
+        """
+        Gets the interval set of an IN range (two intervals, for circular ranges), or the
+          set itself.
+        :param value:
+        :return:
+        """
+
+        if isinstance(value, IntervalSet):
+            return value
+        if not isinstance(value, IN):
+            raise TypeError('Only IN ranges and interval sets can be combined')
+        minv, maxv, strict_min, strict_max = value.interval
+        low, high = (float(minv), not strict_min), (float(maxv), not strict_max)
+        if low[0] > high[0]:
+            # Circular ranges wrap around: everything above the min, or below the max.
+            return cls((((-numpy.inf, True), high), (low, (numpy.inf, True))))
+        return cls(() if _empty(low, high) else ((low, high),))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __getstate__(self):
+        # The per-dtype bounds and tables are caches.
+        return {'intervals': self.intervals}
+
+    def __setstate__(self, state):
+        self.__init__(state['intervals'])
+
+    def __or__(self, other):
+        # Closed lower bounds sort before open ones at the same value.
+        intervals = sorted(self.intervals + IntervalSet.of(other).intervals,
+                           key=lambda interval: (interval[0][0], not interval[0][1]))
+        merged = []
+        for low, high in intervals:
+            if merged:
+                last_low, last_high = merged[-1]
+                if low[0] < last_high[0] or (low[0] == last_high[0] and (low[1] or last_high[1])):
+                    # Closed upper bounds sort after open ones at the same value.
+                    merged[-1] = last_low, max(high, last_high)
+                    continue
+            merged.append((low, high))
+        return IntervalSet(merged)
+
+    def __and__(self, other):
+        mine, theirs = self.intervals, IntervalSet.of(other).intervals
+        intervals = []
+        index, other_index = 0, 0
+        while index < len(mine) and other_index < len(theirs):
+            low = _later_low(mine[index][0], theirs[other_index][0])
+            high = _earlier_high(mine[index][1], theirs[other_index][1])
+            if not _empty(low, high):
+                intervals.append((low, high))
+            if mine[index][1] < theirs[other_index][1]:
+                index += 1
+            else:
+                other_index += 1
+        return IntervalSet(intervals)
+
+    __ror__ = __or__
+    __rand__ = __and__
+
+    def bounds(self, dtype):
+        """
+        Gets the sorted, disjoint, half-open [low, high) bounds of this set, as a (intervals, 2)
+          array of the given float dtype (or float64 for other dtypes).
+        :param dtype:
+        :return:
+        """
+
+        dtype = numpy.dtype(dtype)
+        dtype = dtype if dtype.kind == 'f' else numpy.dtype(numpy.float64)
+        if dtype not in self._bounds:
+            cast, inf = dtype.type, dtype.type(numpy.inf)
+            bounds = []
+            for (low, low_closed), (high, high_closed) in self.intervals:
+                low = cast(low) if low_closed else numpy.nextafter(cast(low), inf)
+                high = numpy.nextafter(cast(high), inf) if high_closed else cast(high)
+                if low >= high:
+                    continue
+                if bounds and low <= bounds[-1][1]:
+                    bounds[-1][1] = max(bounds[-1][1], high)
+                else:
+                    bounds.append([low, high])
+            self._bounds[dtype] = numpy.array(bounds, dtype=dtype).reshape((-1, 2))
+        return self._bounds[dtype]
+
+    def _table(self, dtype):
+        if dtype not in self._tables:
+            info = numpy.iinfo(dtype)
+            self._tables[dtype] = self._compare(numpy.arange(info.min, info.max + 1, dtype=dtype), None)
+        return self._tables[dtype]
+
+    def _compare(self, item, out):
+        """
+        Checks the array against the bounds, with comparisons written into the output.
+        """
+
+        if out is None:
+            out = numpy.empty(item.shape, dtype=bool)
+        bounds = self.bounds(item.dtype)
+        if not len(bounds):
+            out.fill(False)
+            return out
+        scratch = {}
+
+        def buffer(name):
+            if name not in scratch:
+                scratch[name] = numpy.empty(item.shape, dtype=bool)
+            return scratch[name]
+
+        for position, (low, high) in enumerate(bounds):
+            target = buffer('interval') if position else out
+            if low > -numpy.inf and high < numpy.inf:
+                numpy.greater_equal(item, low, out=target)
+                upper = buffer('upper')
+                numpy.less(item, high, out=upper)
+                target &= upper
+            elif low > -numpy.inf:
+                numpy.greater_equal(item, low, out=target)
+            elif high < numpy.inf:
+                numpy.less(item, high, out=target)
+            elif item.dtype.kind == 'f':
+                # Everything but NaN.
+                numpy.equal(item, item, out=target)
+            else:
+                target.fill(True)
+            if position:
+                out |= target
+        return out
+
+    def contains(self, item, out=None):
+        """
+        Checks which values of an array lie in any interval of this set.
+        :param item: The array (or value) to check.
+        :param out: An optional boolean array, of the same shape, to write the mask into.
+        :return:
+        """
+
+        item = numpy.asarray(item)
+        if item.dtype.kind in 'iu' and item.dtype.itemsize <= 2 and len(self) > 1:
+            table = self._table(item.dtype)
+            if item.dtype.kind == 'i':
+                item = item.astype(numpy.int32) - numpy.iinfo(item.dtype).min
+            result = numpy.take(table, item, out=out)
+        elif len(self) > self.SEARCH_INTERVALS:
+            positions = numpy.searchsorted(self.bounds(item.dtype).ravel(), item, 'right')
+            result = numpy.not_equal(positions & 1, 0, out=out)
+        else:
+            if not item.flags.c_contiguous and len(self) > 1:
+                item = numpy.ascontiguousarray(item)
+            result = self._compare(item, out)
+        return result[()] if out is None and not result.ndim else result
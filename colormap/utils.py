@@ -1,3 +1,4 @@
+import numpy
 from six import integer_types
 from numpy import (
     bincount,
@@ -7,6 +8,7 @@ from numpy import (
 )
 from numpy import all as npall
 from .types import IN
+from . import spaces
 
 
 UINT_TYPES = (uint8, uint16, uint32, uint64)
@@ -20,29 +22,41 @@ def _valid_int(value):
     """
     return isinstance(value, integer_types + UINT_TYPES)
 
-def rgb_normalize(arr):
+def rgb_normalize(arr, dtype=None):
     """
     Will normalize a uint8 image to a 0..1-valued image.
       Note that alpha channel will also be affected.
     :param arr:
+    :param dtype: The float dtype of the result (float64 by default). Float images are
+      cast to it, if given, or returned as they are.
     :return:
     """
 
     if arr.dtype == uint8:
-        return arr / 255.0
+        return numpy.true_divide(arr, 255.0, dtype=dtype or float64)
+    if dtype is not None:
+        return arr.astype(dtype, copy=False)
     return arr
 
 
-def rgb_denormalize(arr):
+def rgb_denormalize(arr, dtype=None):
     """
-    Will denormalize a float64 image to a 0..255-valued image.
+    Will denormalize a float32 or float64 image to a 0..255-valued image, keeping its
+      float dtype unless another one is given. Integer dtypes (e.g. uint8) get rounded
+      and clipped values.
       Note that alpha channel will also be affected.
     :param arr:
+    :param dtype: The dtype of the result.
     :return:
     """
 
     if arr.dtype in (float32, float64):
-        return arr * 255.0
+        arr = arr * arr.dtype.type(255.0)
+        if dtype is not None and numpy.issubdtype(dtype, numpy.integer):
+            numpy.rint(arr, out=arr)
+            numpy.clip(arr, 0, 255, out=arr)
+    if dtype is not None:
+        return arr.astype(dtype, copy=False)
     return arr
 
 
@@ -55,10 +69,14 @@ def dhist(arr, bins=256, excludes_rbound=False, ndtype=uint8, distribution=False
     :param bins: A > 0 value to scale the bins.
     :param excludes_rbound: The user must tell if the values in the array are lower than 1 or
       include the value 1. If they include it, we must decrement bins.
-    :param ndtype: A valid integer type for the values.
+    :param ndtype: A valid integer type for the values. Kept for compatibility: the bin
+      of each value is computed as intp, so it never overflows (e.g. uint8 with more
+      than 256 bins).
     :param distribution: Determines whether the frequencies should be divided by the total amount
       in the result.
-    :return: The resulting array.
+    :return: The resulting array, having exactly `bins` 64-bit counts (or frequencies). Values
+      out of range are counted in the first or last bin. NaN and infinite values are not
+      counted (nor taken into the total for the frequencies).
     """
 
     # Ensure bins is positive integer
@@ -68,15 +86,179 @@ def dhist(arr, bins=256, excludes_rbound=False, ndtype=uint8, distribution=False
         raise TypeError('bins must be uint8, uint16, uint32, or uint64, or standard Python integer type')
     if not ndtype in UINT_TYPES:
         raise ValueError('ndtype must be uint8, uint16, uint32, or uint64')
+    bins = int(bins)
     # Flatten the array
     arr = arr.ravel()
+    if arr.dtype.kind == 'f':
+        arr = arr[numpy.isfinite(arr)]
     size = arr.size
     # Adjust the bins.
-    if not excludes_rbound:
-        bins -= 1
+    scale = bins if excludes_rbound else bins - 1
     # Calculate the bins.
-    result = bincount((arr * bins).astype(ndtype))
+    indices = (arr * scale).astype(intp)
+    numpy.clip(indices, 0, bins - 1, out=indices)
+    result = bincount(indices, minlength=bins).astype(int64, copy=False)
     # Normalize the result
     if distribution:
-        result /= size
-    return result
\ No newline at end of file
+        return result / float(max(size, 1))
+    return result
+
+
+class HistogramAccumulator(object):
+    """
+    Accumulates per-channel histograms of images in a colorspace, across any amount of
+      images, tiles, batches or generators of them, so statistics over a whole dataset
+      are computed in a single streaming pass: pixels are converted and counted CHUNK at
+      a time, so memory stays bounded regardless the amount (or size) of the images.
+
+    Each channel has the same amount of fixed-width bins over its range (by default, the
+      colorspace component ranges, and 0..1 for alpha). Counts are 64-bit. Accumulators of
+      the same configuration (e.g. filled by parallel workers) can be merged.
+    """
+
+    CHUNK = 65536
+
+    def __init__(self, colorspace=None, bins=256, channels=3, ranges=None):
+        """
+        :param colorspace: The colorspace to count the images in (by default, rgb). Images
+          are given as normalized plain-rgb(a).
+        :param bins: The amount of bins of each channel.
+        :param channels: 3 (color components) or 4 (also alpha).
+        :param ranges: An optional sequence of (low, high) pairs, one per channel.
+        """
+
+        colorspace = colorspace or spaces.rgb
+        if channels not in (3, 4):
+            raise ValueError('channels must be 3 or 4')
+        if ranges is None:
+            ranges = tuple(colorspace.ranges) + ((0., 1.),)
+        ranges = tuple((float(low), float(high)) for low, high in ranges[:channels])
+        if len(ranges) != channels or any(high <= low for low, high in ranges):
+            raise ValueError('ranges must have one (low, high) pair, with low < high, per channel')
+        # Only the components are kept, so accumulators can be pickled to (and from) workers.
+        self.components = colorspace.components
+        self.bins = bins
+        self.ranges = ranges
+        self.counts = numpy.zeros((channels, bins), dtype=int64)
+        self.total = 0
+
+    @property
+    def colorspace(self):
+        return getattr(spaces, self.components)
+
+    @property
+    def channels(self):
+        return len(self.ranges)
+
+    def update(self, image):
+        """
+        Counts the pixels of an image, tile, or batch of images.
+        :param image: A normalized plain-rgb(a) array, having the components in its last
+          dimension, e.g. (H, W, C), (N, H, W, C) or (pixels, C).
+        :return: This accumulator.
+        """
+
+        if image.shape[-1] < self.channels or image.shape[-1] not in (3, 4):
+            raise ValueError('Image must have 3 or 4 components, and at least as many as the channels')
+        pixels = image.reshape((-1, image.shape[-1]))
+        encoder = self.colorspace.encoder
+        for start in range(0, len(pixels), self.CHUNK):
+            chunk = encoder(pixels[start:start + self.CHUNK])._
+            for channel, (low, high) in enumerate(self.ranges):
+                self.counts[channel] += dhist((chunk[:, channel] - low) / (high - low), self.bins, True)
+            self.total += len(chunk)
+        return self
+
+    def update_many(self, images):
+        """
+        Counts the pixels of each image (or tile, or batch) in an iterable, e.g. a generator
+          reading frames one at a time.
+        :param images:
+        :return: This accumulator.
+        """
+
+        for image in images:
+            self.update(image)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts of another accumulator, having the same configuration.
+        :param other:
+        :return: This accumulator.
+        """
+
+        if (other.components, other.bins, other.ranges) != (self.components, self.bins, self.ranges):
+            raise ValueError('Cannot merge accumulators having different colorspaces, bins, or ranges')
+        self.counts += other.counts
+        self.total += other.total
+        return self
+
+    def distribution(self):
+        """
+        Gets the frequencies of each bin, per channel.
+        """
+
+        return self.counts / float(max(self.total, 1))
+
+    def edges(self, channel):
+        """
+        Gets the bins + 1 edges of the bins of a channel.
+        """
+
+        low, high = self.ranges[channel]
+        return numpy.linspace(low, high, self.bins + 1)
+
+
+def tiles(shape, tile_shape):
+    """
+    Iterates over the tiles covering the first two dimensions of a shape. Each tile is
+      yielded as a (rows, columns) pair of slices, so it can be used to index both an
+      image and its output. Border tiles may be smaller than the requested tile shape.
+    :param shape: The shape to cover (only the first two dimensions are considered).
+    :param tile_shape: A (rows, columns) pair with the maximum size of each tile.
+    :return: A generator of (rows, columns) slice pairs, in row-major order.
+    """
+
+    tile_rows, tile_cols = tile_shape
+    if tile_rows < 1 or tile_cols < 1:
+        raise ValueError('tile_shape must have positive dimensions')
+    rows, cols = shape[0:2]
+    for row in range(0, rows, tile_rows):
+        for col in range(0, cols, tile_cols):
+            yield slice(row, min(row + tile_rows, rows)), slice(col, min(col + tile_cols, cols))
+
+class ScratchArena(object):
+    """
+    A set of named scratch buffers, to be reused across the entries, actions, and tiles of
+      a run instead of allocating new arrays each time. A buffer is (re)allocated only when
+      a larger one is requested for the same name and dtype, and such allocations are
+      counted (and their bytes summed) so they can be observed.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+        self.bytes = 0
+
+    def buffer(self, name, shape, dtype):
+        """
+        Gets a scratch buffer. Its contents are undefined, and it is only valid until the
+          next request for the same name and dtype.
+        :param name: The buffer name.
+        :param shape: The requested shape.
+        :param dtype: The requested dtype.
+        :return:
+        """
+
+        dtype = numpy.dtype(dtype)
+        size = int(numpy.prod(shape))
+        key = name, dtype.str
+        flat = self._buffers.get(key)
+        if flat is None or flat.size < size:
+            # Grow geometrically, since masked chunks vary in size.
+            flat = numpy.empty(max(size, 0 if flat is None else 2 * flat.size), dtype=dtype)
+            self._buffers[key] = flat
+            self.allocations += 1
+            self.bytes += flat.nbytes
+        return flat[:size].reshape(shape)
@@ -1,5 +1,52 @@
+import codecs
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from six import reraise
+from six.moves import queue
 from ply.lex import lex, StringTypes
-from ply.yacc import yacc
+from ply.yacc import (
+    yacc, ParserReflect, LRTable, LRParser, MiniProduction, PlyLogger, YaccError, __tabversion__
+)
+
+
+# Parser tables, by grammar hash (see LYFactory.grammar_hash), shared by every factory.
+_tables = {}
+_tables_lock = threading.Lock()
+
+# The names of yacc's parameters, so positional parser arguments can be given by name.
+try:
+    _YACC_ARGS = tuple(inspect.signature(yacc).parameters)
+except AttributeError:
+    _YACC_ARGS = tuple(inspect.getargspec(yacc).args)
+
+DEFAULT_WINDOW = 65536
+DEFAULT_LOOKAHEAD = 1024
+
+
+def _windows(source, window):
+    """
+    Iterates over the windows of a source: a file object (or memory-mapped file) is read
+      window by window, and other sources (e.g. strings) are sliced.
+    """
+
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(window)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for start in range(0, len(source), window):
+            yield source[start:start + window]
+
+
+class _Stopped(Exception):
+    pass
 
 
 def _statetoken(s, names):
@@ -38,6 +85,10 @@ class LYFactory(object):
     # This one must be overridden.
     t_ignore = ''
 
+    # A directory to keep the parser tables in, as files named by the grammar hash, so
+    #   other processes do not build them again. None keeps them in memory only.
+    tables_directory = None
+
     def __init__(self, lexer_args=None, lexer_kwargs=None, parser_args=None, parser_kwargs=None):
         """
         Builds the actual lexer object.
@@ -49,6 +100,10 @@ class LYFactory(object):
         self._parser_args = parser_args or ()
         self._parser_kwargs = parser_kwargs or {}
         self._state_info = None
+        self._lexer = None
+        self._tables = None
+        self._parsers = threading.local()
+        self._build_lock = threading.Lock()
         self._build_lexer_data()
 
     @property
@@ -142,21 +197,346 @@ class LYFactory(object):
 
         return self._tokens
 
+    def _parser_options(self):
+        """
+        Gets the yacc arguments as keyword arguments (the start symbol being `main` by default).
+        :return:
+        """
+
+        options = dict(zip(_YACC_ARGS, self._parser_args))
+        options.update(self._parser_kwargs)
+        options.setdefault('start', 'main')
+        return options
+
+    def _reflect(self, options):
+        """
+        Collects the grammar of this factory, as yacc does.
+        :return:
+        """
+
+        pdict = dict((name, getattr(self, name)) for name in dir(self))
+        module = sys.modules[type(self).__module__]
+        pdict['__file__'] = getattr(module, '__file__', '')
+        pdict['__package__'] = getattr(module, '__package__', None)
+        pdict['start'] = options['start']
+        reflect = ParserReflect(pdict, log=options.get('errorlog') or PlyLogger(sys.stderr))
+        reflect.get_all()
+        if reflect.error:
+            raise YaccError('Unable to build parser')
+        return reflect
+
+    def grammar_hash(self):
+        """
+        Hashes the grammar of this factory (its rules, tokens, precedence and start symbol,
+          as yacc signs them), along with the parsing method and the ply tables version.
+        :return:
+        """
+
+        options = self._parser_options()
+        return self._grammar_hash(options, self._reflect(options))
+
+    @staticmethod
+    def _grammar_hash(options, reflect):
+        text = '%s %s %s' % (__tabversion__, options.get('method', 'LALR'), reflect.signature())
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _tables_path(self, grammar_hash):
+        return os.path.join(self.tables_directory, 'parser-%s.pickle' % grammar_hash)
+
+    def _load_tables(self, grammar_hash, signature):
+        """
+        Loads the tables from the tables directory, if they are there.
+        """
+
+        if self.tables_directory is None:
+            return None
+        try:
+            with open(self._tables_path(grammar_hash), 'rb') as tables_file:
+                tables = pickle.load(tables_file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return tables if tables.get('signature') == signature else None
+
+    def _store_tables(self, grammar_hash, tables):
+        """
+        Stores the tables in the tables directory, if any.
+        """
+
+        if self.tables_directory is None:
+            return
+        if not os.path.isdir(self.tables_directory):
+            try:
+                os.makedirs(self.tables_directory)
+            except OSError:
+                if not os.path.isdir(self.tables_directory):
+                    raise
+        # Write aside and rename, so concurrent readers never see partial tables.
+        handle, temporary = tempfile.mkstemp(suffix='.pickle', dir=self.tables_directory)
+        with os.fdopen(handle, 'wb') as tables_file:
+            pickle.dump(tables, tables_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self._tables_path(grammar_hash))
+
+    def _build_tables(self, options):
+        """
+        Builds (or gets from the memory, or from the tables directory) the parser tables of
+          this factory's grammar.
+        :return: The tables, and the reflected grammar to bind them to.
+        """
+
+        reflect = self._reflect(options)
+        signature = reflect.signature()
+        grammar_hash = self._grammar_hash(options, reflect)
+        with _tables_lock:
+            tables = _tables.get(grammar_hash)
+            if tables is None or tables['signature'] != signature:
+                tables = self._load_tables(grammar_hash, signature)
+                if tables is None:
+                    # Tables are kept by this factory, so yacc must not read or write table files.
+                    options = dict(options, write_tables=False, picklefile=None)
+                    parser = yacc(module=self, **options)
+                    productions = [(p.str, p.name, p.len, p.func, p.file, p.line) if p.func else
+                                   (str(p), p.name, p.len, None, None, None) for p in parser.productions]
+                    tables = {'signature': signature, 'method': options.get('method', 'LALR'),
+                              'action': parser.action, 'goto': parser.goto, 'productions': productions}
+                    self._store_tables(grammar_hash, tables)
+                _tables[grammar_hash] = tables
+        return tables, reflect
+
+    def _parser(self):
+        """
+        Gets the parser of the current thread (parsers keep their state while parsing, so
+          they cannot be shared among threads). Parsers are bound to the tables built once.
+        :return:
+        """
+
+        parser = getattr(self._parsers, 'parser', None)
+        if parser is None:
+            tables, reflect = self._parser_tables()
+            parser = self._parsers.parser = self._new_parser(tables, reflect.pdict, reflect.error_func)
+        return parser
+
+    def _parser_tables(self):
+        with self._build_lock:
+            if self._tables is None:
+                self._tables = self._build_tables(self._parser_options())
+        return self._tables
+
+    @staticmethod
+    def _new_parser(tables, pdict, error_func):
+        """
+        Creates a parser over the tables, calling the rule functions in pdict.
+        """
+
+        table = LRTable()
+        table.lr_method = tables['method']
+        table.lr_action = tables['action']
+        table.lr_goto = tables['goto']
+        table.lr_productions = [MiniProduction(*production) for production in tables['productions']]
+        table.bind_callables(pdict)
+        return LRParser(table, error_func)
+
+    def _new_lexer(self):
+        """
+        Gets a new lexer, cloned from the one built once (clones share the compiled rules,
+          but not the input, position and state).
+        :return:
+        """
+
+        if self._lexer is None:
+            with self._build_lock:
+                if self._lexer is None:
+                    self._lexer = lex(object=self, *self._lexer_args, **self._lexer_kwargs)
+        lexer = self._lexer.clone()
+        lexer.lexstatestack = []
+        return lexer
+
+    def parser(self, debug=False, tracking=False):
+        """
+        Gets a reusable parse callable, taking the input text. It is thread-safe: each call
+          lexes with its own lexer, and parses with the parser of its thread. Lexer and parser
+          tables are built once, so repeated parses only pay for the parse itself.
+        :return:
+        """
+
+        def parse(inp):
+            lexer = self._new_lexer()
+            lexer.parser = self._parser()
+            return lexer.parser.parse(inp, lexer, debug, tracking)
+        return parse
+
+    def tokenize(self, inp):
+        """
+        Iterates over the tokens of an input text, with a lexer of its own.
+        :param inp:
+        :return:
+        """
+
+        lexer = self._new_lexer()
+        lexer.input(inp)
+        return (t for t in lexer)
+
+    def _stream(self, lexer, source, window, lookahead, encoding):
+        """
+        Lexes a source window by window. Tokens are only lexed from positions having at least
+          `lookahead` characters after them (until the last window), so errors are not raised
+          for input which is not read yet. A token lexed past that position, or reaching the
+          end of a window (as may an ignored or discarded text), may continue in the next one:
+          the lexer is rewound to where it was before lexing it (position, line number and
+          state) and lexes it again along with the next window. Side effects of token functions
+          other than on the lexer are not undone, and may happen again for the rewound token.
+        """
+
+        decoder = codecs.getincrementaldecoder(encoding)() if encoding else None
+        windows = _windows(source, window)
+        eof, lexer.lexeoff = lexer.lexeoff, None
+        buffer, base, final = None, 0, False
+        while not final:
+            chunk = next(windows, None)
+            final = chunk is None
+            if decoder is not None:
+                chunk = decoder.decode(chunk or b'', final)
+            if chunk:
+                buffer = chunk if buffer is None else buffer + chunk
+            if buffer is None:
+                continue
+            if final:
+                lexer.lexeoff = eof
+            lexer.input(buffer)
+            limit, start = len(buffer) - lookahead, None
+            while final or lexer.lexpos < limit:
+                if not final:
+                    saved = lexer.lexpos, lexer.lineno, lexer.current_state(), list(lexer.lexstatestack)
+                token = lexer.token()
+                if not final and (token is None or token.lexpos >= limit or lexer.lexpos >= len(buffer)):
+                    # The token, or the text skipped before it, may continue in the next window.
+                    start, lexer.lineno = saved[0], saved[1]
+                    lexer.begin(saved[2])
+                    lexer.lexstatestack = saved[3]
+                    break
+                if token is None:
+                    break
+                token.lexpos += base
+                yield token
+            if not final:
+                if start is None:
+                    start = min(lexer.lexpos, len(buffer))
+                buffer, base = buffer[start:], base + start
+
+    def tokenize_stream(self, source, window=DEFAULT_WINDOW, lookahead=DEFAULT_LOOKAHEAD, encoding=None):
+        """
+        Iterates over the tokens of a large input, read in bounded windows, so memory stays
+          flat regardless of the input size (token positions are still absolute).
+        :param source: A file object, a memory-mapped file, or a string.
+        :param window: The amount of characters (or bytes) read at once.
+        :param lookahead: The amount of characters kept after a position before lexing from
+          it (until the end of the input). Tokens must be shorter than this.
+        :param encoding: An optional encoding to decode the windows with (e.g. for files
+          opened in binary mode, or memory-mapped files).
+        :return:
+        """
+
+        return self._stream(self._new_lexer(), source, window, lookahead, encoding)
+
+    def parse_stream(self, source, reductions=('main',), window=DEFAULT_WINDOW, lookahead=DEFAULT_LOOKAHEAD,
+                     encoding=None, debug=False, tracking=False, batch=256, buffered=16):
+        """
+        Parses a large input, read in bounded windows (see tokenize_stream), yielding the
+          reductions of the given rules as (rule name, value) as they are made. The parse runs
+          in a thread of its own, handing the reductions over in batches, and ahead of the
+          consumer by `buffered` batches at most, so processing can start before the input is
+          fully read.
+
+        Rules yielding their values should not keep them also (e.g. `main : main statement`
+          may yield each statement, and build nothing), so memory stays flat.
+        :param source: As in tokenize_stream.
+        :param reductions: The names of the rules whose reductions are yielded. The main rule
+          (by default) yields the result of the whole parse.
+        :param window: As in tokenize_stream.
+        :param lookahead: As in tokenize_stream.
+        :param encoding: As in tokenize_stream.
+        :param batch: The amount of reductions handed over at once.
+        :param buffered: The amount of batches the parse may be ahead of the consumer.
+        :return:
+        """
+
+        reductions = frozenset(reductions)
+        results = queue.Queue(buffered)
+        stopped = threading.Event()
+        done, failed = object(), object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise _Stopped()
+
+        pending = []
+
+        def next_token(tokens):
+            if stopped.is_set():
+                raise _Stopped()
+            return next(tokens, None)
+
+        def bound(func, name):
+            def reduce(p):
+                func(p)
+                pending.append((name, p[0]))
+                if len(pending) >= batch:
+                    put(pending[:])
+                    del pending[:]
+            return reduce
+
+        def run():
+            try:
+                tables, reflect = self._parser_tables()
+                pdict = dict(reflect.pdict)
+                for production in tables['productions']:
+                    if production[1] in reductions and production[3]:
+                        pdict[production[3]] = bound(reflect.pdict[production[3]], production[1])
+                parser = self._new_parser(tables, pdict, reflect.error_func)
+                lexer = self._new_lexer()
+                lexer.parser = parser
+                tokens = self._stream(lexer, source, window, lookahead, encoding)
+                parser.parse(None, lexer, debug, tracking, lambda: next_token(tokens))
+                if pending:
+                    put(pending)
+                put(done)
+            except _Stopped:
+                pass
+            except Exception:
+                try:
+                    put((failed, sys.exc_info()))
+                except _Stopped:
+                    pass
+
+        worker = threading.Thread(target=run)
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                items = results.get()
+                if items is done:
+                    return
+                if items[0] is failed:
+                    reraise(*items[1])
+                for reduction in items:
+                    yield reduction
+        finally:
+            stopped.set()
+            worker.join()
+
     def ly(self, input=None, debug=False, tracking=False):
         """
-        Creates a lexer, a parser, and starts the party.
+        Parses the input or, if no input is given, gets a parse callable (see parser) and
+          a tokenizing callable (see tokenize).
         :return:
         """
 
-        if len(self._parser_args) < 5 and 'start' not in self._parser_kwargs:
-            self._parser_kwargs['start'] = 'main'
-        lexer = lex(object=self, *self._lexer_args, **self._lexer_kwargs)
-        parser = yacc(module=self, *self._parser_args, **self._parser_kwargs)
-        lexer.parser = parser
+        parse = self.parser(debug, tracking)
         if input is None:
-            def _lex_iterate(inp):
-                lexer.input(inp)
-                return (t for t in lexer)
-            return lambda inp: parser.parse(inp, lexer, debug, tracking), _lex_iterate
+            return parse, self.tokenize
         else:
-            return parser.parse(input, lexer, debug, tracking)
+            return parse(input)
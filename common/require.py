@@ -1,33 +1,164 @@
 import os
 import sys
-import imp
+import types
+import marshal
+import hashlib
+import tempfile
+import weakref
 import contextlib
 import threading
+import collections
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
 
 
+# Guards the registry of per-path and per-name locks (loads of different files, under
+#   different names, do not wait for each other), and the caches.
 lock = threading.Lock()
 
+# A directory to cache the compiled plugins in (keyed by their path and content), or None
+#   to keep them in memory only. Nothing is ever written next to the plugins.
+BYTECODE_DIRECTORY = None
 
-def as_module(file_path, name):
+# The amount of loaded modules, and of compiled plugins, kept in memory (the least recently
+#   required ones are forgotten first).
+CACHE_SIZE = 256
+
+# The per-path and per-name locks, kept only while some load holds or waits for them.
+_locks = weakref.WeakValueDictionary()
+# Loaded modules, by (path, name): ((mtime, size), content hash, module).
+_modules = collections.OrderedDict()
+# Compiled code of the current content of each path, by path: (key, code).
+_code = collections.OrderedDict()
+
+
+def _lock_of(key):
+    key_lock = _locks.get(key)
+    if key_lock is None:
+        key_lock = _locks[key] = threading.Lock()
+    return key_lock
+
+
+@contextlib.contextmanager
+def _locked(path, name):
+    # The path is always locked before the name, so loads never wait for each other in a cycle.
+    with lock:
+        path_lock, name_lock = _lock_of(('path', path)), _lock_of(('name', name))
+    with path_lock:
+        with name_lock:
+            yield
+
+
+def _cached(cache, key):
+    with lock:
+        value = cache.pop(key, None)
+        if value is not None:
+            cache[key] = value
+        return value
+
+
+def _cache(cache, key, value):
+    with lock:
+        cache.pop(key, None)
+        cache[key] = value
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _compiled(file_path, source, bytecode_directory):
+    """
+    Compiles the source of a plugin, or gets its code from the memory or the bytecode
+      directory (keyed by the interpreter's magic number, the path and the source).
+    """
+
+    digest = hashlib.sha1(MAGIC_NUMBER)
+    digest.update(file_path if isinstance(file_path, bytes) else file_path.encode('utf-8'))
+    digest.update(b'\0' + source)
+    key = digest.hexdigest()
+    compiled = _cached(_code, file_path)
+    if compiled is not None and compiled[0] == key:
+        return compiled[1]
+    code = None
+    cached = os.path.join(bytecode_directory, key + '.code') if bytecode_directory else None
+    if cached is not None and os.path.exists(cached):
+        try:
+            with open(cached, 'rb') as code_file:
+                code = marshal.load(code_file)
+        except (EOFError, ValueError, TypeError):
+            code = None
+    if code is None:
+        code = compile(source, file_path, 'exec', 0, True)
+        if cached is not None:
+            if not os.path.isdir(bytecode_directory):
+                try:
+                    os.makedirs(bytecode_directory)
+                except OSError:
+                    if not os.path.isdir(bytecode_directory):
+                        raise
+            # Write aside and rename, so concurrent loads never read partial code.
+            handle, temporary = tempfile.mkstemp(suffix='.code', dir=bytecode_directory)
+            with os.fdopen(handle, 'wb') as code_file:
+                marshal.dump(code, code_file)
+            os.rename(temporary, cached)
+    _cache(_code, file_path, (key, code))
+    return code
+
+
+def as_module(file_path, name, bytecode_directory=None, reload=False):
     """
     Requires an arbitrary file. It imports it and assigns it a name.
 
     It will be a useful tool in our programs requiring somehow a Python plugin.
+
+    Loaded plugins are cached by their path (and name): requiring an unchanged file (by
+      its mtime and size or, if those changed, its content) again gets the same module
+      without executing it again, unless a reload is told. Compiled code is cached in
+      memory and, optionally, in a bytecode directory, so even reloads or new processes
+      skip compiling unchanged plugins. Loads of different files, under different names,
+      run concurrently.
+
+    Reloads (and changed plugins) execute again into the module already loaded from the
+      same path and name, as importlib's reload does: importers holding the module see
+      the new code, and names the new code no longer defines are kept.
     :param file_path:
-    :param as_module:
+    :param name:
+    :param bytecode_directory: The directory to cache the compiled plugins in (by default,
+      BYTECODE_DIRECTORY).
+    :param reload: Whether to execute the plugin again, even if it is unchanged.
     :return:
     """
 
-    with lock:
-        with open(file_path, 'U') as module_file:
-            prev = sys.dont_write_bytecode
-            sys.dont_write_bytecode = True
-            module = imp.load_module(name, module_file, file_path, (".py", 'U', imp.PY_SOURCE))
-            sys.dont_write_bytecode = prev
-            sys.modules[name] = module
-            return module
-
-
-
+    file_path = os.path.abspath(file_path)
+    if bytecode_directory is None:
+        bytecode_directory = BYTECODE_DIRECTORY
+    with _locked(file_path, name):
+        status = os.stat(file_path)
+        stamp = status.st_mtime, status.st_size
+        cached = _cached(_modules, (file_path, name))
+        if cached is not None and not reload and cached[0] == stamp:
+            sys.modules[name] = cached[2]
+            return cached[2]
 
+        with open(file_path, 'rb') as module_file:
+            source = module_file.read()
+        digest = hashlib.sha1(source).hexdigest()
+        if cached is not None and not reload and cached[1] == digest:
+            _cache(_modules, (file_path, name), (stamp, digest, cached[2]))
+            sys.modules[name] = cached[2]
+            return cached[2]
 
+        code = _compiled(file_path, source, bytecode_directory)
+        module = types.ModuleType(name) if cached is None else cached[2]
+        module.__file__ = file_path
+        sys.modules[name] = module
+        try:
+            exec(code, module.__dict__)
+        except BaseException:
+            if cached is None and sys.modules.get(name) is module:
+                del sys.modules[name]
+            raise
+        _cache(_modules, (file_path, name), (stamp, digest, module))
+        return module
@@ -14,7 +14,7 @@ rgb_img = spaces.rgb_normalize(imread(os.path.join(os.path.dirname(__file__), 's
 mapper1 = mappers.Mapper()
 
 # Cuando el matiz parezca ser rojo...
-mapper1.on(hsv.h_is(IN(0, 3./180.0)) | hsv.h_is(IN(177.0/180.0, 1)), spaces.hsv).do(
+mapper1.on(hsv.h_is(IN(177.0/180.0, 3./180.0)), spaces.hsv).do(
     rgb.mul(spaces.rgb.B, 0.5), spaces.rgb  # disminuir azul a la mitad
 )
 
@@ -0,0 +1,45 @@
+import numpy
+from colormap import spaces
+from colormap.compiler import LoweredExpression
+from colormap.mappers import Mapper
+from colormap.types import IN
+
+
+def band_check(components, check, interval):
+    """
+    The lowered form of e.g. hsv.h_is(IN(0.1, 0.5)), as colormap.sources builds it.
+    """
+
+    return LoweredExpression(('call', ('attr', ('attr', ('root',), components), check), (('const', interval),), ()))
+
+
+def band_operation(components, operation, band, value):
+    """
+    The lowered form of e.g. rgb.mul(spaces.rgb.B, 0.5), as colormap.sources builds it.
+    """
+
+    return LoweredExpression(('call', ('attr', ('attr', ('root',), components), operation),
+                              (('const', band), ('const', value)), ()))
+
+
+def hue_mapper(dtype=None):
+    """
+    Halves the blue of the greenish pixels, and doubles the red of the bright ones.
+    """
+
+    mapper = Mapper(dtype)
+    mapper.on(band_check('hsv', 'h_is', IN(0.2, 0.5)), spaces.hsv).do(
+        band_operation('rgb', 'mul', spaces.rgb.B, 0.5), spaces.rgb
+    )
+    mapper.on(band_check('hsv', 'v_is', IN(0.8, 1.0)), spaces.hsv).do(
+        band_operation('rgb', 'mul', spaces.rgb.R, 2.0), spaces.rgb
+    )
+    return mapper
+
+
+def noise(rows=48, cols=40, channels=4, seed=0):
+    """
+    A normalized image of uniform noise.
+    """
+
+    return numpy.random.RandomState(seed).rand(rows, cols, channels)
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from numpy import float32, float64, uint8
+from colormap.files import open_image, create_image, map_bands, map_file
+from colormap.utils import rgb_normalize, rgb_denormalize
+from .common import hue_mapper, noise
+
+
+class FilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = noise(rows=45, cols=20)
+        self.expected = hue_mapper().run(self.image, False, dedup=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_npy_round_trip(self):
+        numpy.save(self.path('in.npy'), self.image)
+        out = map_file(hue_mapper(), self.path('in.npy'), self.path('out.npy'), band_rows=7)
+        del out
+        result = numpy.load(self.path('out.npy'))
+        self.assertEqual(result.dtype, float64)
+        numpy.testing.assert_array_equal(result, self.expected)
+
+    def test_raw_file_with_explicit_shape_and_dtype(self):
+        self.image.tofile(self.path('in.raw'))
+        stats = {}
+        map_file(hue_mapper(), self.path('in.raw'), self.path('out.raw'), shape=self.image.shape, dtype=float64,
+                 band_rows=7, stats=stats)
+        result = open_image(self.path('out.raw'), self.image.shape, float64)
+        numpy.testing.assert_array_equal(result, self.expected)
+        self.assertEqual(stats, {'bands': 7, 'pixels': 45 * 20})
+
+    def test_raw_file_offset(self):
+        with open(self.path('in.raw'), 'wb') as f:
+            f.write(b'HEADER!!')
+            self.image.tofile(f)
+        map_file(hue_mapper(), self.path('in.raw'), self.path('out.npy'), shape=self.image.shape, dtype=float64,
+                 offset=8)
+        numpy.testing.assert_array_equal(numpy.load(self.path('out.npy')), self.expected)
+
+    def test_tiled_and_parallel(self):
+        numpy.save(self.path('in.npy'), self.image)
+        map_file(hue_mapper(), self.path('in.npy'), self.path('out.npy'), band_rows=16, tile_shape=(5, 6),
+                 workers=2)
+        numpy.testing.assert_array_equal(numpy.load(self.path('out.npy')), self.expected)
+
+    def test_float_output(self):
+        numpy.save(self.path('in.npy'), self.image)
+        map_file(hue_mapper(), self.path('in.npy'), self.path('out.npy'), out_dtype=float32, band_rows=7)
+        result = numpy.load(self.path('out.npy'))
+        self.assertEqual(result.dtype, float32)
+        expected = hue_mapper().run(self.image.astype(float32), False, dedup=False)
+        numpy.testing.assert_array_equal(result, expected)
+
+    def test_uint8_to_uint8(self):
+        image = rgb_denormalize(self.image, uint8)
+        numpy.save(self.path('in.npy'), image)
+        map_file(hue_mapper(), self.path('in.npy'), self.path('out.npy'), band_rows=7)
+        result = numpy.load(self.path('out.npy'))
+        self.assertEqual(result.dtype, uint8)
+        expected = rgb_denormalize(hue_mapper().run(rgb_normalize(image), False, dedup=False), uint8)
+        numpy.testing.assert_array_equal(result, expected)
+
+    def test_npy_shape_and_dtype_are_checked(self):
+        numpy.save(self.path('in.npy'), self.image)
+        self.assertEqual(open_image(self.path('in.npy'), self.image.shape, float64).shape, self.image.shape)
+        with self.assertRaises(ValueError):
+            open_image(self.path('in.npy'), shape=(45, 20, 3))
+        with self.assertRaises(ValueError):
+            open_image(self.path('in.npy'), dtype=float32)
+        with self.assertRaises(ValueError):
+            map_file(hue_mapper(), self.path('in.npy'), self.path('out.npy'), dtype=uint8)
+
+    def test_raw_files_need_a_shape(self):
+        self.image.tofile(self.path('in.raw'))
+        with self.assertRaises(ValueError):
+            open_image(self.path('in.raw'))
+
+    def test_existing_output_mismatch(self):
+        create_image(self.path('small.npy'), (45, 19, 4), float64).flush()
+        create_image(self.path('int.npy'), self.image.shape, numpy.int16).flush()
+        with self.assertRaises(ValueError):
+            map_bands(hue_mapper(), self.image, open_image(self.path('small.npy'), mode='r+'))
+        with self.assertRaises(ValueError):
+            map_bands(hue_mapper(), self.image, open_image(self.path('int.npy'), mode='r+'))
+        with self.assertRaises(ValueError):
+            open_image(self.path('small.npy'), self.image.shape, float64, mode='r+')
+
+    def test_existing_output_is_overwritten(self):
+        create_image(self.path('out.npy'), self.image.shape, float64).flush()
+        out = open_image(self.path('out.npy'), self.image.shape, float64, mode='r+')
+        map_bands(hue_mapper(), self.image, out, band_rows=7)
+        del out
+        numpy.testing.assert_array_equal(numpy.load(self.path('out.npy')), self.expected)
@@ -0,0 +1,63 @@
+import contextlib
+import unittest
+import numpy
+import pytest
+from colormap import kernels
+
+
+@contextlib.contextmanager
+def weak_promotion():
+    """
+    Promotes as NumPy 2 does (Python and NumPy scalars do not upcast arrays by their value).
+    """
+
+    set_state = getattr(numpy, '_set_promotion_state', None)
+    if set_state is None:
+        yield
+        return
+    former = numpy._get_promotion_state()
+    set_state('weak')
+    try:
+        yield
+    finally:
+        set_state(former)
+
+
+class Float32Test(unittest.TestCase):
+
+    def test_luv_stays_in_float32(self):
+        image = numpy.random.RandomState(0).rand(64, 3).astype(numpy.float32)
+        with weak_promotion():
+            components = kernels._luv(kernels.rgb2xyz(image))
+            self.assertEqual([component.dtype for component in components], [numpy.float32] * 3)
+            luv = kernels.rgb2luv(image)
+            self.assertEqual(luv.dtype, numpy.float32)
+            numpy.testing.assert_allclose(kernels.luv2rgb(luv), image, atol=1e-4)
+        numpy.testing.assert_allclose(luv, kernels.rgb2luv(image.astype(numpy.float64)), rtol=1e-4, atol=1e-3)
+
+    def test_conversions_round_trip(self):
+        image = numpy.random.RandomState(1).rand(32, 32, 3)
+        # HED is not here: deconvolution clips negative stain amounts, so it is lossy.
+        for name in ('hsv', 'luv', 'lab', 'xyz'):
+            encoded = getattr(kernels, 'rgb2' + name)(image)
+            numpy.testing.assert_allclose(getattr(kernels, name + '2rgb')(encoded), image, atol=1e-6)
+
+
+SKIMAGE_CONVERSIONS = (
+    ('rgb2hsv', None), ('hsv2rgb', 'rgb2hsv'),
+    ('rgb2xyz', None), ('xyz2rgb', 'rgb2xyz'),
+    ('rgb2lab', None), ('lab2rgb', 'rgb2lab'), ('xyz2lab', 'rgb2xyz'),
+    ('rgb2luv', None), ('luv2rgb', 'rgb2luv'), ('xyz2luv', 'rgb2xyz'),
+    ('rgb2hed', None), ('hed2rgb', 'rgb2hed'),
+)
+
+
+@pytest.mark.parametrize('name, forward', SKIMAGE_CONVERSIONS)
+def test_kernels_match_skimage(name, forward):
+    color = pytest.importorskip('skimage.color')
+    image = numpy.random.RandomState(4).rand(64, 64, 3)
+    # Grays, blacks and whites are the edge cases of hsv (delta == 0) and luv (L == 0).
+    image[:4] = numpy.linspace(0, 1, 64)[numpy.newaxis, :, numpy.newaxis]
+    # Inverse conversions take the forward conversion of the same pixels, so they are in range.
+    source = image if forward is None else getattr(color, forward)(image)
+    numpy.testing.assert_allclose(getattr(kernels, name)(source), getattr(color, name)(source), rtol=0, atol=1e-9)
@@ -0,0 +1,71 @@
+import io
+import shutil
+import tempfile
+import unittest
+from ply.yacc import NullLogger
+from common import lang
+from common.lang import LYFactory
+
+
+class Sums(LYFactory):
+
+    literals = '+;'
+    t_ignore = ' '
+
+    def t_NUMBER(self, t):
+        r'\d+'
+        t.value = int(t.value)
+        return t
+
+    def p_main(self, p):
+        """main : main statement
+                | statement"""
+
+    def p_statement(self, p):
+        "statement : expr ';'"
+        p[0] = p[1]
+
+    def p_sum(self, p):
+        "expr : expr '+' NUMBER"
+        p[0] = p[1] + p[3]
+
+    def p_number(self, p):
+        "expr : NUMBER"
+        p[0] = p[1]
+
+
+def sums(**kwargs):
+    return Sums(parser_kwargs=dict({'debug': False, 'errorlog': NullLogger()}, **kwargs))
+
+
+class ParserTablesTest(unittest.TestCase):
+
+    def test_positional_parser_args_are_named(self):
+        factory = Sums(parser_args=('LALR', False), parser_kwargs={'errorlog': NullLogger()})
+        options = factory._parser_options()
+        self.assertEqual(options['method'], 'LALR')
+        self.assertEqual(options['debug'], False)
+        self.assertEqual(options['start'], 'main')
+
+    def test_tables_are_built_once(self):
+        factory = sums()
+        parse = factory.parser()
+        self.assertEqual(list(factory.parse_stream('1 + 2; 3;', ('statement',))),
+                         [('statement', 3), ('statement', 3)])
+        parse('1;')
+        self.assertIs(factory._parser_tables(), factory._parser_tables())
+        self.assertEqual(factory.grammar_hash(), sums().grammar_hash())
+
+    def test_tables_directory(self):
+        directory = tempfile.mkdtemp()
+        try:
+            Sums.tables_directory = directory
+            grammar_hash = sums().grammar_hash()
+            sums().parser()('1;')
+            lang._tables.pop(grammar_hash)
+            factory = sums()
+            self.assertEqual(list(factory.parse_stream('4 + 5;', ('statement',))), [('statement', 9)])
+            self.assertIn(grammar_hash, lang._tables)
+        finally:
+            Sums.tables_directory = None
+            shutil.rmtree(directory, True)
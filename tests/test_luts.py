@@ -0,0 +1,116 @@
+import functools
+import shutil
+import tempfile
+import unittest
+import numpy
+from colormap import spaces
+from colormap.luts import LookupTable, LookupTableCache
+from colormap.mappers import Mapper
+from colormap.types import IN
+from .common import band_check, band_operation, hue_mapper
+
+
+def scale(factor, wrapper):
+    return wrapper._ * factor
+
+
+def every_pixel(wrapper):
+    return numpy.ones(wrapper._.shape[:-1], dtype=bool)
+
+
+class _Unknown(object):
+    """
+    A C-level callable, standing for callables whose state cannot be told.
+    """
+
+    __call__ = numpy.ones_like
+
+
+def linear_mapper():
+    mapper = Mapper()
+    mapper.on(band_check('rgb', 'r_is', IN(0.0, 1.0)), spaces.rgb).do(
+        band_operation('rgb', 'mul', spaces.rgb.G, 0.5), spaces.rgb
+    )
+    return mapper
+
+
+class LookupTableTest(unittest.TestCase):
+
+    def test_grid_colors_are_exact(self):
+        levels = 9
+        lut = LookupTable.build(hue_mapper(), levels)
+        grid = numpy.random.RandomState(0).randint(0, levels, (32, 32, 3)) / float(levels - 1)
+        numpy.testing.assert_allclose(lut.apply(grid), hue_mapper().run(grid, True), atol=1e-12)
+
+    def test_tables_are_built_slab_by_slab(self):
+        levels = 6
+        grid = numpy.arange(levels) / float(levels - 1)
+        cube = numpy.stack(numpy.meshgrid(grid, grid, grid, indexing='ij'), -1)
+        expected = hue_mapper().run(cube.reshape((-1, levels, 3)), True).reshape(cube.shape)
+        lut = LookupTable.build(hue_mapper(), levels)
+        numpy.testing.assert_array_equal(lut.table, expected)
+        single = LookupTable.build(hue_mapper(numpy.float32), levels, dtype=numpy.float32)
+        self.assertEqual(single.table.dtype, numpy.float32)
+        expected = hue_mapper(numpy.float32).run(cube.reshape((-1, levels, 3)), True).reshape(cube.shape)
+        numpy.testing.assert_array_equal(single.table, expected)
+
+    def test_interpolation_error_of_linear_mappings(self):
+        lut = LookupTable.build(linear_mapper(), 5)
+        image = numpy.random.RandomState(1).rand(32, 32, 4)
+        numpy.testing.assert_allclose(lut.apply(image), linear_mapper().run(image, True), atol=1e-12)
+
+    def test_interpolation_error_is_bounded_by_the_grid(self):
+        mapper = hue_mapper()
+        image = numpy.random.RandomState(2).rand(32, 32, 3)
+        mapped = mapper.run(image, True)
+        coarse = numpy.abs(LookupTable.build(mapper, 9).apply(image) - mapped).mean()
+        fine = numpy.abs(LookupTable.build(mapper, 33).apply(image) - mapped).mean()
+        self.assertLess(fine, coarse)
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def fingerprint(self, masker, action):
+        mapper = Mapper()
+        mapper.on(masker, spaces.rgb).do(action, spaces.rgb)
+        return mapper.fingerprint()
+
+    def test_partials(self):
+        self.assertNotEqual(self.fingerprint(every_pixel, functools.partial(scale, 0.5)),
+                            self.fingerprint(every_pixel, functools.partial(scale, 0.25)))
+
+    def test_bound_methods(self):
+        self.assertNotEqual(self.fingerprint(every_pixel, numpy.float64(0.5).__mul__),
+                            self.fingerprint(every_pixel, numpy.float64(0.25).__mul__))
+
+    def test_referred_globals(self):
+        first = self.fingerprint(every_pixel, functools.partial(scale, 0.5))
+        global numpy
+        original, numpy = numpy, None
+        try:
+            second = self.fingerprint(every_pixel, functools.partial(scale, 0.5))
+        finally:
+            numpy = original
+        self.assertEqual(first, self.fingerprint(every_pixel, functools.partial(scale, 0.5)))
+        self.assertNotEqual(first, second)
+
+    def test_unknown_callables_need_a_key(self):
+        mapper = Mapper()
+        mapper.on(every_pixel, spaces.rgb).do(_Unknown(), spaces.rgb)
+        self.assertRaises(TypeError, mapper.fingerprint)
+        cache = LookupTableCache(tempfile.gettempdir())
+        self.assertIn('explicit', cache.path(mapper, 2, key='explicit'))
+
+
+class LookupTableCacheTest(unittest.TestCase):
+
+    def test_tables_are_stored_by_fingerprint(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = LookupTableCache(directory)
+            built = cache.get(hue_mapper(), 5)
+            loaded = cache.get(hue_mapper(), 5)
+            numpy.testing.assert_array_equal(loaded.table, built.table)
+            self.assertNotEqual(cache.path(hue_mapper(), 5), cache.path(linear_mapper(), 5))
+        finally:
+            shutil.rmtree(directory, True)
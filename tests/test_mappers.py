@@ -0,0 +1,150 @@
+import copy
+import pickle
+import unittest
+import numpy
+from colormap.mappers import ConversionCache, THREADS, PROCESSES
+from colormap import spaces
+from colormap.mappers import Mapper, MappingContext, Masker, Action
+from colormap.types import IN
+from colormap.utils import ScratchArena
+from .common import band_check, band_operation, hue_mapper, noise
+
+
+def palette(rows=48, cols=40, colors=8, seed=0):
+    """
+    A normalized image of a few distinct colors.
+    """
+
+    random = numpy.random.RandomState(seed)
+    return random.rand(colors, 4)[random.randint(0, colors, (rows, cols))]
+
+
+class TiledTest(unittest.TestCase):
+
+    def test_tiled_runs_are_bit_identical(self):
+        image = noise(70, 90)
+        for cache in (True, False):
+            expected = hue_mapper().run(image, cache, dedup=False)
+            for tile_shape in ((5, 3), (16, 16), (7, 33), (70, 90), (256, 256)):
+                mapped = hue_mapper().run(image, cache, tile_shape, dedup=False)
+                numpy.testing.assert_array_equal(mapped, expected)
+
+    def test_output_buffer(self):
+        image = noise(40, 30)
+        out = numpy.empty_like(image)
+        self.assertIs(hue_mapper().run(image, True, (16, 16), out), out)
+        numpy.testing.assert_array_equal(out, hue_mapper().run(image, True))
+        self.assertRaises(ValueError, hue_mapper().run, image, True, (16, 16), out[1:])
+
+    def test_batches_are_mapped_frame_by_frame(self):
+        frames = numpy.stack([noise(20, 30, seed=seed) for seed in range(3)])
+        mapped = hue_mapper().run_batch(frames, True, (8, 8))
+        for frame, expected in zip(mapped, frames):
+            numpy.testing.assert_array_equal(frame, hue_mapper().run(expected, True, dedup=False))
+
+
+class DedupTest(unittest.TestCase):
+
+    def test_low_color_images_are_deduplicated(self):
+        image, stats = palette(), {}
+        mapped = hue_mapper().run(image, True, stats=stats)
+        self.assertTrue(stats['dedup'])
+        numpy.testing.assert_array_equal(mapped, hue_mapper().run(image, True, dedup=False))
+
+    def test_tiled_runs_are_not_deduplicated_unless_told(self):
+        image, stats = palette(), {}
+        mapped = hue_mapper().run(image, True, (16, 16), stats=stats)
+        self.assertFalse(stats['dedup'])
+        self.assertNotIn('sampled_ratio', stats)
+        numpy.testing.assert_array_equal(mapped, hue_mapper().run(image, True, (16, 16), dedup=True))
+
+    def test_high_color_images_are_not_deduplicated(self):
+        stats = {}
+        hue_mapper().run(noise()[::2, ::-1], True, stats=stats)
+        self.assertFalse(stats['dedup'])
+
+
+class ParallelTest(unittest.TestCase):
+
+    def test_thread_and_process_pools_are_bit_identical(self):
+        image = noise(70, 90)
+        expected = hue_mapper().run(image, True, dedup=False)
+        for pool in (THREADS, PROCESSES):
+            for cache in (True, False, ConversionCache()):
+                mapped = hue_mapper().run(image, cache, (32, 16), workers=3, pool=pool, dedup=False)
+                numpy.testing.assert_array_equal(mapped, expected)
+
+    def test_conversion_caches_pickle_empty(self):
+        cache = ConversionCache(1 << 20)
+        hue_mapper().run(noise(8, 8), cache, dedup=False)
+        self.assertTrue(cache.bytes)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((copy.max_bytes, copy.bytes, copy.hits, copy.misses), (1 << 20, 0, 0, 0))
+        hue_mapper().run(noise(8, 8), copy, dedup=False)
+        self.assertTrue(copy.bytes)
+
+
+class ConversionCacheTest(unittest.TestCase):
+
+    def test_gathering_does_not_count_as_lookups(self):
+        mapper = Mapper()
+        mapper.on(band_check('hsv', 'h_is', IN(0.0, 0.6)), spaces.hsv).do(
+            band_operation('rgb', 'mul', spaces.rgb.B, 0.5), spaces.rgb
+        )
+        mapper.on(band_check('lab', 'l_is', IN(0, 50)), spaces.lab).do(
+            band_operation('hsv', 'mul', spaces.hsv.V, 0.5), spaces.hsv
+        )
+        cache = ConversionCache()
+        mapper.run(noise(64, 64), cache, dedup=False)
+        self.assertEqual((cache.hits, cache.misses), (0, len(cache._entries)))
+        mapper.run(noise(64, 64), cache, dedup=False)
+        self.assertEqual(cache.hits, 1)
+
+
+class NodeTest(unittest.TestCase):
+
+    def test_colorspaces_are_checked(self):
+        self.assertRaises(TypeError, Masker, band_check('hsv', 'h_is', IN(0.2, 0.5)), 'hsv')
+        self.assertRaises(TypeError, Action, band_operation('rgb', 'mul', spaces.rgb.B, 0.5), None)
+        self.assertRaises(TypeError, MappingContext(noise(4, 4), False).process_image, 'hsv')
+
+    def test_copies_compile_their_own_functions(self):
+        image = noise(6, 5)
+        context = MappingContext(image, False)
+        masker = Masker(band_check('hsv', 'h_is', IN(0.2, 0.5)), spaces.hsv)
+        action = Action(band_operation('rgb', 'mul', spaces.rgb.B, 0.5))
+        for node in (masker, action):
+            self.assertIsNone(node.__reduce_ex__(2)[2])
+        expected = masker.get_mask(context)
+        for copied in (masker._replace(), Masker._make(masker), copy.copy(masker)):
+            numpy.testing.assert_array_equal(copied.get_mask(context), expected)
+        other = masker._replace(masker=band_check('hsv', 'h_is', IN(0.5, 0.9)))
+        hue = context.process_image(spaces.hsv)._[..., 0]
+        numpy.testing.assert_array_equal(other.get_mask(context), IN(0.5, 0.9).contains(hue))
+        pixels = image[:, :, :3].reshape(-1, 3)
+        expected = action.execute(pixels.copy())
+        for copied in (action._replace(), Action._make(action), copy.copy(action)):
+            numpy.testing.assert_array_equal(copied.execute(pixels.copy()), expected)
+        scaled = action._replace(action=band_operation('rgb', 'mul', spaces.rgb.B, 0.25))
+        numpy.testing.assert_array_equal(scaled.execute(pixels.copy())[:, 2], pixels[:, 2] * 0.25)
+
+
+class ScratchTest(unittest.TestCase):
+
+    def test_allocations_do_not_grow_with_the_tiles(self):
+        counts = []
+        for side in (64, 128, 256):
+            stats = {}
+            hue_mapper().run(noise(side, side), False, (32, 32), dedup=False, stats=stats)
+            counts.append((stats['allocations'], stats['allocated_bytes']))
+        self.assertTrue(counts[0][0] > 0)
+        self.assertEqual(counts, [counts[0]] * 3)
+
+    def test_buffers_are_reused(self):
+        arena = ScratchArena()
+        first = arena.buffer('chunk', (10, 3), numpy.float64)
+        second = arena.buffer('chunk', (4, 3), numpy.float64)
+        self.assertTrue(numpy.shares_memory(first, second))
+        arena.buffer('chunk', (40, 3), numpy.float64)
+        arena.buffer('chunk', (10, 3), numpy.float32)
+        self.assertEqual((arena.allocations, arena.bytes), (3, 30 * 8 + 120 * 8 + 30 * 4))
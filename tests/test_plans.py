@@ -0,0 +1,41 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+from colormap.plans import MappingPlan
+from .common import hue_mapper, noise
+
+
+class MappingPlanTest(unittest.TestCase):
+
+    def assertSameMapper(self, mapper, other):
+        image = noise()
+        self.assertEqual(other.fingerprint(), mapper.fingerprint())
+        numpy.testing.assert_array_equal(other.run(image, True), mapper.run(image, True))
+
+    def test_bytes_round_trip(self):
+        mapper = hue_mapper()
+        plan = MappingPlan.loads(MappingPlan.of(mapper).dumps())
+        self.assertSameMapper(mapper, plan.mapper())
+
+    def test_file_round_trip(self):
+        mapper = hue_mapper(numpy.float32)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mapper.plan')
+            MappingPlan.of(mapper).save(path)
+            self.assertSameMapper(mapper, MappingPlan.load(path).mapper())
+        finally:
+            shutil.rmtree(directory, True)
+
+    def test_mappers_pickle_as_plans(self):
+        mapper = hue_mapper()
+        self.assertSameMapper(mapper, pickle.loads(pickle.dumps(mapper, pickle.HIGHEST_PROTOCOL)))
+
+    def test_plans_compile_without_cantrips_expressions(self):
+        MappingPlan.loads(MappingPlan.of(hue_mapper()).dumps()).mapper().run(noise(), False)
+        self.assertNotIn('cantrips.watch.expression', sys.modules)
+        self.assertNotIn('cantrips.watch.undefined', sys.modules)
@@ -0,0 +1,99 @@
+import json
+import pickle
+import unittest
+import numpy
+from colormap import spaces
+from colormap.mappers import ConversionCache, THREADS, PROCESSES
+from colormap.profiling import Profile
+from colormap.types import IN
+from .common import hue_mapper, noise
+
+
+def entry_pixels(image):
+    """
+    The pixels each entry of hue_mapper() takes, computed apart from the mapper.
+    """
+
+    hsv = spaces.hsv.encoder(image[..., :3])
+    greenish = IN(0.2, 0.5).contains(hsv[..., 0])
+    bright = IN(0.8, 1.0).contains(hsv[..., 2]) & ~greenish
+    return int(greenish.sum()), int(bright.sum())
+
+
+class ProfileTest(unittest.TestCase):
+
+    def test_entries_are_recorded(self):
+        image, profile = noise(), Profile()
+        hue_mapper().run(image, False, dedup=False, profile=profile)
+        pixels = image.shape[0] * image.shape[1]
+        expected = entry_pixels(image)
+        self.assertEqual(list(profile.maskers), [(0, 'hsv'), (1, 'hsv')])
+        self.assertEqual(list(profile.actions), [(0, 0, 'rgb'), (1, 0, 'rgb')])
+        for index, matched in enumerate(expected):
+            masker = profile.maskers[(index, 'hsv')]
+            self.assertEqual((masker['calls'], masker['matched'], masker['evaluated']), (1, matched, pixels))
+            action = profile.actions[(index, 0, 'rgb')]
+            self.assertEqual((action['calls'], action['pixels']), (1, matched))
+        self.assertEqual(len(profile.runs), 1)
+        self.assertEqual(profile.runs[0]['pixels'], pixels)
+
+    def test_conversions_match_the_cache(self):
+        image, cache = noise(), ConversionCache()
+        bound = cache.bind(image)
+        self.assertIsNone(bound.peek(spaces.hsv))
+        first = Profile()
+        hue_mapper().run(image, cache, dedup=False, profile=first)
+        self.assertIsNotNone(bound.peek(spaces.hsv))
+        # The hsv conversion is computed (a miss) once, and the second entry reuses it
+        #   as the last conversion, without looking the cache up.
+        self.assertEqual(first.conversions[('hsv', 'computed')]['calls'], cache.misses)
+        self.assertEqual(first.conversions[('hsv', 'computed')]['pixels'], image.shape[0] * image.shape[1])
+        self.assertEqual(first.conversions[('hsv', 'cached')]['calls'], 1)
+        self.assertEqual((first.runs[0]['cache_hits'], first.runs[0]['cache_misses']), (0, 1))
+        self.assertEqual(first.runs[0]['cache_bytes'], cache.bytes)
+
+        second = Profile()
+        hue_mapper().run(image, cache, dedup=False, profile=second)
+        self.assertNotIn(('hsv', 'computed'), second.conversions)
+        self.assertEqual(second.conversions[('hsv', 'cached')]['calls'], 2)
+        self.assertEqual((second.runs[0]['cache_hits'], second.runs[0]['cache_misses']), (1, 1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_parallel_runs_are_merged(self):
+        image = noise()
+        expected = entry_pixels(image)
+        tiles = 3 * 3
+        for pool in (THREADS, PROCESSES):
+            profile = Profile()
+            hue_mapper().run(image, False, (16, 16), workers=2, pool=pool, dedup=False, profile=profile)
+            for index, matched in enumerate(expected):
+                masker = profile.maskers[(index, 'hsv')]
+                self.assertEqual((masker['calls'], masker['matched']), (tiles, matched))
+                action = profile.actions[(index, 0, 'rgb')]
+                self.assertEqual((action['calls'], action['pixels']), (tiles, matched))
+            self.assertEqual(profile.conversions[('hsv', 'computed')]['calls'], tiles)
+            self.assertEqual(len(profile.runs), 1)
+
+    def test_profiles_are_merged(self):
+        image = noise()
+        first, second = Profile(), Profile()
+        hue_mapper().run(image, False, dedup=False, profile=first)
+        hue_mapper().run(image[:20], False, dedup=False, profile=second)
+        copy = pickle.loads(pickle.dumps(second))
+        self.assertEqual(copy.as_dict(), second.as_dict())
+        matched = first.maskers[(0, 'hsv')]['matched'] + second.maskers[(0, 'hsv')]['matched']
+        self.assertIs(first.merge(copy), first)
+        self.assertEqual(first.maskers[(0, 'hsv')]['calls'], 2)
+        self.assertEqual(first.maskers[(0, 'hsv')]['matched'], matched)
+        self.assertEqual(len(first.runs), 2)
+
+    def test_json_round_trip(self):
+        profile = Profile()
+        hue_mapper().run(noise(), ConversionCache(), (16, 16), dedup=False, profile=profile)
+        records = profile.as_dict()
+        self.assertEqual(json.loads(profile.to_json()), records)
+        self.assertEqual(json.loads(json.dumps(records)), records)
+        self.assertEqual(len(records['maskers']), 2)
+        self.assertEqual(records['maskers'][0]['entry'], 0)
+        self.assertIn('cache_hits', records['runs'][0])
+        self.assertTrue(profile.report())
@@ -0,0 +1,101 @@
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from common import require
+
+
+class AsModuleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+        for name in ('plugin_cached', 'plugin_reloaded', 'plugin_shared'):
+            sys.modules.pop(name, None)
+
+    def plugin(self, file_name, source):
+        path = os.path.join(self.directory, file_name)
+        with open(path, 'w') as plugin_file:
+            plugin_file.write(source)
+        return path
+
+    def test_unchanged_plugins_are_not_executed_again(self):
+        path = self.plugin('cached.py', 'VALUE = 1\n')
+        module = require.as_module(path, 'plugin_cached')
+        module.VALUE = 2
+        self.assertIs(require.as_module(path, 'plugin_cached'), module)
+        self.assertEqual(module.VALUE, 2)
+        self.assertIs(sys.modules['plugin_cached'], module)
+
+    def test_reloads_execute_into_the_same_module(self):
+        path = self.plugin('reloaded.py', 'VALUE = 1\nOLD = True\n')
+        module = require.as_module(path, 'plugin_reloaded')
+        self.plugin('reloaded.py', 'VALUE = 22\n')
+        self.assertIs(require.as_module(path, 'plugin_reloaded', reload=True), module)
+        self.assertEqual(module.VALUE, 22)
+        self.assertTrue(module.OLD)
+        module.VALUE = 0
+        require.as_module(path, 'plugin_reloaded', reload=True)
+        self.assertEqual(module.VALUE, 22)
+
+    def test_bytecode_directory(self):
+        bytecode = os.path.join(self.directory, 'bytecode')
+        path = self.plugin('cached.py', 'VALUE = 3\n')
+        require.as_module(path, 'plugin_cached', bytecode)
+        self.assertEqual(len(os.listdir(bytecode)), 1)
+        require._code.clear()
+        self.assertEqual(require.as_module(path, 'plugin_cached', bytecode, reload=True).VALUE, 3)
+
+    def test_compiled_code_is_kept_for_the_current_content_only(self):
+        path = self.plugin('cached.py', 'VALUE = 1\n')
+        for value in range(5):
+            self.plugin('cached.py', 'VALUE = %d\n' % (value + 10))
+            self.assertEqual(require.as_module(path, 'plugin_cached', reload=True).VALUE, value + 10)
+        self.assertEqual([key for key in require._code if key == path], [path])
+
+    def test_caches_are_bounded(self):
+        size, require.CACHE_SIZE = require.CACHE_SIZE, 2
+        try:
+            paths = [self.plugin('cached_%d.py' % index, 'VALUE = %d\n' % index) for index in range(4)]
+            for path in paths:
+                require.as_module(path, 'plugin_cached')
+            self.assertLessEqual(len(require._modules), 2)
+            self.assertLessEqual(len(require._code), 2)
+        finally:
+            require.CACHE_SIZE = size
+
+    def test_locks_are_dropped_once_released(self):
+        paths = [self.plugin('cached_%d.py' % index, 'VALUE = %d\n' % index) for index in range(4)]
+        for path in paths:
+            require.as_module(path, 'plugin_cached')
+        with require._locked(paths[0], 'plugin_cached'):
+            with require.lock:
+                self.assertTrue(require._lock_of(('path', paths[0])).locked())
+                self.assertEqual(len(require._locks), 2)
+        gc.collect()
+        self.assertEqual(len(require._locks), 0)
+
+    def test_loads_under_the_same_name_are_serialized(self):
+        paths = [self.plugin('shared_%d.py' % index, 'import time\nVALUE = %d\ntime.sleep(0.01)\nINSTALLED = '
+                             '__import__("sys").modules["plugin_shared"].VALUE\n' % index) for index in range(4)]
+        errors = []
+
+        def load(path):
+            try:
+                module = require.as_module(path, 'plugin_shared', reload=True)
+                if module.INSTALLED != module.VALUE:
+                    errors.append(path)
+            except Exception as error:
+                errors.append(error)
+
+        workers = [threading.Thread(target=load, args=(path,)) for path in paths * 3]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
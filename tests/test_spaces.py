@@ -0,0 +1,36 @@
+import unittest
+import warnings
+import numpy
+from colormap import spaces
+
+
+class WrapperTest(unittest.TestCase):
+
+    def test_array_conversion(self):
+        wrapper = spaces.HSV(numpy.random.RandomState(0).rand(4, 3))
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertTrue(numpy.shares_memory(numpy.asarray(wrapper), wrapper._))
+            self.assertEqual(numpy.asarray(wrapper, numpy.float32).dtype, numpy.float32)
+            copied = numpy.array(wrapper, copy=True)
+        self.assertIsNot(copied, wrapper._)
+        numpy.testing.assert_array_equal(copied, wrapper._)
+        self.assertIs(wrapper.__array__(copy=False), wrapper._)
+        self.assertIsNot(wrapper.__array__(copy=True), wrapper._)
+        self.assertRaises(ValueError, wrapper.__array__, numpy.float32, False)
+
+
+class ConverterTest(unittest.TestCase):
+
+    def test_converters_write_into_the_output(self):
+        image = numpy.random.RandomState(1).rand(8, 6, 4)
+        for name in ('hsv', 'luv', 'lab', 'xyz', 'hed'):
+            colorspace = getattr(spaces, name)
+            out = numpy.empty_like(image)
+            encoded = colorspace.encoder(image, out)
+            self.assertIs(encoded._, out)
+            numpy.testing.assert_array_equal(out[:, :, 3], image[:, :, 3])
+            numpy.testing.assert_array_equal(out, colorspace.encoder(image)._)
+            decoded = numpy.empty_like(image)
+            self.assertIs(colorspace.decoder(encoded, decoded), decoded)
+            numpy.testing.assert_array_equal(decoded, colorspace.decoder(colorspace.encoder(image)))
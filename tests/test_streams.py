@@ -0,0 +1,51 @@
+import io
+import unittest
+from common.lang import LYFactory
+
+
+class Decimals(LYFactory):
+
+    states = (('comment', 'exclusive'),)
+    t_ignore = ' '
+    t_comment_ignore = ''
+
+    def t_NUMBER(self, t):
+        r'\d+(\.\d+)?'
+        return t
+
+    def t_COMMENT(self, t):
+        r'\#[^\n]*'
+
+    def t_begin_comment(self, t):
+        r'/\*'
+        t.lexer.begin('comment')
+
+    def t_comment_end(self, t):
+        r'\*/'
+        t.lexer.begin('INITIAL')
+
+    def t_comment_text(self, t):
+        r'[^*]+|\*'
+
+    def t_comment_error(self, t):
+        t.lexer.skip(1)
+
+
+class StreamTest(unittest.TestCase):
+
+    def assertStreams(self, text, window, lookahead):
+        factory = Decimals()
+        expected = [(t.type, t.value, t.lexpos, t.lineno) for t in factory.tokenize(text)]
+        streamed = [(t.type, t.value, t.lexpos, t.lineno)
+                    for t in factory.tokenize_stream(io.StringIO(text), window, lookahead)]
+        self.assertEqual(streamed, expected)
+
+    def test_tokens_cut_by_windows(self):
+        text = u' '.join(u'%d.%d' % (index, index * 7) for index in range(200))
+        for window in (1, 2, 3, 5, 8):
+            self.assertStreams(text, window, 10)
+
+    def test_discarded_text_cut_by_windows(self):
+        text = u'12.5 # 34 56\n78 /* 9\n10 */ 11.25\n' * 20
+        for window in (1, 2, 3, 5, 8):
+            self.assertStreams(text, window, 10)
@@ -0,0 +1,92 @@
+import operator
+import unittest
+import numpy
+from colormap import spaces
+from colormap.compiler import compile_expression, fuse
+from colormap.types import IN, IntervalSet
+from .common import band_check
+
+
+def reference(values, ranges):
+    """
+    Checks values against a union of IN ranges, one comparison at a time.
+    """
+
+    result = numpy.zeros(values.shape, dtype=bool)
+    for minv, maxv, strict_min, strict_max in ranges:
+        lower = values > minv if strict_min else values >= minv
+        upper = values < maxv if strict_max else values <= maxv
+        result |= (lower | upper) if minv > maxv else (lower & upper)
+    return result
+
+
+def union(ranges):
+    interval_set = IntervalSet()
+    for interval in ranges:
+        interval_set |= IN(*interval)
+    return interval_set
+
+
+class IntervalSetTest(unittest.TestCase):
+
+    def test_few_intervals(self):
+        values = numpy.random.RandomState(0).rand(50, 40)
+        values[0, :6] = [0.1, 0.2, 0.3, 0.4, 0.7, 0.8]
+        ranges = [(0.1, 0.2, False, True), (0.3, 0.4, True, False), (0.7, 0.8, True, True)]
+        for dtype in (numpy.float64, numpy.float32):
+            cast = values.astype(dtype)
+            numpy.testing.assert_array_equal(union(ranges).contains(cast), reference(cast, ranges))
+            numpy.testing.assert_array_equal(spaces.mask(cast, union(ranges)), reference(cast, ranges))
+
+    def test_many_intervals(self):
+        edges = numpy.linspace(0, 1, 2 * (IntervalSet.SEARCH_INTERVALS + 10))
+        ranges = [(low, high, False, False) for low, high in zip(edges[::2], edges[1::2])]
+        values = numpy.concatenate([numpy.random.RandomState(1).rand(5000), edges])
+        numpy.testing.assert_array_equal(union(ranges).contains(values), reference(values, ranges))
+
+    def test_integer_tables(self):
+        ranges = [(10, 20, False, False), (30, 40, True, True), (250, 255, False, False)]
+        for dtype in (numpy.uint8, numpy.uint16):
+            values = numpy.arange(numpy.iinfo(dtype).max + 1, dtype=dtype)
+            numpy.testing.assert_array_equal(union(ranges).contains(values), reference(values, ranges))
+
+    def test_intersections(self):
+        values = numpy.linspace(0, 1, 1001)
+        checked = (IN(0.1, 0.6) & IN(0.4, 0.9, True)).contains(values)
+        numpy.testing.assert_array_equal(checked, (values >= 0.1) & (values <= 0.6) & (values > 0.4) & (values <= 0.9))
+
+    def test_fused_checks(self):
+        first, second = band_check('hsv', 'h_is', IN(0, 0.1)), band_check('hsv', 'h_is', IN(0.9, 1))
+        for func in (operator.or_, operator.and_):
+            node = ('op', func, (first.node, second.node))
+            fused = fuse(node)
+            self.assertEqual(fused[0], 'call')
+            self.assertIsInstance(fused[2][0][1], IntervalSet)
+            wrapper = spaces.hsv.encoder(numpy.random.RandomState(2).rand(30, 20, 3))
+            hue = wrapper._[..., 0]
+            expected = func((hue >= 0) & (hue <= 0.1), (hue >= 0.9) & (hue <= 1))
+            numpy.testing.assert_array_equal(compile_expression(type(first)(node), 'hsv')(wrapper), expected)
+
+
+class CircularRangeTest(unittest.TestCase):
+
+    def test_circular_ranges_wrap_around(self):
+        values = numpy.linspace(0, 1, 1001)
+        for interval in ((0.9, 0.1, False, False), (0.9, 0.1, True, True), (0.5, 0.5, True, True)):
+            numpy.testing.assert_array_equal(IN(*interval).contains(values), reference(values, [interval]))
+            numpy.testing.assert_array_equal(spaces.mask(values, IN(*interval)), reference(values, [interval]))
+
+    def test_circular_ranges_with_array_bounds(self):
+        values = numpy.linspace(0, 1, 101)
+        minv, maxv = numpy.full(values.shape, 0.9), numpy.full(values.shape, 0.1)
+        maxv[:50] = 0.95
+        expected = numpy.where(numpy.arange(101) < 50, (values >= 0.9) & (values <= 0.95),
+                               (values >= 0.9) | (values <= 0.1))
+        numpy.testing.assert_array_equal(IN(minv, maxv).contains(values), expected)
+
+    def test_circular_hue_checks(self):
+        wrapper = spaces.hsv.encoder(numpy.random.RandomState(3).rand(30, 20, 3))
+        hue, saturation = wrapper._[..., 0], wrapper._[..., 1]
+        numpy.testing.assert_array_equal(wrapper.h_is(IN(0.95, 0.05)), (hue >= 0.95) | (hue <= 0.05))
+        numpy.testing.assert_array_equal(wrapper.hs_is(IN(0.95, 0.05), IN(0.8, 0.2)),
+                                         ((hue >= 0.95) | (hue <= 0.05)) & ((saturation >= 0.8) | (saturation <= 0.2)))
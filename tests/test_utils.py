@@ -0,0 +1,31 @@
+import unittest
+import numpy
+from colormap import spaces
+from colormap.utils import dhist, HistogramAccumulator
+
+
+class DhistTest(unittest.TestCase):
+
+    def test_bins(self):
+        values = numpy.array([0., 0.2, 0.5, 0.99, 1., 1.5, -0.5])
+        numpy.testing.assert_array_equal(dhist(values, 4), [3, 1, 1, 2])
+        numpy.testing.assert_array_equal(dhist(values, 4, True), [3, 0, 1, 3])
+
+    def test_non_finite_values_are_not_counted(self):
+        values = numpy.array([numpy.nan, 0.1, numpy.inf, 0.9, -numpy.inf, numpy.nan], dtype=numpy.float32)
+        numpy.testing.assert_array_equal(dhist(values, 2, True), [1, 1])
+        numpy.testing.assert_array_equal(dhist(values, 2, True, distribution=True), [0.5, 0.5])
+
+
+class HistogramAccumulatorTest(unittest.TestCase):
+
+    def test_streamed_counts_match_a_single_pass(self):
+        image = numpy.random.RandomState(0).rand(60, 50, 4)
+        whole = HistogramAccumulator(spaces.hsv, 32, 4).update(image)
+        streamed = HistogramAccumulator(spaces.hsv, 32, 4)
+        streamed.CHUNK = 97
+        halves = HistogramAccumulator(spaces.hsv, 32, 4).update_many(image[30:, None])
+        streamed.update_many(image[:30, None]).merge(halves)
+        numpy.testing.assert_array_equal(streamed.counts, whole.counts)
+        self.assertEqual(whole.total, 3000)
+        numpy.testing.assert_array_equal(whole.counts.sum(axis=1), [3000] * 4)